@@ -83,6 +83,7 @@ setup(name='superlance',
       fatalmailbatch = superlance.fatalmailbatch:main
       sentryreporter = superlance.sentryreporter:main
       memmon = superlance.memmon:main
+      superlance = superlance.host:main
       """
       )
 
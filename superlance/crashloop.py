@@ -0,0 +1,109 @@
+##############################################################################
+#
+# Copyright (c) 2007 Agendaless Consulting and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the BSD-like license at
+# http://www.repoze.org/LICENSE.txt.  A copy of the license should accompany
+# this distribution.  THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL
+# EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND
+# FITNESS FOR A PARTICULAR PURPOSE
+#
+##############################################################################
+doc = """\
+Crash rates of processes, to tell a process that crashed once from one
+that is crashing over and over.
+"""
+
+import collections
+import time
+
+from supervisor import childutils
+from superlance.compat import monotonic
+
+# what a listener should do about a crash, as returned by
+# CrashLoopTracker.crashed
+CRASH = 'crash' # report it
+LOOP = 'loop' # report that the process is crash looping
+SUPPRESSED = 'suppressed' # part of a loop already reported
+
+THRESHOLD = 5
+WINDOW = 60.0
+
+class CrashLoop:
+    """A process crashing at least `threshold` times in `window` seconds."""
+
+    def __init__(self, namespec, crashes, first, last):
+        self.namespec = namespec
+        self.crashes = crashes
+        self.first = first
+        self.last = last
+        self.last_clock = None
+
+    def get_summary(self):
+        return ('Process %s stopped crash looping: it crashed %d times '
+                'between %s and %s\n' % (
+                    self.namespec, self.crashes,
+                    childutils.get_asctime(self.first),
+                    childutils.get_asctime(self.last)))
+
+class CrashLoopTracker:
+    """Keeps the times of the last `threshold` crashes of each process in
+    a ring.  When a process crashes `threshold` times within `window`
+    seconds, `crashed` returns LOOP once, then SUPPRESSED for each crash
+    until the process has not crashed for `window` seconds; `expire`
+    then returns the CrashLoop, to report a summary.  A `threshold` of 0
+    turns detection off:  every crash is a CRASH.
+
+    Windows are timed with the monotonic `clock`; `time` only gives the
+    times shown in summaries."""
+
+    def __init__(self, threshold=THRESHOLD, window=WINDOW, clock=monotonic,
+                 time=time.time):
+        self.threshold = threshold
+        self.window = window
+        self.clock = clock
+        self.time = time
+        self.crashes = {} # {namespec: deque of (clock, time)}
+        self.loops = {} # {namespec: CrashLoop}
+
+    def crashed(self, namespec):
+        if not self.threshold:
+            return CRASH
+        now = self.clock()
+        when = self.time()
+        loop = self.loops.get(namespec)
+        if loop is not None:
+            loop.crashes += 1
+            loop.last = when
+            loop.last_clock = now
+            return SUPPRESSED
+        crashes = self.crashes.get(namespec)
+        if crashes is None:
+            crashes = collections.deque(maxlen=self.threshold)
+            self.crashes[namespec] = crashes
+        crashes.append((now, when))
+        if (len(crashes) == self.threshold and
+                now - crashes[0][0] <= self.window):
+            loop = CrashLoop(namespec, len(crashes), crashes[0][1], when)
+            loop.last_clock = now
+            self.loops[namespec] = loop
+            del self.crashes[namespec]
+            return LOOP
+        return CRASH
+
+    def expire(self):
+        """Forget crashes older than the window and return the loops that
+        ended, i.e. whose process has not crashed for `window` seconds"""
+        now = self.clock()
+        for namespec, crashes in list(self.crashes.items()):
+            if now - crashes[-1][0] > self.window:
+                del self.crashes[namespec]
+        ended = []
+        for namespec, loop in list(self.loops.items()):
+            if now - loop.last_clock > self.window:
+                del self.loops[namespec]
+                ended.append(loop)
+        ended.sort(key=lambda loop: loop.last_clock)
+        return ended
@@ -28,7 +28,8 @@
 
 doc = """\
 crashmail.py [-p processname] [-a] [-o string] [-m mail_address]
-             [-s sendmail] URL
+             [-s sendmail] [-F] [-l crashes] [-L seconds] [-R ticks] [-G]
+             URL
 
 Options:
 
@@ -47,11 +48,41 @@ Options:
       (e.g. "/usr/sbin/sendmail -t -i").  Must be a command which accepts
       header and message data on stdin and sends mail.  Default is
       "/usr/sbin/sendmail -t -i".
+      Alternatively, an SMTP URL, "smtp://[user:password@]host[:port]
+      [?starttls]" or "smtps://...", sends mail through an SMTP server
+      over one connection kept open between messages.
 
 -m -- specify an email address.  The script will send mail to this
       address when crashmail detects a process crash.  If no email
       address is specified, email will not be sent.
 
+-F -- follow the logs of the processes in memory, so that the last lines
+      mailed are those written just before the crash, even if the log
+      has since been rotated or written to by a restarted instance.
+      Subscribe crashmail to TICK events (e.g. "events=PROCESS_STATE,TICK_5")
+      too: the logs are read on each one.
+
+-l -- the number of crashes of a process within the -L window that make
+      a crash loop (default 5).  The crash that starts a loop is mailed
+      as such, the next ones are not mailed, and a summary is mailed
+      once the process has not crashed for the window.  The summary is
+      only mailed on the next event after that:  subscribe crashmail to
+      TICK events too (e.g. "events=PROCESS_STATE,TICK_60"), or it may
+      wait until the next crash of any process.  0 mails every crash.
+
+-L -- the crash loop window, in seconds (default 60).
+
+-R -- every this many TICK events, fetch the state of all processes and
+      mail the unexpected exits that were not received as events, e.g.
+      because supervisord dropped them.  Subscribe crashmail to TICK
+      events too.  Off by default.
+
+-G -- do not notice the events supervisord dropped (from gaps in the
+      poolserial header), nor fetch the state of all processes then.
+      Gaps are meaningless with several crashmail processes in the pool
+      (numprocs > 1):  gap detection is turned off by itself when the
+      state of all processes shows more than one.
+
 The -p option may be specified more than once, allowing for
 specification of multiple processes.  Specifying -a overrides any
 selection of -p.
@@ -65,17 +96,29 @@ crashmail.py -p program1 -p group1:program2 -m dev@example.com
 import os
 import sys
 
+from superlance.crashloop import (
+    LOOP,
+    SUPPRESSED,
+    THRESHOLD,
+    WINDOW,
+    CrashLoopTracker,
+)
 from superlance.helpers import (
-    get_last_lines_of_process_stderr,
-    get_last_lines_of_process_stdout,
+    LogFollower,
+    format_last_lines_of_process,
 )
+from superlance.listener import EventListener
+from superlance.mailer import get_transport
 from supervisor import childutils
+from supervisor.options import make_namespec
 
 def usage():
     print(doc)
     sys.exit(255)
 
-class CrashMail:
+class CrashMail(EventListener):
+    # the events handled, by prefix, when run by the superlance host
+    listener_events = ('PROCESS_STATE_EXITED', 'TICK')
 
     def __init__(self,
             programs,
@@ -84,7 +127,13 @@ class CrashMail:
             sendmail,
             optionalheader,
             stderr_lines=0,
-            stdout_lines=0):
+            stdout_lines=0,
+            follow_logs=False,
+            loop_threshold=THRESHOLD,
+            loop_window=WINDOW,
+            reconcile_ticks=0,
+            detect_gaps=True):
+        EventListener.__init__(self, reconcile_ticks, detect_gaps)
         self.programs = programs
         self.any = any
         self.email = email
@@ -95,68 +144,106 @@ class CrashMail:
         self.stderr = sys.stderr
         self.stderr_lines = stderr_lines
         self.stdout_lines = stdout_lines
+        self.log_follower = None
+        if follow_logs:
+            self.log_follower = LogFollower(stderr_lines, stdout_lines,
+                                            None if any else programs)
+        self.crash_loops = CrashLoopTracker(loop_threshold, loop_window)
 
     def runforever(self, test=False):
         while 1:
             # we explicitly use self.stdin, self.stdout, and self.stderr
             # instead of sys.* so we can unit test this code
-            headers, payload = childutils.listener.wait(self.stdin, self.stdout)
-
-            if not headers['eventname'] == 'PROCESS_STATE_EXITED':
-                # do nothing with non-TICK events
-                childutils.listener.ok(self.stdout)
-                if test:
-                    self.stderr.write('non-exited event\n')
-                    self.stderr.flush()
-                    break
-                continue
-
-            pheaders, pdata = childutils.eventdata(payload+'\n')
-
-            if int(pheaders['expected']):
-                childutils.listener.ok(self.stdout)
-                if test:
-                    self.stderr.write('expected exit\n')
+            headers, payload = self.wait_for_event()
+            outcome = self.dispatch_event(headers, payload)
+            childutils.listener.ok(self.stdout)
+            if test:
+                if outcome:
+                    self.stderr.write('%s\n' % outcome)
                     self.stderr.flush()
-                    break
-                continue
-
-            msg = ('Process %(processname)s in group %(groupname)s exited '
-                   'unexpectedly (pid %(pid)s) from state %(from_state)s\n\n' %
-                   pheaders)
-
-            if self.stderr_lines:
-                msg += get_last_lines_of_process_stderr(pheaders, self.stderr_lines)
-            if self.stdout_lines:
-                msg += get_last_lines_of_process_stdout(pheaders, self.stdout_lines)
+                break
 
+    def handle_event(self, headers, payload):
+        """Handle an event, returning what was done instead of mailing if
+        nothing was mailed"""
+        for loop in self.crash_loops.expire():
+            self.mail_crash_loop_summary(loop)
+
+        if (self.log_follower is not None and
+                headers['eventname'].startswith('TICK_')):
+            self.log_follower.poll()
+            return 'followed logs'
+
+        if not headers['eventname'] == 'PROCESS_STATE_EXITED':
+            # do nothing with non-TICK events
+            return 'non-exited event'
+
+        pheaders, pdata = childutils.eventdata(payload+'\n')
+
+        if int(pheaders['expected']):
+            return 'expected exit'
+
+        namespec = make_namespec(pheaders['groupname'],
+                                 pheaders['processname'])
+        action = self.crash_loops.crashed(namespec)
+        if action == SUPPRESSED:
+            return 'crash loop, not mailing'
+
+        msg = ('Process %(processname)s in group %(groupname)s exited '
+               'unexpectedly (pid %(pid)s) from state %(from_state)s\n\n' %
+               pheaders)
+        if action == LOOP:
+            msg = ('Process %s in group %s is crash looping: it crashed '
+                   '%d times within %d seconds.  Its next crashes will '
+                   'not be mailed until it has not crashed for %d '
+                   'seconds.\n\n' % (
+                       pheaders['processname'], pheaders['groupname'],
+                       self.crash_loops.threshold,
+                       self.crash_loops.window,
+                       self.crash_loops.window)) + msg
+
+        if self.log_follower is not None:
+            msg += self.log_follower.format_last_lines(pheaders)
+        else:
+            msg += format_last_lines_of_process(
+                pheaders, self.stderr_lines, self.stdout_lines)
+
+        if action == LOOP:
+            subject = ' %s is crash looping at %s' % (
+                pheaders['processname'], childutils.get_asctime())
+        else:
             subject = ' %s crashed at %s' % (pheaders['processname'],
                                              childutils.get_asctime())
-            if self.optionalheader:
-                subject = self.optionalheader + ':' + subject
+        if self.optionalheader:
+            subject = self.optionalheader + ':' + subject
 
-            self.stderr.write('unexpected exit, mailing\n')
-            self.stderr.flush()
+        self.stderr.write('unexpected exit, mailing\n')
+        self.stderr.flush()
 
-            self.mail(self.email, subject, msg)
+        self.mail(self.email, subject, msg)
+        return None
 
-            childutils.listener.ok(self.stdout)
-            if test:
-                break
+    def mail_crash_loop_summary(self, loop):
+        subject = ' %s stopped crash looping at %s' % (
+            loop.namespec, childutils.get_asctime())
+        if self.optionalheader:
+            subject = self.optionalheader + ':' + subject
+        self.stderr.write('crash loop ended, mailing\n')
+        self.stderr.flush()
+        self.mail(self.email, subject, loop.get_summary())
 
     def mail(self, email, subject, msg):
         body =  'To: %s\n' % self.email
         body += 'Subject: %s\n' % subject
         body += '\n'
         body += msg
-        with os.popen(self.sendmail, 'w') as m:
-            m.write(body)
+        get_transport(self.sendmail).send(body)
         self.stderr.write('Mailed:\n\n%s' % body)
         self.mailed = body
 
-def main(argv=sys.argv):
+def crashmail_from_args(arguments):
     import getopt
-    short_args="hp:ao:s:m:q:w:"
+    short_args="hp:ao:s:m:q:w:Fl:L:R:G"
     long_args=[
         "help",
         "program=",
@@ -165,13 +252,17 @@ def main(argv=sys.argv):
         "sendmail_program=",
         "email=",
         "stderr_lines=",
-        "stdout_lines="
+        "stdout_lines=",
+        "follow_logs",
+        "loop_threshold=",
+        "loop_window=",
+        "reconcile_ticks=",
+        "no_gap_detection",
         ]
-    arguments = argv[1:]
     try:
         opts, args = getopt.getopt(arguments, short_args, long_args)
     except:
-        usage()
+        return None
 
     programs = []
     any = False
@@ -180,11 +271,16 @@ def main(argv=sys.argv):
     optionalheader = None
     stderr_lines = 10
     stdout_lines = 10
+    follow_logs = False
+    loop_threshold = THRESHOLD
+    loop_window = WINDOW
+    reconcile_ticks = 0
+    detect_gaps = True
 
     for option, value in opts:
 
         if option in ('-h', '--help'):
-            usage()
+            return None
 
         if option in ('-p', '--program'):
             programs.append(value)
@@ -207,13 +303,38 @@ def main(argv=sys.argv):
         if option in ('-t', '--stdout_lines'):
             stdout_lines = int(value)
 
+        if option in ('-F', '--follow_logs'):
+            follow_logs = True
+
+        if option in ('-l', '--loop_threshold'):
+            loop_threshold = int(value)
+
+        if option in ('-L', '--loop_window'):
+            loop_window = float(value)
+
+        if option in ('-R', '--reconcile_ticks'):
+            reconcile_ticks = int(value)
+
+        if option in ('-G', '--no_gap_detection'):
+            detect_gaps = False
+
+    return CrashMail(programs, any, email, sendmail, optionalheader,
+                     stderr_lines, stdout_lines, follow_logs,
+                     loop_threshold, loop_window, reconcile_ticks,
+                     detect_gaps)
+
+def main(argv=sys.argv):
+    prog = crashmail_from_args(argv[1:])
+    if prog is None:
+        # something went wrong or -h has been given
+        usage()
+
     if not 'SUPERVISOR_SERVER_URL' in os.environ:
         sys.stderr.write('crashmail must be run as a supervisor event '
                          'listener\n')
         sys.stderr.flush()
         return
 
-    prog = CrashMail(programs, any, email, sendmail, optionalheader, stderr_lines, stdout_lines)
     prog.runforever()
 
 if __name__ == '__main__':
@@ -79,6 +79,9 @@ class CrashSMS(ProcessStateEmailMonitor):
       % pheaders
     return '%s %s' % (txt, childutils.get_asctime(self.now))
 
+def crashsms_from_args(arguments):
+  return CrashSMS.create_from_args(arguments)
+
 def main():
   crash = CrashSMS.create_from_cmd_line()
   crash.run()
@@ -34,6 +34,7 @@ fatalmailbatch.py [--interval=<batch interval in minutes>]
         [--password=<smtp server password]
         [--stderr_lines=<number of stderr lines to report>]
         [--stdout_lines=<number of stdout lines to report>]
+        [--followLogs]
 
 Options:
 
@@ -51,6 +52,29 @@ Options:
 
 --stdout_lines - number of stdout lines to report in the alert
 
+--maxBatchMsgs - send the batch as soon as it holds this many messages
+
+--maxBatchBytes - send the batch as soon as its messages add up to this many
+                  bytes
+
+--followLogs - follow the logs of all processes in memory on each TICK event,
+               so that the lines reported are those written just before
+               the event, even if the log has since been rotated
+
+--immediateEvents - comma separated events sent at once, each in an email of
+                    its own, rather than batched (e.g. FATAL)
+
+--reconcileTicks - every this many TICK events, report the process state
+                   changes found in the state of all processes that were
+                   not received as events
+
+--noGapDetection - do not notice the events supervisord dropped, from gaps
+                   in the poolserial header;  turned off by itself when
+                   the listener pool has several processes (numprocs > 1)
+
+--spoolDir - keep batched messages and unsent emails in a journal in this
+             directory until they are sent, so that a restart loses nothing
+
 A sample invocation:
 
 fatalmailbatch.py --toEmail="you@bar.com" --fromEmail="me@bar.com"
@@ -58,15 +82,12 @@ fatalmailbatch.py --toEmail="you@bar.com" --fromEmail="me@bar.com"
 """
 
 from supervisor import childutils
-from superlance.helpers import (
-    get_last_lines_of_process_stderr,
-    get_last_lines_of_process_stdout,
-)
 from superlance.process_state_email_monitor import ProcessStateEmailMonitor
 
 class FatalMailBatch(ProcessStateEmailMonitor):
 
     event_label = 'FATAL'
+    group_by_process = True
     process_state_events = ['PROCESS_STATE_FATAL']
 
     def __init__(self, **kwargs):
@@ -79,11 +100,14 @@ class FatalMailBatch(ProcessStateEmailMonitor):
 
         txt = 'Process %(groupname)s:%(processname)s failed to start too many \
 times\n' % pheaders
-        if self.stderr_lines:
-            txt += get_last_lines_of_process_stderr(pheaders, self.stderr_lines)
-        if self.stdout_lines:
-            txt += get_last_lines_of_process_stdout(pheaders, self.stdout_lines)
-        return '%s -- %s' % (childutils.get_asctime(self.now), txt)
+        return '%s -- %s' % (childutils.get_asctime(self.get_event_time()),
+                             txt)
+
+    def get_event_time(self):
+        return self.now or ProcessStateEmailMonitor.get_event_time(self)
+
+def fatalmailbatch_from_args(arguments):
+    return FatalMailBatch.create_from_args(arguments)
 
 def main():
     fatal = FatalMailBatch.create_from_cmd_line()
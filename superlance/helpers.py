@@ -1,15 +1,96 @@
+import collections
+import fnmatch
+import mmap
 import os
-from supervisor import childutils
+import re
+from supervisor.options import make_namespec
+from superlance.compat import xmlrpclib
+from superlance.rpc import get_rpc_interface
 
 
 __all__ = [
+    'LogFollower',
+    'ProgramMatcher',
+    'clear_logfile_cache',
+    'forget_logfiles',
+    'format_last_lines',
+    'format_last_lines_of_process',
+    'get_last_lines_of_process',
+    'get_last_lines_of_processes',
+    'read_last_lines',
     'get_last_lines_of_process_stderr',
     'get_last_lines_of_process_stdout',
     'get_last_lines_of_process_stderr_unwrapped',
     'get_last_lines_of_process_stdout_unwrapped',
 ]
 
-MAX_BYTES_TO_READ = 1024 * 50 # 50kb
+INITIAL_BYTES_TO_READ = 1024 * 2 # 2kb
+MAX_BYTES_TO_READ = 1024 * 1024 # 1mb
+FOLLOW_BYTES_TO_READ = 1024 * 64 # 64kb
+
+
+class LogTail:
+    """Collects the last `lines` lines of a process log through the
+    supervisor tail/read RPC methods.
+
+    The first request tails a small window of the log.  While the bytes
+    read hold fewer complete lines than wanted, the window is doubled by
+    reading the bytes just before it, until the start of the log or
+    `limit` bytes are reached.  Requests are handed out one at a time
+    (`request`/`feed`) so that several tails can share RPC round trips.
+    """
+
+    def __init__(self, proc_name, lines,
+                 window=INITIAL_BYTES_TO_READ, limit=MAX_BYTES_TO_READ):
+        self.proc_name = proc_name
+        self.lines = lines
+        self.limit = limit
+        self.window = min(window, limit)
+        self.chunks = [] # newest first
+        self.newlines = 0
+        self.start = None # log offset of the oldest byte read
+        self.done = False
+
+    def request(self):
+        """Return the next call to make as a ('tail', args) or
+        ('read', args) pair, or None once enough has been read."""
+        if self.done:
+            return None
+        if self.start is None:
+            return 'tail', (self.proc_name, 0, self.window)
+        window = min(self.window * 2, self.limit)
+        offset = max(0, self.start - (window - self.window))
+        return 'read', (self.proc_name, offset, self.start - offset)
+
+    def feed(self, result):
+        """Feed the result of the call returned by `request`."""
+        if self.start is None:
+            data, end, overflow = result
+            if overflow:
+                self.start = end - self.window
+            else:
+                self.start = 0
+        else:
+            kind, (proc_name, offset, length) = self.request()
+            data = result
+            self.start = offset
+            self.window += length
+        self.chunks.append(data)
+        self.newlines += data.count('\n')
+        if (self.newlines > self.lines or self.start <= 0 or
+                self.window >= self.limit or not data):
+            self.done = True
+
+    def result(self):
+        data = ''.join(reversed(self.chunks))
+        # keep what follows the (lines + 1)th newline from the end, so
+        # that the first line returned is complete
+        pos = len(data)
+        for i in range(self.lines + 1):
+            pos = data.rfind('\n', 0, pos)
+            if pos == -1:
+                return data
+        return data[pos + 1:]
 
 
 def get_last_lines(proc_name, get_last_bytes_func, read_bytes_func, lines):
@@ -17,11 +98,70 @@ def get_last_lines(proc_name, get_last_bytes_func, read_bytes_func, lines):
     Read last @lines from process @proc_name,
     using @get_last_bytes_func and @read_bytes_func.
 
-    This function reads at most `MAX_BYTES_TO_READ` bytes, currently 50KB
+    This function starts with `INITIAL_BYTES_TO_READ` bytes and reads
+    further back only if needed, reading at most `MAX_BYTES_TO_READ`
+    bytes, currently 1MB.
     """
-    bytes, offset, _ = get_last_bytes_func(proc_name, 0, MAX_BYTES_TO_READ)
-    last_lines = bytes.split('\n')
-    return '\n'.join(last_lines[-lines - 1:])
+    tail = LogTail(proc_name, lines)
+    request = tail.request()
+    while request is not None:
+        kind, args = request
+        if kind == 'tail':
+            tail.feed(get_last_bytes_func(*args))
+        else:
+            tail.feed(read_bytes_func(*args))
+        request = tail.request()
+    return tail.result()
+
+
+class ProgramMatcher:
+    """Matches supervisor processes against program specs given on the
+    command line:  process names, group:process namespecs, or
+    shell-style patterns of either (e.g. "web*" or "workers:*").  The
+    specs are compiled once, so matching a process costs a set lookup
+    or two and a single regex match, however many specs there are."""
+
+    def __init__(self, specs):
+        self.specs = list(specs)
+        self.names = set()
+        self.patterns = []
+        for spec in self.specs:
+            if _is_pattern(spec):
+                self.patterns.append(
+                    (spec, re.compile(fnmatch.translate(spec))))
+            else:
+                self.names.add(spec)
+        self.regex = None
+        if self.patterns:
+            self.regex = re.compile('|'.join(
+                ['(?:%s)' % regex.pattern for spec, regex in self.patterns]))
+
+    def matches(self, group, name):
+        """Return True if the process matches any spec."""
+        namespec = make_namespec(group, name)
+        if name in self.names or namespec in self.names:
+            return True
+        if self.regex is not None:
+            return bool(self.regex.match(name) or
+                        self.regex.match(namespec))
+        return False
+
+    def matching_specs(self, group, name):
+        """Return the list of specs that match the process."""
+        namespec = make_namespec(group, name)
+        found = [key for key in set([name, namespec]) if key in self.names]
+        if self.regex is not None and (self.regex.match(name) or
+                                       self.regex.match(namespec)):
+            found.extend([spec for spec, regex in self.patterns
+                          if regex.match(name) or regex.match(namespec)])
+        return found
+
+
+def _is_pattern(spec):
+    for char in '*?[':
+        if char in spec:
+            return True
+    return False
 
 
 def get_proc_name(pheaders):
@@ -31,39 +171,413 @@ def get_proc_name(pheaders):
         return pheaders['processname']
 
 
+# One stream at a time, each in a round trip of its own:  kept for
+# compatibility.  get_last_lines_of_process and
+# format_last_lines_of_process read both streams at once.
 def get_last_lines_of_process_stderr_unwrapped(pheaders, stderr_lines):
-    rpc = childutils.getRPCInterface(os.environ)
-    proc_name = get_proc_name(pheaders)
-    result = get_last_lines(
-        proc_name,
-        rpc.supervisor.tailProcessStderrLog,
-        rpc.supervisor.readProcessStderrLog,
-        stderr_lines)
-    return result
+    return get_last_lines_of_process(pheaders, stderr_lines, 0)[0]
 
 
 def get_last_lines_of_process_stderr(pheaders, stderr_lines):
     last_lines = get_last_lines_of_process_stderr_unwrapped(pheaders, stderr_lines)
-    result = '-------LAST LINES OF STDERR---------\n'
-    result += last_lines
-    result += '-----------------END----------------\n'
-    return result
+    return _wrap_last_lines('STDERR', last_lines)
 
 
 def get_last_lines_of_process_stdout_unwrapped(pheaders, stdout_lines):
-    rpc = childutils.getRPCInterface(os.environ)
-    proc_name = get_proc_name(pheaders)
-    result = get_last_lines(
-        proc_name,
-        rpc.supervisor.tailProcessStdoutLog,
-        rpc.supervisor.readProcessStdoutLog,
-        stdout_lines)
-    return result
+    return get_last_lines_of_process(pheaders, 0, stdout_lines)[1]
 
 
 def get_last_lines_of_process_stdout(pheaders, stdout_lines):
     last_lines = get_last_lines_of_process_stdout_unwrapped(pheaders, stdout_lines)
-    result = '-------LAST LINES OF STDOUT---------\n'
+    return _wrap_last_lines('STDOUT', last_lines)
+
+
+def _wrap_last_lines(stream, last_lines):
+    result = '-------LAST LINES OF %s---------\n' % stream
     result += last_lines
     result += '-----------------END----------------\n'
     return result
+
+
+def get_last_lines_of_processes(pheaders_list, stderr_lines, stdout_lines):
+    """\
+    Read the last @stderr_lines of stderr and @stdout_lines of stdout of
+    every process in @pheaders_list, returning a (stderr, stdout) pair
+    for each (empty for a stream when its line count is 0).
+
+    Logs are read straight from their files when this process can read
+    them (supervisord runs its listeners on its own host), using the
+    paths from supervisor.getProcessInfo, fetched once per process.  The
+    rest are read through RPC:  each round of reads is a single
+    system.multicall, so a tail that fits in the first window, the usual
+    case, costs one round trip for all the processes and both streams.
+    A log that could not be read locally is read through RPC from then
+    on, until its paths are forgotten (see `forget_logfiles`).
+    """
+    rpc = get_rpc_interface()
+    proc_names = [get_proc_name(pheaders) for pheaders in pheaders_list]
+    streams = (('Stderr', stderr_lines), ('Stdout', stdout_lines))
+    if stderr_lines or stdout_lines:
+        _cache_logfiles(rpc, proc_names)
+
+    texts = []
+    pending = []
+    for proc_name in proc_names:
+        for stream, lines in streams:
+            text = ''
+            if lines:
+                path = _logfiles.get(proc_name, {}).get(stream)
+                text = _read_local_last_lines(path, lines)
+                if text is None:
+                    if path:
+                        # e.g. the listener runs as another user:  don't
+                        # try again
+                        _logfiles[proc_name][stream] = ''
+                    pending.append((len(texts), stream,
+                                    LogTail(proc_name, lines)))
+            texts.append(text)
+
+    tails = pending
+    while pending:
+        calls = []
+        for index, stream, tail in pending:
+            kind, args = tail.request()
+            calls.append({
+                'methodName': 'supervisor.%sProcess%sLog' % (kind, stream),
+                'params': list(args),
+                })
+        results = rpc.system.multicall(calls)
+        for (index, stream, tail), result in zip(pending, results):
+            tail.feed(_multicall_result(result))
+        pending = [(index, stream, tail) for index, stream, tail in pending
+                   if tail.request() is not None]
+    for index, stream, tail in tails:
+        texts[index] = tail.result()
+
+    return [tuple(texts[i:i + 2]) for i in range(0, len(texts), 2)]
+
+
+def get_last_lines_of_process(pheaders, stderr_lines, stdout_lines):
+    """Return (stderr, stdout), the last lines of one process's logs,
+    read in a single round trip when possible."""
+    return get_last_lines_of_processes(
+        [pheaders], stderr_lines, stdout_lines)[0]
+
+
+def read_last_lines(path, lines, limit=MAX_BYTES_TO_READ):
+    """\
+    Read the last @lines lines of the file at @path, looking at most
+    @limit bytes back from its end.  Returns the same text as
+    `get_last_lines` would for the same log read through RPC.  Raises
+    EnvironmentError if the file can't be read.
+    """
+    f = open(path, 'rb')
+    try:
+        if os.fstat(f.fileno()).st_size == 0:
+            return ''
+        m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    finally:
+        f.close()
+    try:
+        end = len(m)
+        start = max(0, end - limit)
+        pos = end
+        for i in range(lines + 1):
+            pos = m.rfind(b'\n', start, pos)
+            if pos == -1:
+                pos = start - 1
+                break
+        data = m[pos + 1:end]
+    finally:
+        m.close()
+    if not isinstance(data, str):
+        data = data.decode('utf-8', 'replace')
+    return data
+
+
+# {namespec: {'Stderr': path, 'Stdout': path}} from supervisor.getProcessInfo
+_logfiles = {}
+
+def clear_logfile_cache():
+    """Forget the log file paths cached by `get_last_lines_of_processes`,
+    e.g. after supervisord has reloaded its configuration."""
+    _logfiles.clear()
+
+
+def forget_logfiles(proc_names):
+    """Forget the log file paths cached for the processes named, e.g.
+    because they were removed from the configuration."""
+    for proc_name in proc_names:
+        _logfiles.pop(proc_name, None)
+
+
+def _cache_logfiles(rpc, proc_names):
+    missing = []
+    for proc_name in proc_names:
+        if proc_name not in _logfiles and proc_name not in missing:
+            missing.append(proc_name)
+    if not missing:
+        return
+    calls = [{'methodName': 'supervisor.getProcessInfo',
+              'params': [proc_name]} for proc_name in missing]
+    for proc_name, result in zip(missing, rpc.system.multicall(calls)):
+        if isinstance(result, dict):
+            # a fault; reading the log through RPC will report it
+            continue
+        info = result[0]
+        _logfiles[proc_name] = {
+            'Stderr': info.get('stderr_logfile', ''),
+            'Stdout': info.get('stdout_logfile', ''),
+            }
+
+
+def _read_local_last_lines(path, lines):
+    """Return the last lines of the log at path, or None if the log
+    has to be read through RPC instead."""
+    if not path:
+        return None
+    try:
+        return read_last_lines(path, lines)
+    except (EnvironmentError, ValueError):
+        return None
+
+
+def _multicall_result(result):
+    if isinstance(result, dict):
+        raise xmlrpclib.Fault(result['faultCode'], result['faultString'])
+    return result[0]
+
+
+class LogRing:
+    """The last `maxlines` lines of one log of a process, kept up to date
+    by reading what was written to the log since the previous poll.
+
+    The first poll tails `window` bytes of the log.  The next ones ask
+    for the size of the log (a tail of no bytes) and read at most
+    `window` bytes from the offset reached, both in one round trip.
+    Only when more than `window` bytes were written, or the log was
+    truncated, does a second round trip fetch the end of the log.  A
+    poll is started with `calls`, and `feed` returns the calls still to
+    make, so that several rings can share round trips."""
+
+    def __init__(self, proc_name, stream, maxlines,
+                 window=FOLLOW_BYTES_TO_READ):
+        self.proc_name = proc_name
+        self.stream = stream
+        self.window = window
+        self.lines = collections.deque(maxlen=maxlines)
+        self.partial = b'' # undecoded bytes after the last newline
+        self.offset = None
+        self.pending = None # what the calls handed out are for
+
+    def calls(self):
+        """Return the calls starting a poll."""
+        if self.offset is None:
+            self.pending = 'start'
+            return [self._call('tail', 0, self.window)]
+        self.pending = 'follow'
+        return [self._call('tail', self.offset, 0),
+                self._call('read', self.offset, self.window)]
+
+    def feed(self, results):
+        """Feed the multicall results of the calls handed out; return the
+        calls still to make to finish the poll."""
+        pending, self.pending = self.pending, None
+        for result in results:
+            if isinstance(result, dict):
+                # a fault, e.g. NO_FILE for a stderr redirected to
+                # stdout, leaves the ring as it was
+                return []
+        results = [result[0] for result in results]
+        if pending == 'follow':
+            size = results[0][1]
+            if size < self.offset:
+                # the log was rotated, or truncated by a restarted
+                # instance:  keep the lines written before, which are
+                # what a crash report wants, and add the new log's
+                self.end_line()
+                self.offset = 0
+                if size <= self.window:
+                    self.pending = 'read'
+                    return [self._call('read', 0, self.window)]
+                self.pending = 'restart'
+                return [self._call('tail', 0, self.window)]
+            if size - self.offset > self.window:
+                # more was written than one window holds:  the end of
+                # the log is all we will know
+                self.pending = 'start'
+                return [self._call('tail', 0, self.window)]
+            data = _as_bytes(results[1])
+            self.offset += len(data)
+        elif pending == 'read':
+            data = _as_bytes(results[0])
+            self.offset = len(data)
+        else:
+            data, size, overflow = results[0]
+            data = _as_bytes(data)
+            if pending == 'start':
+                self.lines.clear()
+                self.partial = b''
+            self.offset = size
+        self.append(data)
+        return []
+
+    def append(self, data):
+        self.partial += data
+        lines = self.partial.split(b'\n')
+        self.partial = lines.pop()
+        for line in lines[-self.lines.maxlen:]:
+            self.lines.append(line + b'\n')
+
+    def end_line(self):
+        if self.partial:
+            self.lines.append(self.partial + b'\n')
+            self.partial = b''
+
+    def text(self):
+        lines = list(self.lines)
+        if self.partial:
+            lines.append(self.partial)
+        if self.lines.maxlen:
+            lines = lines[-self.lines.maxlen:]
+        else:
+            lines = []
+        data = b''.join(lines)
+        if not isinstance(data, str):
+            data = data.decode('utf-8', 'replace')
+        return data
+
+    def _call(self, kind, offset, length):
+        return {'methodName': 'supervisor.%sProcess%sLog' % (kind,
+                                                             self.stream),
+                'params': [self.proc_name, offset, length]}
+
+
+def _as_bytes(data):
+    # offsets in logs count bytes; the RPC methods return text
+    if not isinstance(data, bytes):
+        data = data.encode('utf-8')
+    return data
+
+
+class LogFollower:
+    """Keeps the last lines of the stderr and stdout logs of processes in
+    memory, so that they are at hand when a process crashes, even if its
+    log has since been rotated or overwritten by a restarted instance.
+
+    Call `poll` regularly (e.g. on each TICK event) to follow the logs
+    of the processes matching `programs` (all processes if not given);
+    each poll is a single system.multicall, unless a log was truncated or
+    grew by more than `window` bytes.  `get_last_lines` then polls
+    the logs of just the one process and returns what is in memory.
+    """
+
+    def __init__(self, stderr_lines, stdout_lines, programs=None,
+                 window=FOLLOW_BYTES_TO_READ):
+        self.stderr_lines = stderr_lines
+        self.stdout_lines = stdout_lines
+        self.matcher = None
+        if programs:
+            self.matcher = ProgramMatcher(programs)
+        self.window = window
+        self.rings = {} # {namespec: [stderr ring, stdout ring]}
+
+    def poll(self):
+        """Read what was written to the followed logs, and start
+        following new processes."""
+        [result] = self._follow(self._rings(), [
+            {'methodName': 'supervisor.getAllProcessInfo', 'params': []}])
+        infos = _multicall_result(result)
+        names = set()
+        for info in infos:
+            if (self.matcher is not None and
+                    not self.matcher.matches(info['group'], info['name'])):
+                continue
+            name = make_namespec(info['group'], info['name'])
+            names.add(name)
+            if name not in self.rings:
+                self.rings[name] = [
+                    LogRing(name, 'Stderr', self.stderr_lines, self.window),
+                    LogRing(name, 'Stdout', self.stdout_lines, self.window),
+                    ]
+        for name in list(self.rings):
+            if name not in names:
+                del self.rings[name]
+
+    def get_last_lines(self, pheaders):
+        """Return (stderr, stdout), the last lines of the logs of the
+        process in pheaders, like `get_last_lines_of_process`."""
+        proc_name = make_namespec(pheaders['groupname'],
+                                  pheaders['processname'])
+        if proc_name not in self.rings:
+            return get_last_lines_of_process(pheaders, self.stderr_lines,
+                                             self.stdout_lines)
+        rings = self._rings([proc_name])
+        if rings:
+            self._follow(rings)
+        stderr, stdout = self.rings[proc_name]
+        return stderr.text(), stdout.text()
+
+    def format_last_lines(self, pheaders):
+        """Like `format_last_lines_of_process`."""
+        if not (self.stderr_lines or self.stdout_lines):
+            return ''
+        stderr, stdout = self.get_last_lines(pheaders)
+        return format_last_lines(stderr, stdout, self.stderr_lines,
+                                 self.stdout_lines)
+
+    def _rings(self, names=None):
+        if names is None:
+            names = sorted(self.rings)
+        rings = []
+        for name in names:
+            rings.extend([ring for ring in self.rings[name]
+                          if ring.lines.maxlen])
+        return rings
+
+    def _follow(self, rings, calls=()):
+        """Poll rings, in as few multicalls as possible.  The other
+        calls are made in the first one; return their results."""
+        rpc = get_rpc_interface()
+        calls = list(calls)
+        results = None
+        pending = [(ring, ring.calls()) for ring in rings]
+        while results is None or pending:
+            index = len(calls)
+            for ring, ring_calls in pending:
+                calls.extend(ring_calls)
+            round_results = rpc.system.multicall(calls)
+            if results is None:
+                results = round_results[:index]
+            followups = []
+            for ring, ring_calls in pending:
+                ring_results = round_results[index:index + len(ring_calls)]
+                index += len(ring_calls)
+                ring_calls = ring.feed(ring_results)
+                if ring_calls:
+                    followups.append((ring, ring_calls))
+            pending = followups
+            calls = []
+        return results
+
+
+def format_last_lines_of_process(pheaders, stderr_lines, stdout_lines):
+    """Return the last lines of the stderr and stdout logs of a process
+    as text for a notification, each log between a header and a footer
+    line, omitting a log when its line count is 0."""
+    if not (stderr_lines or stdout_lines):
+        return ''
+    stderr, stdout = get_last_lines_of_process(
+        pheaders, stderr_lines, stdout_lines)
+    return format_last_lines(stderr, stdout, stderr_lines, stdout_lines)
+
+
+def format_last_lines(stderr, stdout, stderr_lines, stdout_lines):
+    """Format the last lines of the stderr and stdout logs of a process
+    as `format_last_lines_of_process` does."""
+    result = ''
+    if stderr_lines:
+        result += _wrap_last_lines('STDERR', stderr)
+    if stdout_lines:
+        result += _wrap_last_lines('STDOUT', stdout)
+    return result
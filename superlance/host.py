@@ -0,0 +1,213 @@
+#!/usr/bin/env python -u
+##############################################################################
+#
+# Copyright (c) 2007 Agendaless Consulting and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the BSD-like license at
+# http://www.repoze.org/LICENSE.txt.  A copy of the license should accompany
+# this distribution.  THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL
+# EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND
+# FITNESS FOR A PARTICULAR PURPOSE
+#
+##############################################################################
+
+# An event listener that runs several superlance plugins in one process,
+# sharing one connection to supervisord and one snapshot of the state of
+# all processes per event between them.
+
+# A supervisor config snippet that tells supervisor to use this script
+# as a listener is below.
+#
+# [eventlistener:superlance]
+# command=superlance "crashmail -a -m dev@example.com"
+#                    "memmon -a 200MB -m dev@example.com"
+#                    "httpok -p web http://localhost:8080/"
+# events=PROCESS_STATE,TICK_60
+
+doc = """\
+superlance "plugin [options]" ["plugin [options]" ...]
+
+Runs each plugin given, with its options as on its own command line, in
+one event listener.  Each event is passed to the plugins that handle it,
+in order, and acknowledged once they all did.  The plugins are:
+
+memmon, httpok, crashmail, crashmailbatch, fatalmailbatch, crashsms,
+sentryreporter
+
+Subscribe the listener to the events all the plugins need, e.g.
+"events=PROCESS_STATE,PROCESS_GROUP,TICK_60":  on PROCESS_GROUP events,
+the log file paths of the processes are fetched again, in case their
+configuration changed.  httpok checks its URL on TICK events:
+its -i and -j options are ignored.  A plugin raising an error while
+handling an event is logged and does not stop the others.
+
+A sample invocation:
+
+superlance "crashmail -a -m dev@example.com" "memmon -a 200MB"
+"""
+
+import os
+import shlex
+import signal
+import sys
+import traceback
+
+from supervisor import childutils
+from superlance.helpers import clear_logfile_cache
+from superlance.listener import PoolSerialTracker
+from superlance.rpc import get_rpc_interface
+
+# plugin name: (module, factory), imported only if the plugin is used
+PLUGINS = {
+    'memmon': ('superlance.memmon', 'memmon_from_args'),
+    'httpok': ('superlance.httpok', 'httpok_from_args'),
+    'crashmail': ('superlance.crashmail', 'crashmail_from_args'),
+    'crashmailbatch': ('superlance.crashmailbatch',
+                       'crashmailbatch_from_args'),
+    'fatalmailbatch': ('superlance.fatalmailbatch',
+                       'fatalmailbatch_from_args'),
+    'crashsms': ('superlance.crashsms', 'crashsms_from_args'),
+    'sentryreporter': ('superlance.sentryreporter',
+                       'sentryreporter_from_args'),
+}
+
+def usage():
+    print(doc)
+    sys.exit(255)
+
+def load_plugin(spec):
+    """Return (name, plugin) for a plugin spec, 'name [options]'."""
+    args = shlex.split(spec)
+    if not args or args[0] not in PLUGINS:
+        raise ValueError('Unknown plugin %r' % spec)
+    modulename, factoryname = PLUGINS[args[0]]
+    module = __import__(modulename, globals(), locals(), [factoryname])
+    plugin = getattr(module, factoryname)(args[1:])
+    if plugin is None:
+        raise ValueError('Bad options for plugin %r' % spec)
+    return args[0], plugin
+
+class ListenerHost:
+
+    def __init__(self, plugins, rpc=None):
+        self.plugins = plugins # [(name, plugin)]
+        self.rpc = rpc
+        self.pool_serials = PoolSerialTracker()
+        self.stdin = sys.stdin
+        self.stdout = sys.stdout
+        self.stderr = sys.stderr
+        for name, plugin in plugins:
+            if rpc is not None and hasattr(plugin, 'rpc'):
+                plugin.rpc = rpc
+            if getattr(plugin, 'interval', None) and name == 'httpok':
+                self.write_stderr('httpok checks on TICK events when run '
+                                  'by superlance, ignoring -i\n')
+                plugin.interval = None
+        if rpc is not None:
+            rpc.cache_snapshot = True
+
+    def runforever(self, test=False):
+        signal.signal(signal.SIGTERM, self._exit_on_signal)
+        self.start()
+        try:
+            while 1:
+                headers, payload = childutils.listener.wait(self.stdin,
+                                                            self.stdout)
+                self.handle_event(headers, payload)
+                childutils.listener.ok(self.stdout)
+                if test:
+                    break
+        finally:
+            self.stop()
+
+    def _exit_on_signal(self, signum, frame):
+        # unwind runforever() so that plugins are stopped
+        sys.exit(0)
+
+    def start(self):
+        for name, plugin in self.plugins:
+            if hasattr(plugin, 'make_connection'):
+                # fail early on a bad httpok URL
+                plugin.make_connection()
+            if hasattr(plugin, 'start'):
+                plugin.start()
+
+    def stop(self):
+        for name, plugin in self.plugins:
+            if hasattr(plugin, 'stop'):
+                self.call_plugin(name, plugin.stop)
+
+    def handle_event(self, headers, payload):
+        if self.rpc is not None:
+            # one snapshot of the processes for all plugins
+            self.rpc.invalidate_snapshot()
+        missed = 0
+        if self.detect_gaps():
+            missed = self.pool_serials.check(headers)
+        if missed:
+            self.write_stderr('Missed %d events before event %s (%d missed '
+                              'in all), reconciling\n' % (
+                                  missed, headers['poolserial'],
+                                  self.pool_serials.dropped))
+        eventname = headers['eventname']
+        if eventname.startswith('PROCESS_GROUP'):
+            # the processes added may log to other files
+            clear_logfile_cache()
+        for name, plugin in self.plugins:
+            if missed and getattr(plugin, 'detect_gaps', False):
+                self.call_plugin(name, plugin.reconcile)
+            if hasattr(plugin, 'dispatch_event'):
+                # every process state event, not only those handled:
+                # reconciling tells restarts from crashes by the
+                # PROCESS_STATE_STOPPING and STOPPED events
+                if (eventname.startswith(plugin.listener_events) or
+                        eventname.startswith('PROCESS_STATE')):
+                    self.call_plugin(name, plugin.dispatch_event, headers,
+                                     payload)
+            elif eventname.startswith(plugin.listener_events):
+                self.call_plugin(name, plugin.handle_event, headers, payload)
+
+    def detect_gaps(self):
+        # the plugins turn it off for listener pools of several processes
+        for name, plugin in self.plugins:
+            if getattr(plugin, 'detect_gaps', False):
+                return True
+        return False
+
+    def call_plugin(self, name, method, *args):
+        try:
+            method(*args)
+        except Exception:
+            self.write_stderr('Error in plugin %s:\n%s' % (
+                name, traceback.format_exc()))
+
+    def write_stderr(self, msg):
+        self.stderr.write(msg)
+        self.stderr.flush()
+
+def main(argv=sys.argv):
+    specs = argv[1:]
+    if not specs or specs[0] in ('-h', '--help'):
+        usage()
+
+    if not 'SUPERVISOR_SERVER_URL' in os.environ:
+        sys.stderr.write('superlance must be run as a supervisor event '
+                         'listener\n')
+        sys.stderr.flush()
+        return
+
+    plugins = []
+    for spec in specs:
+        try:
+            plugins.append(load_plugin(spec))
+        except ValueError as e:
+            sys.stderr.write('%s\n' % e)
+            usage()
+
+    host = ListenerHost(plugins, get_rpc_interface(os.environ))
+    host.runforever()
+
+if __name__ == '__main__':
+    main()
@@ -25,8 +25,10 @@
 # events=TICK_60
 
 doc = """\
-httpok.py [-p processname] [-a] [-g] [-t timeout] [-c status_code] [-b inbody]
-          [-m mail_address] [-s sendmail] URL
+httpok.py [-p processname] [-a] [-g] [-d coredir] [-T dump_timeout] [-z]
+          [-S] [-A [program=]actions] [-i interval] [-j jitter]
+          [-M metrics_file] [-P metrics_port] [-t timeout]
+          [-c status_code] [-b inbody] [-m mail_address] [-s sendmail] URL
 
 Options:
 
@@ -34,7 +36,8 @@ Options:
       process named 'process_name' if it's in the RUNNING state when
       the URL returns an unexpected result or times out.  If this
       process is part of a group, it can be specified using the
-      'group_name:process_name' syntax.
+      'group_name:process_name' syntax.  Shell-style wildcards are
+      allowed (e.g. 'web*' or 'workers:*').
 
 -a -- Restart any child of the supervisord under in the RUNNING state
       if the URL returns an unexpected result or times out.  Overrides
@@ -48,10 +51,25 @@ Options:
 -d -- Core directory.  If a core directory is specified, httpok will
       try to use the ``gcore`` program (see ``-g``) to write a core
       file into this directory against each hung process before we
-      restart it.  Append gcore stdout output to email.
+      restart it.  Append gcore stdout output to email.  Cores of
+      several hung processes are dumped at the same time.
+
+-T -- The number of seconds a core dump may take before it is killed
+      (see -d).  This defaults to 60 seconds.
+
+-z -- Compress core files with gzip once they are written (see -d).
+      Assumes the gcore program names its output <filename>.<pid>, as
+      /usr/bin/gcore does.
+
+-S -- Instead of dumping core, append the kernel stack and wait channel
+      of each thread of a hung process (from /proc/<pid>/task) to the
+      email.  Much cheaper than a core; reading stacks usually needs
+      root.
 
 -t -- The number of seconds that httpok should wait for a response
-      before timing out.  If this timeout is exceeded, httpok will
+      before timing out.  The timeout covers the whole check (connecting,
+      sending the request and reading the headers and body), not each
+      socket operation.  If this timeout is exceeded, httpok will
       attempt to restart processes in the RUNNING state specified by
       -p or -a.  This defaults to 10 seconds.
 
@@ -71,18 +89,54 @@ Options:
       (e.g. "/usr/sbin/sendmail -t -i").  Must be a command which accepts
       header and message data on stdin and sends mail.
       Default is "/usr/sbin/sendmail -t -i".
+      Alternatively, an SMTP URL, "smtp://[user:password@]host[:port]
+      [?starttls]" or "smtps://...", sends mail through an SMTP server
+      over one connection kept open between messages.
 
 -m -- specify an email address.  The script will send mail to this
       address when httpok attempts to restart processes.  If no email
       address is specified, email will not be sent.
 
+-A -- specify how to remediate a hung process, as a comma-separated
+      chain of actions, optionally prefixed with "program_name=" to
+      apply only to that program.  Actions are:
+
+        signal:NAME  send a signal (e.g. signal:HUP) through supervisord
+        wait:SECS    sleep for SECS seconds
+        recheck      check the URL again; stop here if it is healthy
+        stop, start  stop or start the process
+        restart      stop and then start the process
+
+      The default is "restart".  The actions taken and how long they
+      took are included in the email.
+
+-i -- check the URL every this many seconds (fractions allowed) instead
+      of once per TICK event.  TICK events are then only acknowledged.
+
+-j -- with -i, randomly move each check up to this many seconds earlier
+      or later, to spread the load of many listeners on a shared
+      backend.  The first check also happens at a random point within
+      the first interval.  This defaults to 0.
+
+-M -- write check latency histograms and counters of check outcomes
+      and restarts to this file after every check, in the Prometheus
+      text format (e.g. for node_exporter's textfile collector).
+
+-P -- serve the same metrics over HTTP on this port on 127.0.0.1.
+
 -e -- "eager":  check URL / emit mail even if no process we are monitoring
       is in the RUNNING state.  Enabled by default.
 
 -E -- not "eager":  do not check URL / emit mail if no process we are
       monitoring is in the RUNNING state.
 
-URL -- The URL to which to issue a GET request.
+URL -- The URL to which to issue a GET request.  Besides http:// and
+       https:// URLs, httpok accepts http+unix:// URLs whose host part is
+       the percent-encoded path of a unix domain socket
+       (e.g. http+unix://%2Fvar%2Frun%2Fapp.sock/health), and
+       tcp://host:port URLs, which only check that the port accepts
+       connections.  For tcp:// URLs, -b names a banner the server must
+       send after accepting the connection.
 
 The -p option may be specified more than once, allowing for
 specification of multiple processes.  Specifying -a overrides any
@@ -92,20 +146,36 @@ A sample invocation:
 
 httpok.py -p program1 -p group1:program2 http://localhost:8080/tasty
 
+Try a graceful reload of program1 before falling back to a restart:
+
+httpok.py -p program1 -A program1=signal:HUP,wait:2,recheck,restart \\
+    http://localhost:8080/tasty
+
 """
 
+import errno
 import os
+import random
+import select
+import signal
 import socket
 import sys
 import time
+from superlance.compat import monotonic
+from superlance.compat import urllib
 from superlance.compat import urlparse
 from superlance.compat import xmlrpclib
 
 from supervisor import childutils
+from supervisor.compat import as_string
 from supervisor.states import ProcessStates
 from supervisor.options import make_namespec
 
+from superlance import metrics
 from superlance import timeoutconn
+from superlance.helpers import ProgramMatcher
+from superlance.mailer import get_transport
+from superlance.rpc import get_rpc_interface
 
 def usage():
     print(doc)
@@ -113,31 +183,61 @@ def usage():
 
 class HTTPOk:
     connclass = None
+    procdir = '/proc'
+    # the events handled, by prefix, when run by the superlance host
+    listener_events = ('TICK',)
+
     def __init__(self, rpc, programs, any, url, timeout, status, inbody,
-                 email, sendmail, coredir, gcore, eager, retry_time):
+                 email, sendmail, coredir, gcore, eager, retry_time,
+                 dump_timeout=60, compress=False, stacks=False,
+                 actions=None, interval=None, jitter=0,
+                 metrics_file=None, metrics_port=None):
         self.rpc = rpc
         self.programs = programs
+        self.matcher = ProgramMatcher(programs)
         self.any = any
         self.url = url
         self.timeout = timeout
         self.retry_time = retry_time
+        self.interval = interval
+        self.jitter = jitter
         self.status = status
         self.inbody = inbody
         self.email = email
         self.sendmail = sendmail
         self.coredir = coredir
         self.gcore = gcore
+        self.dump_timeout = dump_timeout
+        self.compress = compress
+        self.stacks = stacks
+        self.actions = actions or {}
         self.eager = eager
+        self.metrics_file = metrics_file
+        self.metrics_port = metrics_port
         self.stdin = sys.stdin
         self.stdout = sys.stdout
         self.stderr = sys.stderr
 
+        self.registry = metrics.Registry()
+        self.check_seconds = self.registry.histogram(
+            'httpok_check_duration_seconds',
+            'Time taken to check the URL.', ['url'])
+        self.checks = self.registry.counter(
+            'httpok_checks_total',
+            'URL checks by outcome (ok, bad_status, bad_body, timeout, '
+            'refused or error).', ['url', 'outcome'])
+        self.restarts = self.registry.counter(
+            'httpok_restarts_total',
+            'Processes started or restarted by httpok.', ['program'])
+
     def listProcesses(self, state=None):
+        matches = self.matcher.matches
         return [x for x in self.rpc.supervisor.getAllProcessInfo()
-                   if x['name'] in self.programs and
+                   if matches(x['group'], x['name']) and
                       (state is None or x['state'] == state)]
 
-    def runforever(self, test=False):
+    def make_connection(self):
+        """Return a new connection to the URL and the path to request."""
         parsed = urlparse.urlsplit(self.url)
         scheme = parsed[0].lower()
         hostport = parsed[1]
@@ -153,62 +253,161 @@ class HTTPOk:
             ConnClass = timeoutconn.TimeoutHTTPConnection
         elif scheme == 'https':
             ConnClass = timeoutconn.TimeoutHTTPSConnection
+        elif scheme == 'http+unix':
+            ConnClass = timeoutconn.UnixHTTPConnection
+            hostport = urllib.unquote(hostport)
+        elif scheme == 'tcp':
+            ConnClass = timeoutconn.TCPProbeConnection
+            if ':' not in hostport:
+                raise ValueError('tcp URL %s has no port' % self.url)
         else:
             raise ValueError('Bad scheme %s' % scheme)
 
+        conn = ConnClass(hostport)
+        conn.timeout = self.timeout
+        if scheme == 'tcp':
+            conn.banner = self.inbody
+        return conn, path
+
+    def start(self):
+        if self.metrics_port is not None:
+            metrics.serve(self.registry, self.metrics_port)
+
+    def runforever(self, test=False):
+        # fail early on a bad URL rather than on the first TICK
+        self.make_connection()
+
+        if self.interval:
+            return self.runscheduled(test)
+
         while 1:
             # we explicitly use self.stdin, self.stdout, and self.stderr
             # instead of sys.* so we can unit test this code
             headers, payload = childutils.listener.wait(self.stdin, self.stdout)
+            self.handle_event(headers, payload)
+            childutils.listener.ok(self.stdout)
+            if test:
+                break
 
-            if not headers['eventname'].startswith('TICK'):
-                # do nothing with non-TICK events
+    def handle_event(self, headers, payload):
+        if headers['eventname'].startswith('TICK'):
+            self.tick()
+
+    def runscheduled(self, test=False):
+        """Check the URL every ``interval`` seconds, give or take up to
+        ``jitter`` seconds, instead of once per TICK.  Events are still
+        read and acknowledged between checks, so TICK events only serve
+        as a heartbeat that keeps the listener busy in supervisord's
+        eyes."""
+        childutils.listener.ready(self.stdout)
+        # start at a random point in the first interval so listeners
+        # started at the same time don't all check at the same time
+        next_check = monotonic() + random.uniform(0, self.interval)
+        while 1:
+            timeout = max(0, next_check - monotonic())
+            if self.wait_for_event(timeout):
+                line = self.stdin.readline()
+                if not line:
+                    # supervisord went away
+                    break
+                headers = childutils.get_headers(line)
+                self.stdin.read(int(headers['len']))
                 childutils.listener.ok(self.stdout)
                 if test:
                     break
+                childutils.listener.ready(self.stdout)
                 continue
 
-            conn = ConnClass(hostport)
-            conn.timeout = self.timeout
-
-            specs = self.listProcesses(ProcessStates.RUNNING)
-            if self.eager or len(specs) > 0:
-
+            self.tick()
+            next_check = monotonic() + self.interval + random.uniform(
+                -self.jitter, self.jitter)
+
+    def wait_for_event(self, timeout):
+        """Return True if an event can be read from stdin within
+        timeout seconds."""
+        readable, _, _ = select.select([self.stdin], [], [], timeout)
+        return bool(readable)
+
+    def tick(self):
+        specs = self.listProcesses(ProcessStates.RUNNING)
+        if self.eager or len(specs) > 0:
+            failure = self.check()
+            if failure is not None:
+                subject, msg = failure
+                self.act(subject, msg)
+
+    def check(self):
+        """Issue one request to the URL.  Return None if the response
+        is as expected, otherwise a (subject, msg) pair describing the
+        failure."""
+        conn, path = self.make_connection()
+
+        start = monotonic()
+        outcome = None
+        try:
+            for will_retry in range(
+                    self.timeout // (self.retry_time or 1) - 1 ,
+                    -1, -1):
                 try:
-                    for will_retry in range(
-                            self.timeout // (self.retry_time or 1) - 1 ,
-                            -1, -1):
-                        try:
-                            headers = {'User-Agent': 'httpok'}
-                            conn.request('GET', path, headers=headers)
-                            break
-                        except socket.error as e:
-                            if e.errno == 111 and will_retry:
-                                time.sleep(self.retry_time)
-                            else:
-                                raise
-
-                    res = conn.getresponse()
-                    body = res.read()
-                    status = res.status
-                    msg = 'status contacting %s: %s %s' % (self.url,
-                                                           res.status,
-                                                           res.reason)
-                except Exception as e:
-                    body = ''
-                    status = None
-                    msg = 'error contacting %s:\n\n %s' % (self.url, e)
-
-                if str(status) != str(self.status):
-                    subject = 'httpok for %s: bad status returned' % self.url
-                    self.act(subject, msg)
-                elif self.inbody and self.inbody not in body:
-                    subject = 'httpok for %s: bad body returned' % self.url
-                    self.act(subject, msg)
-
-            childutils.listener.ok(self.stdout)
-            if test:
-                break
+                    headers = {'User-Agent': 'httpok'}
+                    conn.request('GET', path, headers=headers)
+                    break
+                except socket.error as e:
+                    if e.errno == errno.ECONNREFUSED and will_retry:
+                        # a refused connection leaves httplib's
+                        # connection mid-request;  closing resets it
+                        conn.close()
+                        time.sleep(self.retry_time)
+                    else:
+                        raise
+
+            res = conn.getresponse()
+            body = as_string(res.read())
+            status = res.status
+            msg = 'status contacting %s: %s %s' % (self.url,
+                                                   res.status,
+                                                   res.reason)
+        except socket.timeout as e:
+            body = ''
+            status = None
+            outcome = 'timeout'
+            msg = 'timeout contacting %s after %s seconds:\n\n %s' % (
+                self.url, self.timeout, e)
+        except Exception as e:
+            body = ''
+            status = None
+            if getattr(e, 'errno', None) == errno.ECONNREFUSED:
+                outcome = 'refused'
+            else:
+                outcome = 'error'
+            msg = 'error contacting %s:\n\n %s' % (self.url, e)
+
+        failure = None
+        if outcome == 'timeout':
+            subject = 'httpok for %s: timed out' % self.url
+            failure = subject, msg
+        elif str(status) != str(self.status):
+            subject = 'httpok for %s: bad status returned' % self.url
+            failure = subject, msg
+            outcome = outcome or 'bad_status'
+        elif self.inbody and self.inbody not in body:
+            subject = 'httpok for %s: bad body returned' % self.url
+            failure = subject, msg
+            outcome = 'bad_body'
+
+        self.check_seconds.observe(monotonic() - start, url=self.url)
+        self.checks.inc(url=self.url, outcome=outcome or 'ok')
+        self.export_metrics()
+        return failure
+
+    def export_metrics(self):
+        if self.metrics_file:
+            try:
+                metrics.write_textfile(self.registry, self.metrics_file)
+            except (IOError, OSError) as e:
+                self.stderr.write('Failed to write metrics to %s: %s\n' % (
+                    self.metrics_file, e))
+                self.stderr.flush()
 
     def act(self, subject, msg):
         messages = [msg]
@@ -224,31 +423,26 @@ class HTTPOk:
             write('Exception retrieving process info %s, not acting' % e)
             return
 
-        waiting = list(self.programs)
+        found = set()
+        selected = []
 
         if self.any:
             write('Restarting all running processes')
-            for spec in specs:
-                name = spec['name']
-                group = spec['group']
-                self.restart(spec, write)
-                namespec = make_namespec(group, name)
-                if name in waiting:
-                    waiting.remove(name)
-                if namespec in waiting:
-                    waiting.remove(namespec)
         else:
             write('Restarting selected processes %s' % self.programs)
-            for spec in specs:
-                name = spec['name']
-                group = spec['group']
-                namespec = make_namespec(group, name)
-                if (name in self.programs) or (namespec in self.programs):
-                    self.restart(spec, write)
-                    if name in waiting:
-                        waiting.remove(name)
-                    if namespec in waiting:
-                        waiting.remove(namespec)
+        for spec in specs:
+            matching = self.matcher.matching_specs(spec['group'], spec['name'])
+            if self.any or matching:
+                selected.append(spec)
+                found.update(matching)
+
+        waiting = [program for program in self.programs
+                   if program not in found]
+
+        self.diagnose([spec for spec in selected
+                       if spec['state'] is ProcessStates.RUNNING], write)
+        for spec in selected:
+            self.restart(spec, write)
 
         if waiting:
             write(
@@ -264,42 +458,197 @@ class HTTPOk:
         body += 'Subject: %s\n' % subject
         body += '\n'
         body += msg
-        with os.popen(self.sendmail, 'w') as m:
-            m.write(body)
+        get_transport(self.sendmail).send(body)
         self.stderr.write('Mailed:\n\n%s' % body)
         self.mailed = body
 
+    def diagnose(self, specs, write):
+        """Collect diagnostics for hung processes before they are
+        restarted:  kernel stacks if requested, otherwise a core file
+        per process if a core directory is configured."""
+        if not specs:
+            return
+        if self.stacks:
+            for spec in specs:
+                namespec = make_namespec(spec['group'], spec['name'])
+                write('kernel stacks for %s:\n\n%s' % (
+                    namespec, read_stacks(spec['pid'], self.procdir)))
+        elif self.coredir and self.gcore:
+            self.dump_cores(specs, write)
+
+    def dump_cores(self, specs, write):
+        """Run the gcore program against all specs at once, killing any
+        dump still running after dump_timeout seconds."""
+        # only needed when dumping cores, so not imported at startup
+        import subprocess
+        import tempfile
+        jobs = []
+        for spec in specs:
+            namespec = make_namespec(spec['group'], spec['name'])
+            corename = os.path.join(self.coredir, namespec)
+            cmd = self.gcore + ' "%s" %s' % (corename, spec['pid'])
+            if self.compress:
+                # gcore needs a seekable file, so compress once it's done
+                cmd += ' && gzip -f "%s.%s"' % (corename, spec['pid'])
+            output = tempfile.TemporaryFile()
+            proc = subprocess.Popen(cmd, shell=True, stdout=output,
+                                    preexec_fn=os.setsid)
+            jobs.append((namespec, proc, output))
+
+        deadline = monotonic() + self.dump_timeout
+        while monotonic() < deadline:
+            if all(proc.poll() is not None for _, proc, _ in jobs):
+                break
+            time.sleep(0.05)
+
+        for namespec, proc, output in jobs:
+            if proc.poll() is None:
+                try:
+                    os.killpg(proc.pid, signal.SIGKILL)
+                except OSError:
+                    pass
+                proc.wait()
+                write('gcore for %s timed out after %s seconds' % (
+                    namespec, self.dump_timeout))
+            output.seek(0)
+            write('gcore output for %s:\n\n %s' % (
+                namespec, as_string(output.read())))
+            output.close()
+
+    def get_actions(self, spec):
+        """Return the remediation steps configured for spec's program."""
+        namespec = make_namespec(spec['group'], spec['name'])
+        for key in (namespec, spec['name']):
+            if key in self.actions:
+                return self.actions[key]
+        return self.actions.get(None, DEFAULT_ACTIONS)
+
     def restart(self, spec, write):
         namespec = make_namespec(spec['group'], spec['name'])
         if spec['state'] is ProcessStates.RUNNING:
-            if self.coredir and self.gcore:
-                corename = os.path.join(self.coredir, namespec)
-                cmd = self.gcore + ' "%s" %s' % (corename, spec['pid'])
-                with os.popen(cmd) as m:
-                    write('gcore output for %s:\n\n %s' % (
-                        namespec, m.read()))
-            write('%s is in RUNNING state, restarting' % namespec)
-            try:
-                self.rpc.supervisor.stopProcess(namespec)
-            except xmlrpclib.Fault as e:
-                write('Failed to stop process %s: %s' % (
-                    namespec, e))
-
-            try:
-                self.rpc.supervisor.startProcess(namespec)
-            except xmlrpclib.Fault as e:
-                write('Failed to start process %s: %s' % (
-                    namespec, e))
+            actions = self.get_actions(spec)
+            if actions == DEFAULT_ACTIONS:
+                write('%s is in RUNNING state, restarting' % namespec)
             else:
-                write('%s restarted' % namespec)
-
+                write('%s is in RUNNING state, remediating with %s' % (
+                    namespec, format_actions(actions)))
+            start = monotonic()
+            done = self.remediate(namespec, actions, write)
+            write('%s: %s took %.2f seconds' % (
+                namespec, format_actions(done), monotonic() - start))
         else:
             write('%s not in RUNNING state, NOT restarting' % namespec)
 
+    def remediate(self, namespec, actions, write):
+        """Carry out the remediation steps in order, stopping early if a
+        recheck finds the URL healthy again.  Returns the steps taken."""
+        for i, (action, arg) in enumerate(actions):
+            if action == 'signal':
+                try:
+                    self.rpc.supervisor.signalProcess(namespec, arg)
+                except xmlrpclib.Fault as e:
+                    write('Failed to signal process %s: %s' % (
+                        namespec, e))
+                else:
+                    write('Sent SIG%s to %s' % (arg, namespec))
+            elif action == 'wait':
+                time.sleep(arg)
+            elif action == 'recheck':
+                failure = self.check()
+                if failure is None:
+                    write('%s recovered, skipping remaining actions' % (
+                        namespec))
+                    return actions[:i + 1]
+                write('%s still failing: %s' % (namespec, failure[1]))
+            if action in ('stop', 'restart'):
+                try:
+                    self.rpc.supervisor.stopProcess(namespec)
+                except xmlrpclib.Fault as e:
+                    write('Failed to stop process %s: %s' % (
+                        namespec, e))
+                else:
+                    if action == 'stop':
+                        write('%s stopped' % namespec)
+            if action in ('start', 'restart'):
+                try:
+                    self.rpc.supervisor.startProcess(namespec)
+                except xmlrpclib.Fault as e:
+                    write('Failed to start process %s: %s' % (
+                        namespec, e))
+                else:
+                    self.restarts.inc(program=namespec)
+                    write('%s %s' % (namespec, action == 'start' and
+                                     'started' or 'restarted'))
+        return actions
+
+DEFAULT_ACTIONS = [('restart', None)]
+
+def parse_actions(value):
+    """Parse an action option of the form [program=]step,step,... into
+    a (program, steps) pair.  program is None when it applies to every
+    program without actions of its own."""
+    program = None
+    if '=' in value:
+        program, value = value.split('=', 1)
+    steps = []
+    for step in value.split(','):
+        action, _, arg = step.strip().partition(':')
+        action = action.lower()
+        if action == 'signal':
+            arg = arg.upper()
+            if arg.startswith('SIG'):
+                arg = arg[3:]
+            if not arg:
+                raise ValueError('signal action needs a signal name')
+        elif action == 'wait':
+            arg = float(arg)
+        elif action in ('recheck', 'stop', 'start', 'restart'):
+            if arg:
+                raise ValueError('%s action takes no argument' % action)
+            arg = None
+        else:
+            raise ValueError('unknown action %r' % step)
+        steps.append((action, arg))
+    return program, steps
+
+def format_actions(actions):
+    return ','.join([arg is None and action or
+                     '%s:%s' % (action, _format_number(arg))
+                     for action, arg in actions])
+
+def _format_number(arg):
+    if isinstance(arg, float) and arg == int(arg):
+        return int(arg)
+    return arg
+
+def read_stacks(pid, procdir='/proc'):
+    """Return the kernel stack and wait channel of every thread of pid,
+    as found under procdir.  Much cheaper than a core file, and often
+    enough to tell what a hung process is blocked on."""
+    def read(path):
+        try:
+            with open(path) as f:
+                return f.read().strip()
+        except (IOError, OSError) as e:
+            return '<unavailable: %s>' % e
 
-def main(argv=sys.argv):
+    taskdir = os.path.join(procdir, str(pid), 'task')
+    try:
+        tids = sorted(os.listdir(taskdir), key=int)
+    except OSError as e:
+        return 'unable to list threads: %s' % e
+
+    threads = []
+    for tid in tids:
+        threaddir = os.path.join(taskdir, tid)
+        threads.append('thread %s (wchan %s):\n%s' % (
+            tid, read(os.path.join(threaddir, 'wchan')),
+            read(os.path.join(threaddir, 'stack'))))
+    return '\n\n'.join(threads)
+
+def httpok_from_args(arguments):
     import getopt
-    short_args="hp:at:c:b:s:m:g:d:eE"
+    short_args="hp:at:c:b:s:m:g:d:T:zSA:i:j:M:P:eE"
     long_args=[
         "help",
         "program=",
@@ -311,25 +660,38 @@ def main(argv=sys.argv):
         "email=",
         "gcore=",
         "coredir=",
+        "dump-timeout=",
+        "compress",
+        "stacks",
+        "action=",
+        "interval=",
+        "jitter=",
+        "metrics-file=",
+        "metrics-port=",
         "eager",
         "not-eager",
         ]
-    arguments = argv[1:]
     try:
         opts, args = getopt.getopt(arguments, short_args, long_args)
     except:
-        usage()
+        return None
 
-    if not args:
-        usage()
-    if len(args) > 1:
-        usage()
+    if len(args) != 1:
+        return None
 
     programs = []
     any = False
     sendmail = '/usr/sbin/sendmail -t -i'
     gcore = '/usr/bin/gcore -o'
     coredir = None
+    dump_timeout = 60
+    compress = False
+    stacks = False
+    actions = {}
+    interval = None
+    jitter = 0
+    metrics_file = None
+    metrics_port = None
     eager = True
     email = None
     timeout = 10
@@ -340,7 +702,7 @@ def main(argv=sys.argv):
     for option, value in opts:
 
         if option in ('-h', '--help'):
-            usage()
+            return None
 
         if option in ('-p', '--program'):
             programs.append(value)
@@ -369,16 +731,56 @@ def main(argv=sys.argv):
         if option in ('-d', '--coredir'):
             coredir = value
 
+        if option in ('-T', '--dump-timeout'):
+            dump_timeout = float(value)
+
+        if option in ('-z', '--compress'):
+            compress = True
+
+        if option in ('-S', '--stacks'):
+            stacks = True
+
+        if option in ('-A', '--action'):
+            try:
+                program, steps = parse_actions(value)
+            except ValueError as e:
+                print('Unparseable action %r: %s' % (value, e))
+                return None
+            actions[program] = steps
+
+        if option in ('-i', '--interval'):
+            interval = float(value)
+
+        if option in ('-j', '--jitter'):
+            jitter = float(value)
+
+        if option in ('-M', '--metrics-file'):
+            metrics_file = value
+
+        if option in ('-P', '--metrics-port'):
+            metrics_port = int(value)
+
         if option in ('-e', '--eager'):
             eager = True
 
         if option in ('-E', '--not-eager'):
             eager = False
 
-    url = arguments[-1]
+    url = args[0]
+
+    return HTTPOk(None, programs, any, url, timeout, status, inbody, email,
+                  sendmail, coredir, gcore, eager, retry_time,
+                  dump_timeout, compress, stacks, actions, interval,
+                  jitter, metrics_file, metrics_port)
+
+def main(argv=sys.argv):
+    prog = httpok_from_args(argv[1:])
+    if prog is None:
+        # something went wrong or -h has been given
+        usage()
 
     try:
-        rpc = childutils.getRPCInterface(os.environ)
+        prog.rpc = get_rpc_interface(os.environ)
     except KeyError as e:
         if e.args[0] != 'SUPERVISOR_SERVER_URL':
             raise
@@ -387,8 +789,7 @@ def main(argv=sys.argv):
         sys.stderr.flush()
         return
 
-    prog = HTTPOk(rpc, programs, any, url, timeout, status, inbody, email,
-                  sendmail, coredir, gcore, eager, retry_time)
+    prog.start()
     prog.runforever()
 
 if __name__ == '__main__':
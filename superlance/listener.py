@@ -0,0 +1,319 @@
+##############################################################################
+#
+# Copyright (c) 2007 Agendaless Consulting and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the BSD-like license at
+# http://www.repoze.org/LICENSE.txt.  A copy of the license should accompany
+# this distribution.  THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL
+# EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND
+# FITNESS FOR A PARTICULAR PURPOSE
+#
+##############################################################################
+doc = """\
+Base class for event listeners that notices the events supervisord
+dropped before sending them, and finds the process state changes it
+missed from snapshots of the state of all processes.
+"""
+
+import collections
+import os
+import sys
+
+from supervisor import childutils
+from supervisor.options import make_namespec
+from superlance.helpers import clear_logfile_cache
+from superlance.helpers import forget_logfiles
+from superlance.helpers import get_proc_name
+from superlance.rpc import get_rpc_interface
+
+class PoolSerialTracker:
+    """Counts the events missing between the events received.
+
+    supervisord numbers the events of each listener pool in the
+    'poolserial' header.  When the buffer of a pool overflows, the
+    oldest events are dropped, which shows as a gap in those numbers.
+    (With several listener processes in the pool, each one only sees
+    part of the events:  the gaps are then meaningless.)"""
+
+    def __init__(self):
+        self.last = None
+        self.dropped = 0
+        self.gaps = 0
+
+    def check(self, headers):
+        """Return the number of events missed before this one."""
+        try:
+            serial = int(headers['poolserial'])
+        except (KeyError, ValueError):
+            return 0
+        last, self.last = self.last, serial
+        if last is None or serial <= last:
+            # first event, or supervisord was restarted
+            return 0
+        missed = serial - last - 1
+        if missed:
+            self.dropped += missed
+            self.gaps += 1
+        return missed
+
+class RecentKeys:
+    """A set remembering at most `maxkeys` keys, forgetting the oldest
+    first.  (collections.OrderedDict is not in Python 2.6.)"""
+
+    def __init__(self, maxkeys):
+        self.maxkeys = maxkeys
+        self.keys = set()
+        self.order = collections.deque()
+
+    def __contains__(self, key):
+        return key in self.keys
+
+    def __len__(self):
+        return len(self.keys)
+
+    def add(self, key):
+        if key in self.keys:
+            return
+        self.keys.add(key)
+        self.order.append(key)
+        while len(self.keys) > self.maxkeys:
+            self.keys.discard(self.order.popleft())
+
+    def discard(self, key):
+        if key in self.keys:
+            self.keys.discard(key)
+            self.order.remove(key)
+
+class ProcessStateReconciler:
+    """Finds the unexpected exits and FATAL states between successive
+    snapshots of supervisor.getAllProcessInfo, as events.
+
+    The first snapshot is the baseline:  nothing is reported from it,
+    and the processes already FATAL in it are not reported until they
+    leave the state and come back to it.
+
+    A process whose pid changed while it was not stopped, and whose exit
+    status is above 0, exited unexpectedly.  (Processes killed by a
+    signal have an exit status of -1, whether they crashed or were
+    stopped:  their exits are not reported.)  A process in the FATAL
+    state is reported once, until it leaves the state.
+
+    A snapshot cannot tell a crash from a restart (e.g. supervisorctl
+    restart) of a program exiting with a status above 0 when stopped,
+    such as 143 for a JVM stopped by SIGTERM:  in both cases the pid
+    changed and the exit status is above 0.  Restarts are only told
+    apart when the PROCESS_STATE_STOPPING or PROCESS_STATE_STOPPED event
+    of the old pid was received, so listeners reconciling should be
+    subscribed to those events too (e.g. to PROCESS_STATE).
+
+    Events received for real are passed to `seen`, so that the same
+    transition is not reported twice, whichever comes first.  At most
+    `maxkeys` of them are remembered."""
+
+    def __init__(self, maxkeys=1000):
+        self.maxkeys = maxkeys
+        self.snapshot = None
+        self.received = RecentKeys(maxkeys)
+        self.synthesized = RecentKeys(maxkeys)
+
+    def seen(self, headers, payload):
+        """Record an event received from supervisord; return True if it
+        was already synthesized from a snapshot."""
+        eventname = headers.get('eventname', '')
+        if not eventname.startswith('PROCESS_STATE'):
+            return False
+        pheaders, pdata = childutils.eventdata(payload+'\n')
+        try:
+            namespec = make_namespec(pheaders['groupname'],
+                                     pheaders['processname'])
+        except KeyError:
+            return False
+        if eventname != 'PROCESS_STATE_FATAL':
+            self._forget(('PROCESS_STATE_FATAL', namespec))
+        if eventname in ('PROCESS_STATE_STOPPING', 'PROCESS_STATE_STOPPED'):
+            # stopped on purpose:  its exit is not a crash
+            key = self._get_key('PROCESS_STATE_EXITED', namespec,
+                                pheaders.get('pid'))
+            if key is not None:
+                self.received.add(key)
+            return False
+        key = self._get_key(eventname, namespec, pheaders.get('pid'))
+        if key is None:
+            return False
+        if key in self.synthesized:
+            return True
+        self.received.add(key)
+        return False
+
+    def diff(self, infos):
+        """Return the (headers, payload) of the events found since the
+        previous snapshot."""
+        events = []
+        snapshot = {}
+        if self.snapshot is None:
+            # the baseline
+            for info in infos:
+                namespec = make_namespec(info['group'], info['name'])
+                snapshot[namespec] = info
+                if info['statename'] == 'FATAL':
+                    self.received.add(('PROCESS_STATE_FATAL', namespec))
+            self.snapshot = snapshot
+            return events
+        for info in infos:
+            namespec = make_namespec(info['group'], info['name'])
+            snapshot[namespec] = info
+            old = self.snapshot.get(namespec)
+            if (old is not None and old['pid'] and
+                    info['pid'] != old['pid'] and
+                    info['statename'] not in ('STOPPING', 'STOPPED') and
+                    info.get('exitstatus', 0) > 0):
+                payload = ('processname:%s groupname:%s from_state:RUNNING '
+                           'expected:0 pid:%s' % (info['name'], info['group'],
+                                                  old['pid']))
+                self._synthesize(events, 'PROCESS_STATE_EXITED', namespec,
+                                 old['pid'], payload)
+            if info['statename'] == 'FATAL':
+                payload = ('processname:%s groupname:%s from_state:BACKOFF' %
+                           (info['name'], info['group']))
+                self._synthesize(events, 'PROCESS_STATE_FATAL', namespec,
+                                 None, payload)
+            else:
+                self._forget(('PROCESS_STATE_FATAL', namespec))
+        self.snapshot = snapshot
+        return events
+
+    def _synthesize(self, events, eventname, namespec, pid, payload):
+        key = self._get_key(eventname, namespec, pid)
+        if key in self.received or key in self.synthesized:
+            return
+        self.synthesized.add(key)
+        headers = {'ver': '3.0', 'server': 'superlance',
+                   'eventname': eventname, 'len': str(len(payload)),
+                   'synthesized': '1'}
+        events.append((headers, payload))
+
+    def _get_key(self, eventname, namespec, pid):
+        if eventname == 'PROCESS_STATE_EXITED':
+            return (eventname, namespec, str(pid))
+        if eventname == 'PROCESS_STATE_FATAL':
+            return (eventname, namespec)
+        return None
+
+    def _forget(self, key):
+        self.received.discard(key)
+        self.synthesized.discard(key)
+
+class EventListener:
+    """Mixin for listeners, which call wait_for_event rather than
+    childutils.listener.wait, and dispatch_event rather than their own
+    handle_event(headers, payload).
+
+    When events were dropped (if `detect_gaps`), and every
+    `reconcile_ticks` TICK events if set, the state of all processes is
+    fetched (one RPC) and passed to reconcile_process_infos.  The
+    transitions it finds are handled like the events received, which are
+    not handled again if they come after.  The state of all processes is
+    first fetched on the first event, as the baseline to compare to.
+
+    Gaps in the pool serials are meaningless when the listener pool has
+    several processes (numprocs > 1):  gap detection is turned off when
+    the state of all processes shows one, and can be turned off from the
+    start with `detect_gaps`.
+
+    The log file paths cached by superlance.helpers are forgotten on
+    PROCESS_GROUP events, and for the processes that appeared or
+    disappeared between two snapshots, since the configuration of those
+    processes may have changed."""
+
+    def __init__(self, reconcile_ticks=0, detect_gaps=True):
+        self.pool_serials = PoolSerialTracker()
+        self.reconciler = ProcessStateReconciler()
+        self.reconcile_ticks = reconcile_ticks
+        self.detect_gaps = detect_gaps
+        self.ticks = 0
+        self.baseline_taken = False
+
+    def wait_for_event(self):
+        headers, payload = childutils.listener.wait(self.stdin, self.stdout)
+        if not self.detect_gaps:
+            return headers, payload
+        missed = self.pool_serials.check(headers)
+        if missed:
+            self.stderr.write('Missed %d events before event %s of pool %s '
+                              '(%d missed in all), reconciling\n' % (
+                                  missed, headers['poolserial'],
+                                  headers.get('pool'),
+                                  self.pool_serials.dropped))
+            self.stderr.flush()
+            self.reconcile()
+        return headers, payload
+
+    def dispatch_event(self, headers, payload):
+        if not self.baseline_taken and (self.detect_gaps or
+                                        self.reconcile_ticks):
+            self.reconcile()
+        if headers['eventname'].startswith('PROCESS_GROUP'):
+            clear_logfile_cache()
+        if self.reconcile_ticks and headers['eventname'].startswith('TICK_'):
+            self.ticks += 1
+            if self.ticks >= self.reconcile_ticks:
+                self.ticks = 0
+                self.reconcile()
+        if self.reconciler.seen(headers, payload):
+            return None
+        return self.handle_event(headers, payload)
+
+    """
+    Override this method in child classes to handle an event
+    """
+    def handle_event(self, headers, payload):
+        pass
+
+    def reconcile(self):
+        # once only:  if it fails, the next reconciliation takes it
+        self.baseline_taken = True
+        try:
+            rpc = get_rpc_interface(os.environ)
+            infos = rpc.supervisor.getAllProcessInfo()
+        except Exception:
+            self.stderr.write('Error reconciling process states: %s\n' %
+                              (sys.exc_info()[1],))
+            self.stderr.flush()
+            return
+        self.reconcile_process_infos(infos)
+
+    def reconcile_process_infos(self, infos):
+        if self.detect_gaps:
+            self.check_pool_size(infos)
+        old = self.reconciler.snapshot
+        events = self.reconciler.diff(infos)
+        if old is not None:
+            # added or removed, maybe with other log files
+            new = self.reconciler.snapshot
+            forget_logfiles([
+                get_proc_name({'groupname': info['group'],
+                               'processname': info['name']})
+                for info in ([old[namespec] for namespec in old
+                              if namespec not in new] +
+                             [new[namespec] for namespec in new
+                              if namespec not in old])])
+        for headers, payload in events:
+            self.stderr.write('Found a missed %s event: %s\n' % (
+                headers['eventname'], payload))
+            self.stderr.flush()
+            self.handle_event(headers, payload)
+
+    def check_pool_size(self, infos):
+        """Turn gap detection off if the listener pool this process
+        belongs to has several processes."""
+        group = os.environ.get('SUPERVISOR_GROUP_NAME')
+        if group is None:
+            return
+        size = len([info for info in infos if info['group'] == group])
+        if size > 1:
+            self.detect_gaps = False
+            self.stderr.write('Listener pool %s has %d processes, not '
+                              'detecting dropped events\n' % (group, size))
+            self.stderr.flush()
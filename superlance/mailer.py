@@ -0,0 +1,190 @@
+##############################################################################
+#
+# Copyright (c) 2007 Agendaless Consulting and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the BSD-like license at
+# http://www.repoze.org/LICENSE.txt.  A copy of the license should accompany
+# this distribution.  THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL
+# EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND
+# FITNESS FOR A PARTICULAR PURPOSE
+#
+##############################################################################
+doc = """\
+Mail transports shared by the notifiers:  a pipe to a sendmail command,
+or a persistent SMTP session.
+
+A transport is chosen by a spec string, the value of the notifiers'
+sendmail option:  a sendmail command (e.g. "/usr/sbin/sendmail -t -i"),
+or an SMTP URL:
+
+  smtp://[user:password@]host[:port][?starttls][&from=address]
+  smtps://[user:password@]host[:port][?from=address]
+"""
+
+import os
+import socket
+import sys
+import threading
+
+from superlance.compat import urllib
+from superlance.compat import urlparse
+
+class SendmailTransport:
+    """Pipes each message, headers included, to a sendmail command."""
+
+    def __init__(self, command):
+        self.command = command
+
+    def send(self, message, to_addrs=None, from_addr=None):
+        # the command finds the recipients in the headers (sendmail -t)
+        with os.popen(self.command, 'w') as m:
+            m.write(message)
+
+    def send_many(self, messages):
+        for message in messages:
+            self.send(message)
+
+    def close(self):
+        pass
+
+class SMTPTransport:
+    """Sends messages through an SMTP server, keeping the session open
+    between messages.  If the session turns out to be broken (e.g. the
+    server closed it while idle), it is reopened and the message sent
+    again, once.  The session is shared by the threads sending through
+    the transport, one message at a time."""
+
+    def __init__(self, host, port=None, user=None, password=None,
+                 starttls=False, ssl=False, from_addr=None, timeout=30,
+                 smtp_class=None):
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.starttls = starttls
+        self.ssl = ssl
+        if from_addr is None:
+            from_addr = 'supervisord@%s' % socket.gethostname()
+        self.from_addr = from_addr
+        self.timeout = timeout
+        if smtp_class is None:
+            import smtplib
+            smtp_class = ssl and smtplib.SMTP_SSL or smtplib.SMTP
+        self.smtp_class = smtp_class
+        self.conn = None
+        # smtplib sessions are not thread-safe
+        self.lock = threading.RLock()
+
+    def connect(self):
+        with self.lock:
+            conn = self.smtp_class(self.host, self.port or 0,
+                                   timeout=self.timeout)
+            try:
+                if self.starttls:
+                    conn.ehlo()
+                    conn.starttls()
+                    conn.ehlo()
+                if self.user:
+                    conn.login(self.user, self.password or '')
+            except:
+                conn.close()
+                raise
+            self.conn = conn
+
+    def send(self, message, to_addrs=None, from_addr=None):
+        """Send message, a string with headers.  The envelope sender and
+        recipients default to the From and To/Cc/Bcc headers."""
+        # imported on first use, so that listeners start faster
+        import smtplib
+        from email.parser import Parser
+        from email.utils import getaddresses
+        if to_addrs is None or from_addr is None:
+            headers = Parser().parsestr(message, headersonly=True)
+            if to_addrs is None:
+                fields = []
+                for name in ('to', 'cc', 'bcc'):
+                    fields.extend(headers.get_all(name, []))
+                to_addrs = [addr for name, addr in getaddresses(fields)]
+            if from_addr is None:
+                if headers['from']:
+                    from_addr = getaddresses([headers['from']])[0][1]
+                else:
+                    from_addr = self.from_addr
+                    message = 'From: %s\n%s' % (from_addr, message)
+        with self.lock:
+            for attempt in (1, 2):
+                if self.conn is None:
+                    self.connect()
+                try:
+                    self.conn.sendmail(from_addr, to_addrs, message)
+                    return
+                except (smtplib.SMTPServerDisconnected, socket.error):
+                    error = sys.exc_info()[1]
+                    if (isinstance(error, smtplib.SMTPException) and not
+                            isinstance(error,
+                                       smtplib.SMTPServerDisconnected)):
+                        # refused by the server, which resending won't
+                        # change (on Python 3, SMTPException is a
+                        # socket.error)
+                        raise
+                    self.abort()
+                    if attempt == 2:
+                        raise
+
+    def send_many(self, messages):
+        """Send several messages in the same session."""
+        for message in messages:
+            self.send(message)
+
+    def abort(self):
+        with self.lock:
+            if self.conn is not None:
+                try:
+                    self.conn.close()
+                except Exception:
+                    pass
+                self.conn = None
+
+    def close(self):
+        with self.lock:
+            if self.conn is not None:
+                try:
+                    self.conn.quit()
+                except Exception:
+                    pass
+                self.abort()
+
+def parse_transport(spec):
+    """Return a new transport for spec, a sendmail command or an SMTP
+    URL (see the module doc)."""
+    parts = urlparse.urlsplit(spec)
+    if parts.scheme not in ('smtp', 'smtps'):
+        return SendmailTransport(spec)
+    query = urlparse.parse_qs(parts.query, keep_blank_values=True)
+    unquote = lambda value: value is not None and urllib.unquote(value) or None
+    from_addr = query.get('from', [None])[0]
+    return SMTPTransport(parts.hostname,
+                         port=parts.port,
+                         user=unquote(parts.username),
+                         password=unquote(parts.password),
+                         starttls='starttls' in query,
+                         ssl=parts.scheme == 'smtps',
+                         from_addr=from_addr)
+
+_transports = {}
+
+def get_transport(spec):
+    """Return the transport for spec, shared by everything in this
+    process that sends mail with the same spec."""
+    transport = _transports.get(spec)
+    if transport is None:
+        transport = _transports[spec] = parse_transport(spec)
+    return transport
+
+def close_transports():
+    """Close and forget the shared transports."""
+    for transport in _transports.values():
+        transport.close()
+    _transports.clear()
@@ -52,6 +52,9 @@ Options:
       (e.g. "/usr/sbin/sendmail -t -i").  Must be a command which accepts
       header and message data on stdin and sends mail.
       Default is "/usr/sbin/sendmail -t -i".
+      Alternatively, an SMTP URL, "smtp://[user:password@]host[:port]
+      [?starttls]" or "smtps://...", sends mail through an SMTP server
+      over one connection kept open between messages.
 
 -m -- specify an email address.  The script will send mail to this
       address when any process is restarted.  If no email address is
@@ -87,6 +90,8 @@ from collections import namedtuple
 from superlance.compat import maxint
 from superlance.compat import xmlrpclib
 
+from superlance.mailer import get_transport
+from superlance.rpc import get_rpc_interface
 from supervisor import childutils
 from supervisor.datatypes import byte_size, SuffixMultiplier
 
@@ -99,6 +104,9 @@ def shell(cmd):
         return f.read()
 
 class Memmon:
+    # the events handled, by prefix, when run by the superlance host
+    listener_events = ('TICK',)
+
     def __init__(self, cumulative, programs, groups, any, sendmail, email, email_uptime_limit, name, rpc=None):
         self.cumulative = cumulative
         self.programs = programs
@@ -121,75 +129,74 @@ class Memmon:
             # we explicitly use self.stdin, self.stdout, and self.stderr
             # instead of sys.* so we can unit test this code
             headers, payload = childutils.listener.wait(self.stdin, self.stdout)
+            self.handle_event(headers, payload)
+            childutils.listener.ok(self.stdout)
+            if test:
+                break
 
-            if not headers['eventname'].startswith('TICK'):
-                # do nothing with non-TICK events
-                childutils.listener.ok(self.stdout)
-                if test:
-                    break
-                continue
-
-            status = []
-            if self.programs:
-                keys = sorted(self.programs.keys())
-                status.append(
-                    'Checking programs %s' % ', '.join(
-                    [ '%s=%s' % (k, self.programs[k]) for k in keys ])
-                    )
-
-            if self.groups:
-                keys = sorted(self.groups.keys())
-                status.append(
-                    'Checking groups %s' % ', '.join(
-                    [ '%s=%s' % (k, self.groups[k]) for k in keys ])
-                    )
-            if self.any is not None:
-                status.append('Checking any=%s' % self.any)
+    def handle_event(self, headers, payload):
+        if not headers['eventname'].startswith('TICK'):
+            # do nothing with non-TICK events
+            return
+
+        status = []
+        if self.programs:
+            keys = sorted(self.programs.keys())
+            status.append(
+                'Checking programs %s' % ', '.join(
+                [ '%s=%s' % (k, self.programs[k]) for k in keys ])
+                )
 
-            self.stderr.write('\n'.join(status) + '\n')
+        if self.groups:
+            keys = sorted(self.groups.keys())
+            status.append(
+                'Checking groups %s' % ', '.join(
+                [ '%s=%s' % (k, self.groups[k]) for k in keys ])
+                )
+        if self.any is not None:
+            status.append('Checking any=%s' % self.any)
 
-            infos = self.rpc.supervisor.getAllProcessInfo()
+        self.stderr.write('\n'.join(status) + '\n')
 
-            for info in infos:
-                pid = info['pid']
-                name = info['name']
-                group = info['group']
-                pname = '%s:%s' % (group, name)
+        infos = self.rpc.supervisor.getAllProcessInfo()
 
-                if not pid:
-                    # ps throws an error in this case (for processes
-                    # in standby mode, non-auto-started).
-                    continue
+        for info in infos:
+            pid = info['pid']
+            name = info['name']
+            group = info['group']
+            pname = '%s:%s' % (group, name)
 
-                rss = self.calc_rss(pid)
-                if rss is None:
-                    # no such pid (deal with race conditions) or
-                    # rss couldn't be calculated for other reasons
-                    continue
+            if not pid:
+                # ps throws an error in this case (for processes
+                # in standby mode, non-auto-started).
+                continue
 
-                for n in name, pname:
-                    if n in self.programs:
-                        self.stderr.write('RSS of %s is %s\n' % (pname, rss))
-                        if  rss > self.programs[name]:
-                            self.restart(pname, rss)
-                            continue
+            rss = self.calc_rss(pid)
+            if rss is None:
+                # no such pid (deal with race conditions) or
+                # rss couldn't be calculated for other reasons
+                continue
 
-                if group in self.groups:
+            for n in name, pname:
+                if n in self.programs:
                     self.stderr.write('RSS of %s is %s\n' % (pname, rss))
-                    if rss > self.groups[group]:
+                    if  rss > self.programs[name]:
                         self.restart(pname, rss)
                         continue
 
-                if self.any is not None:
-                    self.stderr.write('RSS of %s is %s\n' % (pname, rss))
-                    if rss > self.any:
-                        self.restart(pname, rss)
-                        continue
+            if group in self.groups:
+                self.stderr.write('RSS of %s is %s\n' % (pname, rss))
+                if rss > self.groups[group]:
+                    self.restart(pname, rss)
+                    continue
 
-            self.stderr.flush()
-            childutils.listener.ok(self.stdout)
-            if test:
-                break
+            if self.any is not None:
+                self.stderr.write('RSS of %s is %s\n' % (pname, rss))
+                if rss > self.any:
+                    self.restart(pname, rss)
+                    continue
+
+        self.stderr.flush()
 
     def restart(self, name, rss):
         info = self.rpc.supervisor.getProcessInfo(name)
@@ -287,8 +294,7 @@ class Memmon:
         body += 'Subject: %s\n' % subject
         body += '\n'
         body += msg
-        with os.popen(self.sendmail, 'w') as m:
-            m.write(body)
+        get_transport(self.sendmail).send(body)
         self.mailed = body
 
 def parse_namesize(option, value):
@@ -401,7 +407,7 @@ def main():
     if memmon is None:
         # something went wrong or -h has been given
         usage()
-    memmon.rpc = childutils.getRPCInterface(os.environ)
+    memmon.rpc = get_rpc_interface(os.environ)
     memmon.runforever()
 
 if __name__ == '__main__':
@@ -0,0 +1,181 @@
+##############################################################################
+#
+# Copyright (c) 2007 Agendaless Consulting and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the BSD-like license at
+# http://www.repoze.org/LICENSE.txt.  A copy of the license should accompany
+# this distribution.  THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL
+# EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND
+# FITNESS FOR A PARTICULAR PURPOSE
+#
+##############################################################################
+doc = """\
+Counters and histograms kept by listeners, exported in the Prometheus
+text format either to a file (for node_exporter's textfile collector)
+or over HTTP.
+"""
+
+import os
+import threading
+
+from superlance.compat import BaseHTTPRequestHandler, HTTPServer
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0)
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace(
+        '"', '\\"').replace('\n', '\\n')
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join(['%s="%s"' % (name, _escape(value))
+                              for name, value in labels])
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value == int(value):
+        return str(int(value))
+    return repr(value)
+
+class Metric:
+    kind = None
+
+    def __init__(self, registry, name, help, labelnames):
+        self.registry = registry
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError('%s takes labels %s, got %s' % (
+                self.name, self.labelnames, sorted(labels)))
+        return tuple([(name, labels[name]) for name in self.labelnames])
+
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name, self.help),
+                 '# TYPE %s %s' % (self.name, self.kind)]
+        for key in sorted(self.values):
+            lines.extend(self.render_sample(key, self.values[key]))
+        return lines
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.registry.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels):
+        return self.values.get(self._key(labels), 0)
+
+    def render_sample(self, key, value):
+        return ['%s%s %s' % (self.name, _format_labels(key),
+                             _format_value(value))]
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, registry, name, help, labelnames,
+                 buckets=DEFAULT_BUCKETS):
+        Metric.__init__(self, registry, name, help, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self.registry.lock:
+            counts = self.values.get(key)
+            if counts is None:
+                # per-bucket counts, then the sum of observed values
+                counts = self.values[key] = [0] * len(self.buckets) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            counts[-1] += value
+
+    def get_count(self, **labels):
+        counts = self.values.get(self._key(labels))
+        if counts is None:
+            return 0
+        return sum(counts[:-1])
+
+    def render_sample(self, key, counts):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, counts):
+            cumulative += count
+            lines.append('%s_bucket%s %d' % (
+                self.name, _format_labels(key + (('le', _format_value(
+                    float(bound))),)), cumulative))
+        labels = _format_labels(key)
+        lines.append('%s_sum%s %s' % (self.name, labels, repr(counts[-1])))
+        lines.append('%s_count%s %d' % (self.name, labels, cumulative))
+        return lines
+
+class Registry:
+    """A set of metrics that can be rendered together.  Updates and
+    rendering are serialized by a lock, so metrics can be served from
+    another thread."""
+
+    def __init__(self):
+        self.metrics = []
+        self.lock = threading.Lock()
+
+    def counter(self, name, help, labelnames=()):
+        metric = Counter(self, name, help, labelnames)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(self, name, help, labelnames, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        with self.lock:
+            for metric in self.metrics:
+                lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+def write_textfile(registry, path):
+    """Write the registry's metrics to path, replacing it atomically so
+    a collector never reads a partial file."""
+    tmp = '%s.%d.tmp' % (path, os.getpid())
+    with open(tmp, 'w') as f:
+        f.write(registry.render())
+    os.rename(tmp, path)
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry = None
+
+    def do_GET(self):
+        body = self.registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # stderr belongs to the listener's own log
+        pass
+
+def serve(registry, port, host='127.0.0.1'):
+    """Serve the registry's metrics over HTTP from a daemon thread and
+    return the server."""
+    handler = type('MetricsHandler', (_MetricsHandler, object),
+                   {'registry': registry})
+    server = HTTPServer((host, port), handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
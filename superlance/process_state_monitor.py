@@ -16,17 +16,119 @@ doc = """\
 Base class for common functionality when monitoring process state changes
 """
 
+import collections
+import signal
 import sys
+import time
 
 from supervisor import childutils
+from superlance.compat import monotonic
+from supervisor.options import make_namespec
+from superlance.helpers import (
+    LogFollower,
+    format_last_lines,
+    get_last_lines_of_processes,
+)
+from superlance.listener import EventListener
+from superlance.sender import BackgroundSender
+from superlance.spool import Spool
 
-class ProcessStateMonitor:
+def get_event_names(names):
+    """Return a list of event names from a list or a comma separated
+    string of them, where 'FATAL' is short for 'PROCESS_STATE_FATAL'"""
+    if isinstance(names, str):
+        names = names.split(',')
+    result = []
+    for name in names:
+        name = name.strip().upper()
+        if name and not name.startswith('PROCESS_STATE_'):
+            name = 'PROCESS_STATE_' + name
+        if name:
+            result.append(name)
+    return result
+
+class BatchEntry:
+    """The events of one process in a batch."""
+
+    def __init__(self, max_pids):
+        self.pheaders = None
+        self.msg = None
+        self.count = 0
+        self.first = None
+        self.last = None
+        self.pids = collections.deque(maxlen=max_pids)
+
+    def add(self, pheaders, msg, when):
+        self.pheaders = pheaders
+        self.msg = msg
+        self.count += 1
+        if self.first is None:
+            self.first = when
+        self.last = when
+        if 'pid' in pheaders:
+            self.pids.append(pheaders['pid'])
+
+class ProcessBatch:
+    """Batched events grouped by process, in the order the processes
+    first appeared.  Memory is bounded:  only the last message and
+    `max_pids` pids are kept per process, and events of processes beyond
+    the first `max_processes` are only counted."""
+
+    def __init__(self, max_processes=100, max_pids=10):
+        self.max_processes = max_processes
+        self.max_pids = max_pids
+        self.clear()
+
+    def __len__(self):
+        return len(self.order)
+
+    def add(self, pheaders, msg, when):
+        namespec = make_namespec(pheaders['groupname'],
+                                 pheaders['processname'])
+        entry = self.entries.get(namespec)
+        if entry is None:
+            if len(self.order) >= self.max_processes:
+                self.dropped += 1
+                return None
+            entry = self.entries[namespec] = BatchEntry(self.max_pids)
+            self.order.append(namespec)
+        entry.add(pheaders, msg, when)
+        return entry
+
+    def get_entries(self):
+        return [self.entries[namespec] for namespec in self.order]
+
+    def clear(self):
+        self.entries = {}
+        self.order = []
+        self.dropped = 0
+
+class ProcessStateMonitor(EventListener):
 
     # In child class, define a list of events to monitor
     process_state_events = []
 
+    # the events handled, by prefix, when run by the superlance host
+    listener_events = ('PROCESS_STATE', 'TICK')
+
+    # In child class, set to True to batch one entry per process (see
+    # ProcessBatch) rather than one message per event; the last lines
+    # of the process logs are then read once per process, when the
+    # batch is sent
+    group_by_process = False
+
+    # In child class, list the events critical enough to be sent at
+    # once, each in a notification of its own, rather than batched; they
+    # are monitored in addition to process_state_events
+    immediate_events = []
+
     def __init__(self, **kwargs):
+        EventListener.__init__(self, kwargs.get('reconcile_ticks', 0),
+                               kwargs.get('detect_gaps', True))
         self.interval = kwargs.get('interval', 1.0)
+        immediate_events = kwargs.get('immediate_events')
+        if immediate_events is not None:
+            self.immediate_events = get_event_names(immediate_events)
 
         self.debug = kwargs.get('debug', False)
         self.stdin = kwargs.get('stdin', sys.stdin)
@@ -36,9 +138,39 @@ class ProcessStateMonitor:
         self.tickmins = self._get_tick_mins(self.eventname)
         self.stderr_lines = kwargs.get('stderr_lines')
         self.stdout_lines = kwargs.get('stdout_lines')
+        self.log_follower = None
+        if kwargs.get('follow_logs'):
+            self.log_follower = LogFollower(self.stderr_lines,
+                                            self.stdout_lines)
 
+        # a batch is sent when it is `interval` minutes old, timed with
+        # a monotonic clock rather than by counting TICK events (from the
+        # TICK event that sent the previous batch, give or take half a
+        # tick period), or as soon as it holds max_batch_msgs messages or
+        # max_batch_bytes bytes of messages
+        self.clock = kwargs.get('clock', monotonic)
+        self.max_batch_msgs = kwargs.get('max_batch_msgs')
+        self.max_batch_bytes = kwargs.get('max_batch_bytes')
         self.batchmsgs = []
-        self.batchmins = 0.0
+        self.batch = ProcessBatch(kwargs.get('max_batch_processes', 100))
+        self.batch_started = self.clock()
+        self.batch_count = 0
+        self.batch_bytes = 0
+
+        # notifications are delivered by a background thread while run()
+        # is running, otherwise synchronously
+        self.sender = None
+        self.send_queue_size = kwargs.get('send_queue_size', 100)
+        self.send_retries = kwargs.get('send_retries', 3)
+        self.shutdown_timeout = kwargs.get('shutdown_timeout', 30)
+
+        # with a spool directory, the batched messages and the queued
+        # notifications are journaled on disk until they are sent, and
+        # what a previous run left there is sent by run()
+        self.spool = None
+        if kwargs.get('spool_dir'):
+            self.spool = Spool(kwargs['spool_dir'])
+        self.batch_spool_ids = []
 
     def _get_tick_mins(self, eventname):
         return float(self._get_tick_secs(eventname))/60.0
@@ -52,13 +184,52 @@ class ProcessStateMonitor:
             raise ValueError("Invalid TICK event name: %s" % eventname)
 
     def run(self):
-        while 1:
-            hdrs, payload = childutils.listener.wait(self.stdin, self.stdout)
-            self.handle_event(hdrs, payload)
-            childutils.listener.ok(self.stdout)
+        signal.signal(signal.SIGTERM, self._exit_on_signal)
+        self.start()
+        try:
+            while 1:
+                hdrs, payload = self.wait_for_event()
+                self.dispatch_event(hdrs, payload)
+                childutils.listener.ok(self.stdout)
+        finally:
+            self.stop()
+
+    def start(self):
+        self.start_sender()
+        self.replay_spool()
+
+    def stop(self):
+        self.stop_sender()
+        if self.spool is not None:
+            self.spool.close()
+
+    def dispatch_event(self, headers, payload):
+        result = EventListener.dispatch_event(self, headers, payload)
+        if self.spool is not None:
+            # one fsync per event, before supervisord forgets it
+            self.spool.sync()
+        return result
+
+    def _exit_on_signal(self, signum, frame):
+        # unwind run() so that queued notifications are flushed
+        sys.exit(0)
+
+    def start_sender(self):
+        self.sender = BackgroundSender(self.deliver_queued_notification,
+                                       maxsize=self.send_queue_size,
+                                       retries=self.send_retries,
+                                       log=self.write_stderr)
+        self.sender.start()
+
+    def stop_sender(self):
+        sender, self.sender = self.sender, None
+        if sender is not None and not sender.close(self.shutdown_timeout):
+            self.write_stderr('Gave up waiting for notifications to be '
+                              'sent\n')
 
     def handle_event(self, headers, payload):
-        if headers['eventname'] in self.process_state_events:
+        if (headers['eventname'] in self.process_state_events or
+                headers['eventname'] in self.immediate_events):
             self.handle_process_state_change_event(headers, payload)
         elif headers['eventname'] == self.eventname:
             self.handle_tick_event(headers, payload)
@@ -67,7 +238,40 @@ class ProcessStateMonitor:
         msg = self.get_process_state_change_msg(headers, payload)
         if msg:
             self.write_stderr('%s\n' % msg)
+            pheaders = None
+            if self.group_by_process:
+                pheaders, pdata = childutils.eventdata(payload+'\n')
+            when = self.get_event_time()
+            if headers['eventname'] in self.immediate_events:
+                self.send_immediate_notification(
+                    self.get_immediate_msgs(msg, pheaders, when))
+                return
+            if self.spool is not None:
+                spool_id = self.spool.append({'kind': 'event', 'msg': msg,
+                                              'pheaders': pheaders,
+                                              'when': when})
+                self.batch_spool_ids.append(spool_id)
+            self.add_to_batch(msg, pheaders, when)
+            if self.batch_is_full():
+                self.send_batch_notification()
+                self.clear_batch()
+
+    def add_to_batch(self, msg, pheaders, when):
+        if self.group_by_process and pheaders is not None:
+            self.batch.add(pheaders, msg, when)
+        else:
             self.batchmsgs.append(msg)
+        self.batch_count += 1
+        self.batch_bytes += len(msg)
+
+    def batch_is_full(self):
+        return ((self.max_batch_msgs and
+                 self.batch_count >= self.max_batch_msgs) or
+                (self.max_batch_bytes and
+                 self.batch_bytes >= self.max_batch_bytes))
+
+    def get_event_time(self):
+        return time.time()
 
     """
     Override this method in child classes to customize messaging
@@ -76,26 +280,153 @@ class ProcessStateMonitor:
         return None
 
     def handle_tick_event(self, headers, payload):
-        self.batchmins += self.tickmins
-        if self.batchmins >= self.interval:
+        now = self.clock()
+        if self.log_follower is not None:
+            self.log_follower.poll()
+        # TICK events do not come exactly every tick period:  without the
+        # tolerance, a batch would wait for the next one
+        if self.get_batch_minutes(now) + self.tickmins / 2 >= self.interval:
             self.send_batch_notification()
-            self.clear_batch()
+            # the next batch starts with this tick, not once this one
+            # was sent
+            self.clear_batch(now)
+        self.resend_spooled()
 
     """
-    Override this method in child classes to send notification
+    Override this method in child classes to send notification, e.g. by
+    passing it to queue_notification
     """
     def send_batch_notification(self):
         pass
 
-    def get_batch_minutes(self):
-        return self.batchmins
+    """
+    Override this method in child classes to deliver a notification
+    queued by queue_notification.  Raise on failure to have the
+    delivery retried.
+    """
+    def deliver_notification(self, notification):
+        pass
+
+    """
+    Override this method in child classes to send the notification of
+    one of the immediate_events
+    """
+    def send_immediate_notification(self, msgs):
+        pass
+
+    def get_immediate_msgs(self, msg, pheaders, when):
+        if self.group_by_process and pheaders is not None:
+            entry = BatchEntry(1)
+            entry.add(pheaders, msg, when)
+            return self.format_batch_entries([entry])
+        return [msg]
+
+    def queue_notification(self, notification):
+        spool_id = None
+        if self.spool is not None:
+            spool_id = self.spool.append({'kind': 'notification',
+                                          'notification': notification})
+        if self.sender is not None:
+            self.sender.submit((spool_id, notification))
+        elif self.send_notification(notification):
+            self.ack_notification(spool_id)
+
+    def send_notification(self, notification):
+        """Deliver a notification synchronously, returning True if it
+        was delivered"""
+        try:
+            self.deliver_notification(notification)
+        except Exception as e:
+            self.write_stderr('Error sending notification: %s\n' % e)
+            return False
+        return True
+
+    def deliver_queued_notification(self, item):
+        spool_id, notification = item
+        self.deliver_notification(notification)
+        self.ack_notification(spool_id)
+
+    def ack_notification(self, spool_id):
+        if spool_id is not None:
+            self.spool.ack([spool_id])
+
+    def replay_spool(self):
+        """Put back what a previous run left in the spool:  the
+        messages of the batch it did not send, and the notifications it
+        did not deliver"""
+        if self.spool is None:
+            return
+        for spool_id, record in self.spool.pending('event'):
+            self.batch_spool_ids.append(spool_id)
+            self.add_to_batch(record['msg'], record['pheaders'],
+                              record['when'])
+        self.resend_spooled()
+
+    def resend_spooled(self):
+        # notifications the sender dropped or gave up on stay in the
+        # spool; they are submitted again whenever the sender is idle
+        if (self.spool is None or self.sender is None or
+                self.sender.pending()):
+            return
+        pending = self.spool.pending('notification')
+        for spool_id, record in pending[:self.send_queue_size]:
+            self.sender.submit((spool_id, record['notification']))
+
+    def get_batch_minutes(self, now=None):
+        if now is None:
+            now = self.clock()
+        return (now - self.batch_started) / 60.0
 
     def get_batch_msgs(self):
+        if self.group_by_process:
+            return self.get_grouped_batch_msgs()
         return self.batchmsgs
 
-    def clear_batch(self):
-        self.batchmins = 0.0;
+    def get_grouped_batch_msgs(self):
+        msgs = self.format_batch_entries(self.batch.get_entries())
+        if self.batch.dropped:
+            msgs.append('%d more events from other processes\n' %
+                        self.batch.dropped)
+        return msgs
+
+    def format_batch_entries(self, entries):
+        if self.stderr_lines or self.stdout_lines:
+            pheaders_list = [entry.pheaders for entry in entries]
+            if self.log_follower is not None:
+                last_lines = [self.log_follower.get_last_lines(pheaders)
+                              for pheaders in pheaders_list]
+            else:
+                last_lines = get_last_lines_of_processes(
+                    pheaders_list, self.stderr_lines, self.stdout_lines)
+        else:
+            last_lines = [('', '')] * len(entries)
+        msgs = []
+        for entry, (stderr, stdout) in zip(entries, last_lines):
+            msg = entry.msg
+            if entry.count > 1:
+                msg += '(%d times between %s and %s' % (
+                    entry.count, childutils.get_asctime(entry.first),
+                    childutils.get_asctime(entry.last))
+                if entry.pids:
+                    msg += ', last pids %s' % ', '.join(entry.pids)
+                msg += ')\n'
+            msg += format_last_lines(stderr, stdout, self.stderr_lines,
+                                     self.stdout_lines)
+            msgs.append(msg)
+        return msgs
+
+    def clear_batch(self, started=None):
+        if started is None:
+            started = self.clock()
+        self.batch_started = started
+        self.batch_count = 0
+        self.batch_bytes = 0
         self.batchmsgs = [];
+        self.batch.clear()
+        if self.batch_spool_ids:
+            # the messages are in the notification now
+            self.spool.ack(self.batch_spool_ids)
+            self.batch_spool_ids = []
 
     def write_stderr(self, msg):
         self.stderr.write(msg)
@@ -0,0 +1,135 @@
+##############################################################################
+#
+# Copyright (c) 2007 Agendaless Consulting and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the BSD-like license at
+# http://www.repoze.org/LICENSE.txt.  A copy of the license should accompany
+# this distribution.  THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL
+# EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND
+# FITNESS FOR A PARTICULAR PURPOSE
+#
+##############################################################################
+doc = """\
+A process-wide XML-RPC client for talking to the supervisord that runs
+this listener, shared by all the code in the process.
+"""
+
+import os
+import socket
+
+from superlance.compat import httplib
+from supervisor import childutils
+
+class PersistentRPCInterface:
+    """A proxy to supervisord's XML-RPC interface that keeps one
+    connection open across calls instead of connecting for each one,
+    and reconnects when the connection breaks, e.g. because supervisord
+    closed an idle keep-alive connection.  Read-only calls are then
+    retried once; the others (stopProcess, signalProcess, ...) may have
+    been carried out before the connection broke, so their error is
+    raised rather than risking doing them twice.  Calls look the same
+    as on the proxy returned by childutils.getRPCInterface, e.g.
+    rpc.supervisor.getAllProcessInfo().
+
+    With cache_snapshot set, the result of getAllProcessInfo is kept, so
+    that the code handling one event shares one snapshot, until
+    invalidate_snapshot is called or a method that may change the state
+    of processes (any but get*, list*, read* and tail* methods) is.
+    """
+    retry_errors = (socket.error, httplib.HTTPException)
+    read_only_prefixes = ('get', 'list', 'read', 'tail')
+
+    def __init__(self, env):
+        self.env = env
+        self.proxy = None
+        self.cache_snapshot = False
+        self.snapshot = None
+        # raises KeyError now, rather than on the first call, if we are
+        # not running under supervisord
+        self.connect()
+
+    def connect(self):
+        self.proxy = childutils.getRPCInterface(self.env)
+
+    def close(self):
+        if self.proxy is not None:
+            try:
+                self.proxy('close')()
+            except Exception:
+                pass
+            self.proxy = None
+
+    def invalidate_snapshot(self):
+        self.snapshot = None
+
+    def is_read_only(self, methodname, args):
+        if methodname == 'system.multicall':
+            return all([self.is_read_only(call['methodName'], ())
+                        for call in args[0]])
+        name = methodname.split('.')[-1]
+        return name.startswith(self.read_only_prefixes)
+
+    def call(self, methodname, args):
+        if not self.cache_snapshot:
+            return self._call(methodname, args)
+        if methodname == 'supervisor.getAllProcessInfo':
+            if self.snapshot is None:
+                self.snapshot = self._call(methodname, args)
+            # callers may change the dicts they are given
+            return [dict(info) for info in self.snapshot]
+        if not self.is_read_only(methodname, args):
+            self.snapshot = None
+        return self._call(methodname, args)
+
+    def _call(self, methodname, args):
+        for attempt in (1, 2):
+            if self.proxy is None:
+                self.connect()
+            method = self.proxy
+            for name in methodname.split('.'):
+                method = getattr(method, name)
+            try:
+                return method(*args)
+            except self.retry_errors:
+                self.close()
+                if attempt == 2 or not self.is_read_only(methodname, args):
+                    raise
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return _Method(self, name)
+
+class _Method:
+    def __init__(self, rpc, name):
+        self.rpc = rpc
+        self.name = name
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return _Method(self.rpc, '%s.%s' % (self.name, name))
+
+    def __call__(self, *args):
+        return self.rpc.call(self.name, args)
+
+_shared = None
+
+def get_rpc_interface(env=None):
+    """Return the process-wide PersistentRPCInterface, creating it from
+    env (default os.environ) on first use."""
+    global _shared
+    if _shared is None:
+        if env is None:
+            env = os.environ
+        _shared = PersistentRPCInterface(env)
+    return _shared
+
+def reset_rpc_interface():
+    """Close and forget the process-wide interface."""
+    global _shared
+    if _shared is not None:
+        _shared.close()
+        _shared = None
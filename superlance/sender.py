@@ -0,0 +1,127 @@
+##############################################################################
+#
+# Copyright (c) 2007 Agendaless Consulting and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the BSD-like license at
+# http://www.repoze.org/LICENSE.txt.  A copy of the license should accompany
+# this distribution.  THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL
+# EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND
+# FITNESS FOR A PARTICULAR PURPOSE
+#
+##############################################################################
+doc = """\
+Delivery of notifications from a background thread, so that a listener
+can acknowledge events without waiting on the network.
+"""
+
+import sys
+import threading
+import time
+
+from superlance.compat import monotonic
+from superlance.compat import queue
+
+class BackgroundSender:
+    """Delivers items (e.g. emails) by calling `deliver(item)` from a
+    background thread.
+
+    `submit` never blocks:  at most `maxsize` items wait for delivery,
+    and when the queue is full the oldest waiting item is dropped.  A
+    delivery that raises is retried `retries` times, waiting
+    `retry_delay` seconds before the first retry and twice as long
+    before each of the next.  `close` delivers what is still queued.
+    """
+
+    _stop = object()
+
+    def __init__(self, deliver, maxsize=100, retries=3, retry_delay=1.0,
+                 log=None, sleep=time.sleep):
+        self.deliver = deliver
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.log = log
+        self.sleep = sleep
+        self.queue = queue.Queue(maxsize)
+        self.thread = None
+        self.dropped = 0
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def submit(self, item):
+        while True:
+            try:
+                self.queue.put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    self.queue.get_nowait()
+                except queue.Empty:
+                    continue
+                self.queue.task_done()
+                self.dropped += 1
+                self.write_log('Notification queue full, dropped the '
+                               'oldest notification\n')
+
+    def close(self, timeout=None):
+        """Deliver the queued items, waiting at most `timeout` seconds,
+        and stop the thread.  Returns False if items were left."""
+        if self.thread is None:
+            return True
+        deadline = None
+        if timeout is not None:
+            deadline = monotonic() + timeout
+        # unlike submit, wait for room rather than dropping an item, but
+        # no longer than the timeout
+        try:
+            self.queue.put(self._stop, True, timeout)
+        except queue.Full:
+            return False
+        if deadline is not None:
+            timeout = max(0, deadline - monotonic())
+        self.thread.join(timeout)
+        alive = self.thread.is_alive()
+        if not alive:
+            self.thread = None
+        return not alive
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is self._stop:
+                self.queue.task_done()
+                return
+            try:
+                self.send(item)
+            finally:
+                self.queue.task_done()
+
+    def pending(self):
+        """Return the number of items queued or being delivered."""
+        return self.queue.unfinished_tasks
+
+    def send(self, item):
+        delay = self.retry_delay
+        for attempt in range(self.retries + 1):
+            try:
+                self.deliver(item)
+                return True
+            except Exception:
+                error = sys.exc_info()[1]
+                if attempt == self.retries:
+                    self.write_log('Error sending notification, giving up '
+                                   'after %d attempts: %s\n' %
+                                   (attempt + 1, error))
+                    return False
+                self.write_log('Error sending notification, retrying in '
+                               '%s seconds: %s\n' % (delay, error))
+                self.sleep(delay)
+                delay *= 2
+
+    def write_log(self, msg):
+        if self.log is not None:
+            self.log(msg)
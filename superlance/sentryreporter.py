@@ -49,60 +49,124 @@ optional arguments:
                         the number of stdout lines to read (default: 10)
   -r STDERR_LINES, --stderr-lines STDERR_LINES
                         the number of stderr lines to read (default: 10)
+  -l LOOP_THRESHOLD, --loop-threshold LOOP_THRESHOLD
+                        the number of events of a process within the loop
+                        window that make a crash loop: it is reported once,
+                        its next events are not, and a summary is sent when
+                        it ends, on the next event after it ended (subscribe
+                        to TICK_60 or similar too) (0 reports every event)
+                        (default: 5)
+  -L LOOP_WINDOW, --loop-window LOOP_WINDOW
+                        the crash loop window, in seconds (default: 60.0)
+  -R RECONCILE_TICKS, --reconcile-ticks RECONCILE_TICKS
+                        every this many TICK events (subscribe to TICK_60 or
+                        similar too), fetch the state of all processes and
+                        report the transitions that were not received as
+                        events (0 turns it off) (default: 0)
+  -G, --no-gap-detection
+                        do not notice the events supervisord dropped, from
+                        gaps in the poolserial header (turned off by itself
+                        when the listener pool has several processes)
+                        (default: True)
 """
 
 import argparse
 import hashlib
 import os
 import sys
-import raven
 
+from superlance.crashloop import (
+    LOOP,
+    SUPPRESSED,
+    THRESHOLD,
+    WINDOW,
+    CrashLoopTracker,
+)
 from superlance.helpers import (
-    get_last_lines_of_process_stderr_unwrapped,
-    get_last_lines_of_process_stdout_unwrapped,
+    LogFollower,
+    get_last_lines_of_process,
 )
+from superlance.listener import EventListener
 from supervisor import childutils
+from supervisor.compat import as_bytes
+from supervisor.options import make_namespec
 
 
 SENTRY_STRING_MAX_LENGTH = 4096
 
+# imported on first use (see get_raven):  it takes longer to import than
+# the rest of the listener
+raven = None
+
+def get_raven():
+    global raven
+    if raven is None:
+        raven = __import__('raven')
+    return raven
 
-class SentryReporter:
+
+class SentryReporter(EventListener):
+    # the events handled, by prefix, when run by the superlance host
+    listener_events = ('PROCESS_STATE', 'TICK')
 
     EVENT_NAMES = {
         'crash': 'PROCESS_STATE_EXITED',
         'fatal': 'PROCESS_STATE_FATAL',
     }
 
-    def __init__(self, sentry_dsn, stderr_lines, stdout_lines):
+    def __init__(self, sentry_dsn, stderr_lines, stdout_lines,
+                 follow_logs=False, loop_threshold=THRESHOLD,
+                 loop_window=WINDOW, reconcile_ticks=0, event_type='crash',
+                 detect_gaps=True):
+        EventListener.__init__(self, reconcile_ticks, detect_gaps)
+        self.event_type = event_type
         self.sentry_dsn = sentry_dsn
         self.stderr_lines = stderr_lines
         self.stdout_lines = stdout_lines
+        self.log_follower = None
+        if follow_logs:
+            self.log_follower = LogFollower(stderr_lines, stdout_lines)
+        self.crash_loops = CrashLoopTracker(loop_threshold, loop_window)
         # create and use self.{stdin,stdout,stderr} to make it easier to test
         self.stdin = sys.stdin
         self.stdout = sys.stdout
         self.stderr = sys.stderr
 
     def runforever(self, event_type):
+        self.event_type = event_type
         while True:
-            pheaders, should_ignore = self.get_event_details(event_type)
+            headers, payload = self.wait_for_event()
+            self.dispatch_event(headers, payload)
+            childutils.listener.ok(self.stdout)
 
-            if should_ignore:
-                childutils.listener.ok(self.stdout)
-                continue
+    def handle_event(self, headers, payload):
+        pheaders, pdata = childutils.eventdata(payload+'\n')
 
-            msg_header = 'Process %(groupname)s:%(processname)s exited unexpectedly' % pheaders
-            stderr, stdout = self.get_notification_message(pheaders)
-            self.notify_sentry(msg_header, stderr, stdout, event_type)
+        if (self.log_follower is not None and
+                headers['eventname'].startswith('TICK_')):
+            self.log_follower.poll()
 
-            childutils.listener.ok(self.stdout)
+        for loop in self.crash_loops.expire():
+            self.notify_sentry(loop.get_summary().rstrip('\n'), '', '',
+                               self.event_type)
 
-    def get_event_details(self, event_type):
-        headers, payload = childutils.listener.wait(self.stdin, self.stdout)
-        pheaders, pdata = childutils.eventdata(payload+'\n')
+        if self.ignore_event(headers, pheaders, self.event_type):
+            return
 
-        ignore = self.ignore_event(headers, pheaders, event_type)
-        return pheaders, ignore
+        namespec = make_namespec(pheaders['groupname'],
+                                 pheaders['processname'])
+        action = self.crash_loops.crashed(namespec)
+        if action == SUPPRESSED:
+            return
+
+        msg_header = 'Process %(groupname)s:%(processname)s exited unexpectedly' % pheaders
+        if action == LOOP:
+            msg_header = ('Process %s is crash looping: %d events within '
+                          '%d seconds' % (namespec,
+                                          self.crash_loops.threshold,
+                                          self.crash_loops.window))
+        stderr, stdout = self.get_notification_message(pheaders)
+        self.notify_sentry(msg_header, stderr, stdout, self.event_type)
 
     def ignore_event(self, headers, pheaders, event_type):
         # 1) event must be an expected event
@@ -111,17 +175,16 @@ class SentryReporter:
                 (event_type == 'crash' and int(pheaders['expected'])))
 
     def get_notification_message(self, pheaders):
-        stderr = ''
-        stdout = ''
-        if self.stderr_lines:
-            stderr = get_last_lines_of_process_stderr_unwrapped(pheaders, self.stderr_lines)
-        if self.stdout_lines:
-            stdout = get_last_lines_of_process_stdout_unwrapped(pheaders, self.stdout_lines)
-        return (stderr, stdout)
+        if not (self.stderr_lines or self.stdout_lines):
+            return ('', '')
+        if self.log_follower is not None:
+            return self.log_follower.get_last_lines(pheaders)
+        return get_last_lines_of_process(
+            pheaders, self.stderr_lines, self.stdout_lines)
 
     def notify_sentry(self, header, stderr, stdout, event_type):
         self.stderr.write('unexpected {}, notifying sentry\n'.format(event_type))
-        client = raven.Client(
+        client = get_raven().Client(
             dsn=self.sentry_dsn,
             string_max_length=SENTRY_STRING_MAX_LENGTH,
         )
@@ -143,10 +206,10 @@ class SentryReporter:
             self.stderr.write("Error notifying Sentry: {}\n".format(e))
 
     def _md5(self, msg):
-        return hashlib.md5(msg).hexdigest()
+        return hashlib.md5(as_bytes(msg)).hexdigest()
 
 
-def main():
+def sentryreporter_from_args(arguments):
     parser = argparse.ArgumentParser(
         formatter_class=argparse.ArgumentDefaultsHelpFormatter,
         description='''\
@@ -171,9 +234,41 @@ events.  It will send notifications to Sentry when processes that are children o
                         type=int,
                         default=10,
                         help='the number of stderr lines to read')
+    parser.add_argument('-F', '--follow-logs',
+                        dest='follow_logs',
+                        action='store_true',
+                        help='follow the process logs in memory on each TICK event (subscribe to TICK_5 or similar too), so that the lines reported are those written just before the event')
+    parser.add_argument('-l', '--loop-threshold',
+                        dest='loop_threshold',
+                        type=int,
+                        default=THRESHOLD,
+                        help='the number of events of a process within the loop window that make a crash loop: it is reported once, its next events are not, and a summary is sent when it ends, on the next event after it ended (subscribe to TICK_60 or similar too) (0 reports every event)')
+    parser.add_argument('-L', '--loop-window',
+                        dest='loop_window',
+                        type=float,
+                        default=WINDOW,
+                        help='the crash loop window, in seconds')
+    parser.add_argument('-R', '--reconcile-ticks',
+                        dest='reconcile_ticks',
+                        type=int,
+                        default=0,
+                        help='every this many TICK events (subscribe to TICK_60 or similar too), fetch the state of all processes and report the transitions that were not received as events (0 turns it off)')
+    parser.add_argument('-G', '--no-gap-detection',
+                        dest='detect_gaps',
+                        action='store_false',
+                        help='do not notice the events supervisord dropped, from gaps in the poolserial header (turned off by itself when the listener pool has several processes)')
 
-    args = parser.parse_args()
-    if not args.sentry_dsn and 'SENTRY_DSN' not in os.environ:
+    args = parser.parse_args(arguments)
+    return SentryReporter(args.sentry_dsn, args.stderr_lines,
+                          args.stdout_lines, args.follow_logs,
+                          args.loop_threshold, args.loop_window,
+                          args.reconcile_ticks, args.event_type,
+                          args.detect_gaps)
+
+
+def main():
+    prog = sentryreporter_from_args(sys.argv[1:])
+    if not prog.sentry_dsn and 'SENTRY_DSN' not in os.environ:
         sys.stderr.write("You must specify the --sentry-dsn option or export the SENTRY_DSN variable (neither of them were specified).\n")
         sys.exit(1)
 
@@ -181,8 +276,7 @@ events.  It will send notifications to Sentry when processes that are children o
         sys.stderr.write('sentryreporter must be run as a supervisor event listener\n')
         sys.exit(1)
 
-    prog = SentryReporter(args.sentry_dsn, args.stderr_lines, args.stdout_lines)
-    prog.runforever(args.event_type)
+    prog.runforever(prog.event_type)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,176 @@
+##############################################################################
+#
+# Copyright (c) 2007 Agendaless Consulting and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the BSD-like license at
+# http://www.repoze.org/LICENSE.txt.  A copy of the license should accompany
+# this distribution.  THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL
+# EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND
+# FITNESS FOR A PARTICULAR PURPOSE
+#
+##############################################################################
+doc = """\
+An append-only on-disk journal of records (e.g. notifications) waiting
+to be handled, so that a listener that is restarted loses nothing.
+"""
+
+import json
+import os
+import re
+import threading
+
+SEGMENT_BYTES = 1024 * 1024 # 1mb
+
+class Spool:
+    """A journal of JSON records kept in `directory`.
+
+    `append` adds a record and returns its id; `ack` marks records as
+    handled.  Both write a line to the newest segment file, which is
+    replaced by a new one once it holds `segment_bytes`.  Writes are
+    flushed at once but only fsync'ed by `sync`, so that a listener can
+    make everything it wrote while handling an event durable with a
+    single fsync.  Segments are deleted, oldest first, once all their
+    records are acknowledged.  On opening, the records not acknowledged
+    yet are found again:  `pending` reads them back from disk, so a
+    large backlog does not have to fit in memory.
+    """
+
+    segment_re = re.compile(r'^(\d{8})\.spool$')
+
+    def __init__(self, directory, segment_bytes=SEGMENT_BYTES):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.lock = threading.Lock()
+        self.segments = []
+        self.unacked = {} # {id: segment}
+        self.next_id = 1
+        self.file = None
+        self.size = 0
+        self.dirty = False
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._load()
+        # always write to a new segment, so that nothing is appended to
+        # a line left half-written by a crash
+        self._open_segment()
+        self._compact()
+
+    def append(self, record):
+        with self.lock:
+            id = self.next_id
+            self.next_id += 1
+            self._write({'id': id, 'record': record})
+            self.unacked[id] = self.segments[-1]
+            if self.size >= self.segment_bytes:
+                self._rotate()
+            return id
+
+    def ack(self, ids):
+        with self.lock:
+            ids = [id for id in ids if id in self.unacked]
+            if not ids:
+                return
+            self._write({'ack': ids})
+            for id in ids:
+                del self.unacked[id]
+            self._compact()
+
+    def sync(self):
+        with self.lock:
+            if self.dirty:
+                os.fsync(self.file.fileno())
+                self.dirty = False
+
+    def pending(self, kind=None):
+        """Return the (id, record) pairs not acknowledged yet, oldest
+        first, keeping only records whose 'kind' is kind if given."""
+        with self.lock:
+            segments = list(self.segments)
+        result = []
+        for segment in segments:
+            for entry in self._read(segment):
+                id = entry.get('id')
+                if id not in self.unacked:
+                    continue
+                record = entry['record']
+                if kind is None or record.get('kind') == kind:
+                    result.append((id, record))
+        return result
+
+    def __len__(self):
+        return len(self.unacked)
+
+    def close(self):
+        self.sync()
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+    def _path(self, segment):
+        return os.path.join(self.directory, '%08d.spool' % segment)
+
+    def _read(self, segment):
+        try:
+            f = open(self._path(segment), 'r')
+        except IOError:
+            return
+        try:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    # a line left half-written by a crash
+                    continue
+        finally:
+            f.close()
+
+    def _load(self):
+        for name in sorted(os.listdir(self.directory)):
+            match = self.segment_re.match(name)
+            if match:
+                self.segments.append(int(match.group(1)))
+        for segment in self.segments:
+            for entry in self._read(segment):
+                if 'ack' in entry:
+                    for id in entry['ack']:
+                        self.unacked.pop(id, None)
+                elif 'id' in entry:
+                    self.unacked[entry['id']] = segment
+                    self.next_id = max(self.next_id, entry['id'] + 1)
+
+    def _write(self, entry):
+        line = json.dumps(entry) + '\n'
+        self.file.write(line)
+        self.file.flush()
+        self.size += len(line)
+        self.dirty = True
+
+    def _open_segment(self):
+        if self.segments:
+            segment = self.segments[-1] + 1
+        else:
+            segment = 1
+        self.segments.append(segment)
+        self.file = open(self._path(segment), 'a')
+        self.size = 0
+
+    def _rotate(self):
+        if self.dirty:
+            os.fsync(self.file.fileno())
+            self.dirty = False
+        self.file.close()
+        self._open_segment()
+
+    def _compact(self):
+        # delete fully acknowledged segments, oldest first only:  a
+        # segment may hold the acks of records in older ones
+        live = set(self.unacked.values())
+        while len(self.segments) > 1 and self.segments[0] not in live:
+            try:
+                os.remove(self._path(self.segments[0]))
+            except OSError:
+                pass
+            del self.segments[0]
@@ -0,0 +1,339 @@
+doc = """\
+benchmark.py [-n events] [-p processes] [-t tick_every] [-v] [listener ...]
+
+Measures how many events per second each listener handles.  Every
+listener runs in a child process and is fed a synthetic stream of TICK
+and PROCESS_STATE events through the event listener protocol, over
+pipes, as supervisord would do.  Its XML-RPC interface is the dummy one
+of the tests, with as many processes as asked for.  Mail, Sentry and
+HTTP checks go nowhere, and memmon makes up the RSS of each process
+instead of running ps.
+
+For each listener, the events handled per second, percentiles of the
+time taken to acknowledge an event and the peak RSS of the child process
+are reported.  The peak RSS includes the interpreter and what the
+benchmark imported before forking.
+
+Options:
+
+-n -- the number of events sent to each listener (default 1000)
+
+-p -- the number of processes supervisord manages (default 1000)
+
+-t -- send a TICK_60 event every this many events (default 10)
+
+-v -- let the listeners write to stderr
+
+The listeners are memmon, httpok, crashmail, crashmailbatch,
+sentryreporter and superlance (all of the others in one process); all of
+them by default.  A sample invocation:
+
+python -m superlance.tests.benchmark -n 5000 -p 2000 crashmail memmon
+"""
+
+import os
+import select
+import sys
+import time
+import traceback
+
+from superlance import mailer
+from superlance.compat import monotonic
+from superlance.tests.dummy import DummyResponse
+from superlance.tests.dummy import DummyRPCServer
+from superlance.tests.dummy import make_process_infos
+
+NULL_TRANSPORT = 'null://benchmark'
+
+LISTENERS = {
+    'memmon': ['memmon -a 1GB -m dev@example.com -s %s' % NULL_TRANSPORT],
+    'httpok': ['httpok -p group_0000: -m dev@example.com -s %s '
+               'http://localhost/' % NULL_TRANSPORT],
+    'crashmail': ['crashmail -a -m dev@example.com -s %s '
+                  '--stderr_lines=0 --stdout_lines=0' % NULL_TRANSPORT],
+    'crashmailbatch': ['crashmailbatch -t dev@example.com '
+                       '-f supervisord@example.com -H %s -q 0 -w 0'
+                       % NULL_TRANSPORT],
+    'sentryreporter': ['sentryreporter -e crash '
+                       '-s http://key@sentry.example.com/1 -o 0 -r 0'],
+}
+LISTENERS['superlance'] = [LISTENERS[name][0] for name in (
+    'memmon', 'httpok', 'crashmail', 'crashmailbatch', 'sentryreporter')]
+ORDER = ('memmon', 'httpok', 'crashmail', 'crashmailbatch',
+         'sentryreporter', 'superlance')
+
+# (eventname, state the process was in), in turn for each process event
+TRANSITIONS = (
+    ('PROCESS_STATE_EXITED', 'RUNNING'),
+    ('PROCESS_STATE_STARTING', 'EXITED'),
+    ('PROCESS_STATE_RUNNING', 'STARTING'),
+    )
+
+def usage():
+    print(doc)
+    sys.exit(255)
+
+class NullTransport:
+    """Counts the mail it is given instead of sending it."""
+
+    def __init__(self):
+        self.sent = 0
+
+    def send(self, message, to_addrs=None, from_addr=None):
+        self.sent += 1
+
+    def send_many(self, messages):
+        for message in messages:
+            self.send(message)
+
+    def close(self):
+        pass
+
+class NullRavenClient:
+    def __init__(self, **kwargs):
+        pass
+
+    def captureMessage(self, message, **kwargs):
+        pass
+
+class NullRaven:
+    Client = NullRavenClient
+
+class NullConnection:
+    """An HTTP connection to a server that always answers 200 OK."""
+
+    def __init__(self, hostport):
+        self.hostport = hostport
+
+    def request(self, method, path, headers=None):
+        pass
+
+    def getresponse(self):
+        return DummyResponse()
+
+def made_up_rss(pid):
+    return pid * 1024
+
+def make_events(count, infos, tick_every=10):
+    """Yield count (eventname, payload) pairs:  a TICK_60 event every
+    tick_every events and, between them, processes taken in turn exiting
+    unexpectedly, starting and running."""
+    now = int(time.time())
+    for i in range(count):
+        if tick_every and i % tick_every == 0:
+            yield 'TICK_60', 'when:%d' % (now + i)
+            continue
+        info = infos[i % len(infos)]
+        eventname, from_state = TRANSITIONS[i % len(TRANSITIONS)]
+        payload = 'processname:%s groupname:%s from_state:%s' % (
+            info['name'], info['group'], from_state)
+        if eventname == 'PROCESS_STATE_EXITED':
+            payload += ' expected:0 pid:%d' % info['pid']
+        elif eventname == 'PROCESS_STATE_RUNNING':
+            payload += ' pid:%d' % info['pid']
+        else:
+            payload += ' tries:0'
+        yield eventname, payload
+
+def encode_event(serial, eventname, payload):
+    body = payload.encode('ascii')
+    header = ('ver:3.0 server:supervisor serial:%d pool:benchmark '
+              'poolserial:%d eventname:%s len:%d\n' % (
+                  serial, serial, eventname, len(body)))
+    return header.encode('ascii') + body
+
+def percentile(values, pct):
+    """Return the pct percentile of sorted values (nearest rank)."""
+    if not values:
+        return 0.0
+    index = int(round(pct / 100.0 * len(values))) - 1
+    return values[min(max(index, 0), len(values) - 1)]
+
+def make_listener(name, infos, verbose=False):
+    """Return a callable running the listener name, set up to talk to
+    the dummy supervisord and to notify nobody."""
+    from superlance.host import ListenerHost, load_plugin
+    from superlance import rpc as rpc_module
+    from superlance import sentryreporter
+    mailer._transports[NULL_TRANSPORT] = NullTransport()
+    sentryreporter.raven = NullRaven
+    rpc = DummyRPCServer(infos)
+    # what the listeners get from get_rpc_interface() too
+    rpc_module._shared = rpc
+    devnull = open(os.devnull, 'w')
+
+    plugins = []
+    for spec in LISTENERS[name]:
+        plugin_name, plugin = load_plugin(spec)
+        if hasattr(plugin, 'rpc'):
+            plugin.rpc = rpc
+        if hasattr(plugin, 'connclass'):
+            plugin.connclass = NullConnection
+        if hasattr(plugin, 'calc_rss'):
+            plugin.calc_rss = made_up_rss
+        if not verbose:
+            plugin.stderr = devnull
+        plugins.append((plugin_name, plugin))
+
+    if name == 'superlance':
+        host = ListenerHost(plugins)
+        if not verbose:
+            host.stderr = devnull
+        return host.runforever
+    plugin = plugins[0][1]
+    if name == 'crashmailbatch':
+        return plugin.run
+    if name == 'sentryreporter':
+        return lambda: plugin.runforever(plugin.event_type)
+    return plugin.runforever
+
+def run_child(name, infos, verbose):
+    # sys.stdin and sys.stdout may not be fds 0 and 1 (e.g. when output
+    # is captured by a test runner)
+    sys.stdin = os.fdopen(0, 'r')
+    sys.stdout = os.fdopen(1, 'w')
+    try:
+        run = make_listener(name, infos, verbose)
+        run()
+    except BaseException:
+        # the listener stops with an error once its stdin is closed;
+        # anything else is worth a traceback
+        if not select.select([sys.stdin], [], [], 0)[0]:
+            traceback.print_exc()
+    sys.stderr.flush()
+
+def expect(stream, expected):
+    line = stream.readline()
+    if line != expected:
+        raise RuntimeError('Expected %r from the listener, got %r' % (
+            expected, line))
+
+class Result:
+    def __init__(self, name, latencies, elapsed, maxrss):
+        self.name = name
+        self.events = len(latencies)
+        self.elapsed = elapsed
+        self.latencies = sorted(latencies)
+        self.maxrss = maxrss # in bytes
+
+    @property
+    def events_per_second(self):
+        return self.elapsed and self.events / self.elapsed or 0.0
+
+    def latency(self, pct):
+        return percentile(self.latencies, pct)
+
+def benchmark(name, events, infos, verbose=False):
+    """Feed events, (eventname, payload) pairs, to the listener name
+    running in a child process, and return its Result."""
+    child_stdin, to_child = os.pipe()
+    from_child, child_stdout = os.pipe()
+    sys.stdout.flush()
+    sys.stderr.flush()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            os.close(to_child)
+            os.close(from_child)
+            os.dup2(child_stdin, 0)
+            os.dup2(child_stdout, 1)
+            run_child(name, infos, verbose)
+        finally:
+            os._exit(0)
+
+    os.close(child_stdin)
+    os.close(child_stdout)
+    to_child = os.fdopen(to_child, 'wb')
+    from_child = os.fdopen(from_child, 'rb')
+    try:
+        latencies, elapsed = feed_events(to_child, from_child, events)
+    finally:
+        to_child.close()
+        from_child.close()
+        _, _, rusage = os.wait4(pid, 0)
+    return Result(name, latencies, elapsed, get_maxrss(rusage))
+
+def feed_events(to_child, from_child, events):
+    """Send events, (eventname, payload) pairs, to a listener through
+    its stdin and stdout pipes, one at a time as supervisord does.
+    Return how long each took to be acknowledged, and how long it took
+    from sending the first event to the last acknowledgement."""
+    latencies = []
+    start = None
+    for serial, (eventname, payload) in enumerate(events, 1):
+        expect(from_child, b'READY\n')
+        data = encode_event(serial, eventname, payload)
+        sent = monotonic()
+        if start is None:
+            start = sent
+        to_child.write(data)
+        to_child.flush()
+        line = from_child.readline()
+        if not line.startswith(b'RESULT '):
+            raise RuntimeError('Expected a result for event %d from '
+                               'the listener, got %r' % (serial, line))
+        from_child.read(int(line.split()[1]))
+        latencies.append(monotonic() - sent)
+    elapsed = start is not None and monotonic() - start or 0.0
+    return latencies, elapsed
+
+def get_maxrss(rusage):
+    """Return the peak RSS in bytes from a resource usage struct."""
+    if sys.platform == 'darwin':
+        return rusage.ru_maxrss
+    return rusage.ru_maxrss * 1024 # in kilobytes
+
+def format_results(results):
+    width = max([15] + [len(result.name) for result in results])
+    lines = ['%-*s %8s %10s %8s %8s %8s %8s %8s' % (
+        width, 'listener', 'events', 'events/s', 'p50 ms', 'p90 ms',
+        'p99 ms', 'max ms', 'RSS MB')]
+    for result in results:
+        lines.append('%-*s %8d %10.1f %8.3f %8.3f %8.3f %8.3f %8.1f' % (
+            width, result.name, result.events, result.events_per_second,
+            result.latency(50) * 1000, result.latency(90) * 1000,
+            result.latency(99) * 1000, result.latency(100) * 1000,
+            result.maxrss / 1048576.0))
+    return '\n'.join(lines)
+
+def main(argv=sys.argv):
+    import getopt
+    short_args = 'hn:p:t:v'
+    long_args = ['help', 'events=', 'processes=', 'tick-every=', 'verbose']
+    try:
+        opts, args = getopt.getopt(argv[1:], short_args, long_args)
+    except:
+        usage()
+
+    count = 1000
+    processes = 1000
+    tick_every = 10
+    verbose = False
+
+    for option, value in opts:
+        if option in ('-h', '--help'):
+            usage()
+        if option in ('-n', '--events'):
+            count = int(value)
+        if option in ('-p', '--processes'):
+            processes = int(value)
+        if option in ('-t', '--tick-every'):
+            tick_every = int(value)
+        if option in ('-v', '--verbose'):
+            verbose = True
+
+    names = args or ORDER
+    for name in names:
+        if name not in LISTENERS:
+            sys.stderr.write('Unknown listener %s\n' % name)
+            usage()
+
+    infos = make_process_infos(processes)
+    results = []
+    for name in names:
+        events = make_events(count, infos, tick_every)
+        results.append(benchmark(name, events, infos, verbose))
+    print(format_results(results))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+import unittest
+from superlance.tests.dummy import make_process_infos
+
+class BenchmarkTests(unittest.TestCase):
+    def test_make_events(self):
+        from superlance.tests.benchmark import make_events
+        infos = make_process_infos(20)
+        events = list(make_events(7, infos, tick_every=5))
+        self.assertEqual(7, len(events))
+        self.assertEqual('TICK_60', events[0][0])
+        self.assertEqual('TICK_60', events[5][0])
+        self.assertEqual(('PROCESS_STATE_STARTING',
+                          'processname:proc_00001 groupname:group_0000 '
+                          'from_state:EXITED tries:0'), events[1])
+        self.assertEqual(('PROCESS_STATE_RUNNING',
+                          'processname:proc_00002 groupname:group_0000 '
+                          'from_state:STARTING pid:1002'), events[2])
+        self.assertEqual(('PROCESS_STATE_EXITED',
+                          'processname:proc_00003 groupname:group_0000 '
+                          'from_state:RUNNING expected:0 pid:1003'),
+                         events[3])
+
+    def test_encode_event(self):
+        from superlance.tests.benchmark import encode_event
+        self.assertEqual(
+            b'ver:3.0 server:supervisor serial:3 pool:benchmark '
+            b'poolserial:3 eventname:TICK_60 len:9\nwhen:1234',
+            encode_event(3, 'TICK_60', 'when:1234'))
+
+    def test_percentile(self):
+        from superlance.tests.benchmark import percentile
+        values = list(range(1, 101))
+        self.assertEqual(50, percentile(values, 50))
+        self.assertEqual(99, percentile(values, 99))
+        self.assertEqual(100, percentile(values, 100))
+        self.assertEqual(1, percentile(values, 0))
+        self.assertEqual(0.0, percentile([], 50))
+
+    def test_benchmark_every_listener(self):
+        from superlance.tests.benchmark import ORDER, benchmark, make_events
+        infos = make_process_infos(50)
+        for name in ORDER:
+            result = benchmark(name, make_events(30, infos), infos)
+            self.assertEqual(30, result.events, name)
+            self.assertTrue(result.events_per_second > 0, name)
+            self.assertTrue(result.latency(99) <= result.latency(100))
+            self.assertTrue(result.maxrss > 0, name)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import unittest
+
+class CrashLoopTrackerTests(unittest.TestCase):
+    def setUp(self):
+        self.now = 1000.0
+
+    def clock(self):
+        return self.now
+
+    def _makeOne(self, threshold=3, window=60.0):
+        from superlance.crashloop import CrashLoopTracker
+        return CrashLoopTracker(threshold, window, clock=self.clock,
+                                time=self.clock)
+
+    def test_crashes_below_threshold(self):
+        from superlance.crashloop import CRASH
+        tracker = self._makeOne()
+        self.assertEqual(CRASH, tracker.crashed('foo'))
+        self.now += 40
+        self.assertEqual(CRASH, tracker.crashed('foo'))
+        self.now += 40
+        # the first crash is out of the window
+        self.assertEqual(CRASH, tracker.crashed('foo'))
+        self.assertEqual(CRASH, tracker.crashed('bar'))
+
+    def test_loop_reported_once_then_suppressed(self):
+        from superlance.crashloop import CRASH, LOOP, SUPPRESSED
+        tracker = self._makeOne()
+        self.assertEqual(CRASH, tracker.crashed('foo'))
+        self.assertEqual(CRASH, tracker.crashed('foo'))
+        self.assertEqual(LOOP, tracker.crashed('foo'))
+        for i in range(10):
+            self.now += 10
+            self.assertEqual(SUPPRESSED, tracker.crashed('foo'))
+        self.assertEqual(CRASH, tracker.crashed('bar'))
+        self.assertEqual([], tracker.expire())
+
+    def test_expire_returns_ended_loops(self):
+        from superlance.crashloop import CRASH
+        tracker = self._makeOne()
+        for i in range(5):
+            tracker.crashed('foo')
+        self.now += 60
+        self.assertEqual([], tracker.expire())
+        self.now += 1
+        loops = tracker.expire()
+        self.assertEqual(1, len(loops))
+        self.assertEqual('foo', loops[0].namespec)
+        self.assertEqual(5, loops[0].crashes)
+        self.assertTrue(loops[0].get_summary().startswith(
+            'Process foo stopped crash looping: it crashed 5 times between '))
+        self.assertEqual([], tracker.expire())
+        self.assertEqual(CRASH, tracker.crashed('foo'))
+
+    def test_expire_forgets_old_crashes(self):
+        tracker = self._makeOne()
+        tracker.crashed('foo')
+        self.now += 61
+        self.assertEqual([], tracker.expire())
+        self.assertEqual({}, tracker.crashes)
+
+    def test_zero_threshold_disables_detection(self):
+        from superlance.crashloop import CRASH
+        tracker = self._makeOne(threshold=0)
+        for i in range(10):
+            self.assertEqual(CRASH, tracker.crashed('foo'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,6 @@
 import unittest
 from mock import patch
-from superlance.helpers import MAX_BYTES_TO_READ
+from superlance.helpers import INITIAL_BYTES_TO_READ
 from superlance.compat import StringIO
 
 class CrashMailTests(unittest.TestCase):
@@ -13,11 +13,20 @@ class CrashMailTests(unittest.TestCase):
 
     def setUp(self):
         import tempfile
+        from superlance.helpers import clear_logfile_cache
+        from superlance.rpc import reset_rpc_interface
         self.tempdir = tempfile.mkdtemp()
+        reset_rpc_interface()
+        clear_logfile_cache()
 
     def tearDown(self):
         import shutil
+        from superlance.rpc import reset_rpc_interface
         shutil.rmtree(self.tempdir)
+        reset_rpc_interface()
+
+    # getProcessInfo result for a process without log files readable here
+    _no_logfiles = [[{'stderr_logfile': '', 'stdout_logfile': ''}]]
 
     def _makeOnePopulated(self, programs, any, stderr_lines=0, stdout_lines=0, response=None):
         import os
@@ -28,6 +37,8 @@ class CrashMailTests(unittest.TestCase):
         prog.stdin = StringIO()
         prog.stdout = StringIO()
         prog.stderr = StringIO()
+        # no supervisord to take the reconciliation baseline from
+        prog.baseline_taken = True
         return prog
 
     def test_runforever_not_process_state_exited(self):
@@ -80,11 +91,76 @@ class CrashMailTests(unittest.TestCase):
         self.assertTrue(
             'Process foo in group bar exited unexpectedly' in mail)
 
+    def test_runforever_crash_loop(self):
+        from superlance.crashloop import CrashLoopTracker
+        programs = ['foo']
+        any = None
+        prog = self._makeOnePopulated(programs, any)
+        now = [1000.0]
+        prog.crash_loops = CrashLoopTracker(2, 60, clock=lambda: now[0])
+        payload=('expected:0 processname:foo groupname:bar '
+                 'from_state:RUNNING pid:1')
+        for i in range(3):
+            prog.stdin.write(
+                'eventname:PROCESS_STATE_EXITED len:%s\n' % len(payload))
+            prog.stdin.write(payload)
+        prog.stdin.write('eventname:TICK_5 len:0\n')
+        prog.stdin.seek(0)
+        prog.runforever(test=True)
+        prog.stderr = StringIO()
+        prog.runforever(test=True)
+        self.assertTrue('Subject: [foo]: foo is crash looping at'
+                        in prog.stderr.getvalue())
+        self.assertTrue('is crash looping: it crashed 2 times within 60 '
+                        'seconds' in prog.mailed)
+        prog.stderr = StringIO()
+        prog.runforever(test=True)
+        self.assertEqual(prog.stderr.getvalue(), 'crash loop, not mailing\n')
+        now[0] += 61
+        prog.stderr = StringIO()
+        prog.runforever(test=True)
+        output = prog.stderr.getvalue()
+        self.assertTrue(output.startswith('crash loop ended, mailing\n'))
+        self.assertTrue('Subject: [foo]: bar:foo stopped crash looping at'
+                        in output)
+        self.assertTrue('Process bar:foo stopped crash looping: it crashed 3 '
+                        'times' in prog.mailed)
+
+    def test_runforever_tick_polls_followed_logs(self):
+        import os
+        from mock import Mock
+        sendmail = 'cat - > %s' % os.path.join(self.tempdir, 'email.log')
+        prog = self._makeOne(['foo'], None, 'chrism@plope.com', sendmail,
+                             '[foo]', 10, 10, True)
+        prog.log_follower = Mock()
+        prog.stdin = StringIO()
+        prog.stdout = StringIO()
+        prog.stderr = StringIO()
+        prog.baseline_taken = True
+        prog.stdin.write('eventname:TICK_5 len:0\n')
+        prog.stdin.seek(0)
+        prog.runforever(test=True)
+        self.assertEqual(prog.stderr.getvalue(), 'followed logs\n')
+        prog.log_follower.poll.assert_called_once_with()
+
+    def test_runforever_unexpected_exit_uses_followed_logs(self):
+        from mock import Mock
+        prog = self._makeOnePopulated(['foo'], None, stderr_lines=2)
+        prog.log_follower = Mock()
+        prog.log_follower.format_last_lines.return_value = 'followed\n'
+        payload=('expected:0 processname:foo groupname:bar '
+                 'from_state:RUNNING pid:1')
+        prog.stdin.write(
+            'eventname:PROCESS_STATE_EXITED len:%s\n' % len(payload))
+        prog.stdin.write(payload)
+        prog.stdin.seek(0)
+        prog.runforever(test=True)
+        self.assertTrue('followed\n' in prog.stderr.getvalue())
+
     @patch('superlance.crashmail.childutils.getRPCInterface')
     def test_stderr_lines_should_use_stderr_tail(self, getRPCInterfaceMock):
-        supervisor_mock = getRPCInterfaceMock().supervisor
-        tailProcessStderrLogMock = supervisor_mock.tailProcessStderrLog
-        tailProcessStderrLogMock.return_value = ['test1\test2\n', 0, False]
+        multicallMock = getRPCInterfaceMock().system.multicall
+        multicallMock.side_effect = [self._no_logfiles, [[['test1\test2\n', 0, False]]]]
 
         programs = ['foo']
         any = None
@@ -97,17 +173,15 @@ class CrashMailTests(unittest.TestCase):
         prog.stdin.seek(0)
         prog.runforever(test=True)
 
-        tailProcessStderrLogMock.assert_called_with(
-            'bar:foo',
-            0,
-            MAX_BYTES_TO_READ
-        )
+        multicallMock.assert_called_with([
+            {'methodName': 'supervisor.tailProcessStderrLog',
+             'params': ['bar:foo', 0, INITIAL_BYTES_TO_READ]},
+        ])
 
     @patch('superlance.crashmail.childutils.getRPCInterface')
     def test_stderr_lines_should_use_stdout_tail(self, getRPCInterfaceMock):
-        supervisor_mock = getRPCInterfaceMock().supervisor
-        tailProcessStdoutLogMock = supervisor_mock.tailProcessStdoutLog
-        tailProcessStdoutLogMock.return_value = ['test1\test2\n', 0, False]
+        multicallMock = getRPCInterfaceMock().system.multicall
+        multicallMock.side_effect = [self._no_logfiles, [[['test1\test2\n', 0, False]]]]
 
         programs = ['foo']
         any = None
@@ -120,11 +194,42 @@ class CrashMailTests(unittest.TestCase):
         prog.stdin.seek(0)
         prog.runforever(test=True)
 
-        tailProcessStdoutLogMock.assert_called_with(
-            'bar:foo',
-            0,
-            MAX_BYTES_TO_READ
-        )
+        multicallMock.assert_called_with([
+            {'methodName': 'supervisor.tailProcessStdoutLog',
+             'params': ['bar:foo', 0, INITIAL_BYTES_TO_READ]},
+        ])
+
+    @patch('superlance.crashmail.childutils.getRPCInterface')
+    def test_stderr_and_stdout_lines_share_one_round_trip(self,
+                                                          getRPCInterfaceMock):
+        multicallMock = getRPCInterfaceMock().system.multicall
+        multicallMock.side_effect = [self._no_logfiles,
+                                     [[['err1\nerr2\n', 12, False]],
+                                      [['out1\nout2\n', 12, False]]]]
+
+        programs = ['foo']
+        any = None
+        prog = self._makeOnePopulated(programs, any, stderr_lines=2,
+                                      stdout_lines=2)
+        payload=('expected:0 processname:foo groupname:bar '
+                 'from_state:RUNNING pid:1')
+        prog.stdin.write(
+            'eventname:PROCESS_STATE_EXITED len:%s\n' % len(payload))
+        prog.stdin.write(payload)
+        prog.stdin.seek(0)
+        prog.runforever(test=True)
+
+        multicallMock.assert_called_with([
+            {'methodName': 'supervisor.tailProcessStderrLog',
+             'params': ['bar:foo', 0, INITIAL_BYTES_TO_READ]},
+            {'methodName': 'supervisor.tailProcessStdoutLog',
+             'params': ['bar:foo', 0, INITIAL_BYTES_TO_READ]},
+        ])
+        output = prog.stderr.getvalue()
+        self.assertTrue('-------LAST LINES OF STDERR---------\n'
+                        'err1\nerr2\n' in output)
+        self.assertTrue('-------LAST LINES OF STDOUT---------\n'
+                        'out1\nout2\n' in output)
 
 if __name__ == '__main__':
     unittest.main()
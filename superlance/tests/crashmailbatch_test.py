@@ -2,6 +2,16 @@ import unittest
 import mock
 from superlance.compat import StringIO
 
+def get_process_exited_event(pname, gname, expected, pid=58597):
+    headers = {
+        'ver': '3.0', 'poolserial': '7', 'len': '71',
+        'server': 'supervisor', 'eventname': 'PROCESS_STATE_EXITED',
+        'serial': '7', 'pool': 'checkmailbatch',
+    }
+    payload = 'processname:%s groupname:%s from_state:RUNNING expected:%d \
+pid:%d' % (pname, gname, expected, pid)
+    return (headers, payload)
+
 class CrashMailBatchTests(unittest.TestCase):
     from_email = 'testFrom@blah.com'
     to_emails = ('testTo@blah.com')
@@ -25,14 +35,7 @@ class CrashMailBatchTests(unittest.TestCase):
         return obj
 
     def get_process_exited_event(self, pname, gname, expected):
-        headers = {
-            'ver': '3.0', 'poolserial': '7', 'len': '71',
-            'server': 'supervisor', 'eventname': 'PROCESS_STATE_EXITED',
-            'serial': '7', 'pool': 'checkmailbatch',
-        }
-        payload = 'processname:%s groupname:%s from_state:RUNNING expected:%d \
-pid:58597' % (pname, gname, expected)
-        return (headers, payload)
+        return get_process_exited_event(pname, gname, expected)
 
     def test_get_process_state_change_msg_expected(self):
         crash = self._make_one_mocked()
@@ -61,5 +64,93 @@ pid:58597' % (pname, gname, expected)
         self.assertTrue(self.unexpected_err_msg in msgs[0])
         self.assertTrue(self.unexpected_err_msg in crash.stderr.getvalue())
 
+    def test_handle_event_fatal_ignored_by_default(self):
+        crash = self._make_one_mocked()
+        hdrs, payload = self.get_process_exited_event('foo', 'bar', 0)
+        hdrs['eventname'] = 'PROCESS_STATE_FATAL'
+        crash.handle_event(hdrs, payload)
+        self.assertEqual([], crash.get_batch_msgs())
+        self.assertEqual(0, crash.send_email.call_count)
+
+
+class CrashMailBatchGroupingTests(unittest.TestCase):
+    def _make_one_mocked(self, **kwargs):
+        from superlance.crashmailbatch import CrashMailBatch
+        kwargs['stdin'] = StringIO()
+        kwargs['stdout'] = StringIO()
+        kwargs['stderr'] = StringIO()
+        kwargs['from_email'] = 'testFrom@blah.com'
+        kwargs['to_emails'] = ('testTo@blah.com')
+        obj = CrashMailBatch(**kwargs)
+        obj.send_email = mock.Mock()
+        return obj
+
+    def test_handle_event_sends_fatal_immediately(self):
+        crash = self._make_one_mocked(immediate_events=['FATAL'], now=1.0)
+        hdrs, payload = get_process_exited_event('foo', 'bar', 0)
+        crash.handle_event(hdrs, payload)
+        hdrs['eventname'] = 'PROCESS_STATE_FATAL'
+        crash.handle_event(hdrs, payload)
+        self.assertEqual(1, crash.send_email.call_count)
+        body = crash.send_email.call_args[0][0]['body']
+        self.assertTrue('Process bar:foo failed to start too many times'
+                        in body)
+        self.assertFalse('died unexpectedly' in body)
+        # the crash is still batched
+        self.assertEqual(1, len(crash.get_batch_msgs()))
+
+    def test_handle_event_groups_repeated_crashes(self):
+        crash = self._make_one_mocked(now=1279665240)
+        for pid in range(1, 6):
+            hdrs, payload = get_process_exited_event('foo', 'bar', 0, pid)
+            crash.handle_event(hdrs, payload)
+        hdrs, payload = get_process_exited_event('baz', 'baz', 0)
+        crash.handle_event(hdrs, payload)
+        msgs = crash.get_batch_msgs()
+        self.assertEqual(2, len(msgs))
+        self.assertTrue('Process bar:foo (pid 5) died unexpectedly' in msgs[0])
+        self.assertTrue('(5 times between ' in msgs[0])
+        self.assertTrue('last pids 1, 2, 3, 4, 5)' in msgs[0])
+        self.assertTrue('Process baz:baz (pid 58597) died unexpectedly'
+                        in msgs[1])
+        self.assertFalse('times between' in msgs[1])
+
+    def test_batch_memory_is_bounded(self):
+        crash = self._make_one_mocked(max_batch_processes=2)
+        for name in ('a', 'b', 'c', 'd'):
+            for pid in range(20):
+                hdrs, payload = get_process_exited_event(name, name, 0, pid)
+                crash.handle_event(hdrs, payload)
+        self.assertEqual(2, len(crash.batch))
+        self.assertEqual(10, len(crash.batch.get_entries()[0].pids))
+        msgs = crash.get_batch_msgs()
+        self.assertEqual(3, len(msgs))
+        self.assertEqual('40 more events from other processes\n', msgs[2])
+        crash.clear_batch()
+        self.assertEqual([], crash.get_batch_msgs())
+
+    def test_logs_fetched_once_per_process_when_sent(self):
+        crash = self._make_one_mocked(stderr_lines=1, stdout_lines=1)
+        with mock.patch('superlance.process_state_monitor.'
+                        'get_last_lines_of_processes') as get_last_lines:
+            get_last_lines.return_value = [('err\n', 'out\n')]
+            for pid in range(3):
+                hdrs, payload = get_process_exited_event('foo', 'bar', 0, pid)
+                crash.handle_event(hdrs, payload)
+            self.assertEqual(0, get_last_lines.call_count)
+            msgs = crash.get_batch_msgs()
+        self.assertEqual(1, get_last_lines.call_count)
+        pheaders_list, stderr_lines, stdout_lines = \
+            get_last_lines.call_args[0]
+        self.assertEqual([pheaders['processname']
+                          for pheaders in pheaders_list], ['foo'])
+        self.assertTrue(msgs[0].endswith(
+            '-------LAST LINES OF STDERR---------\n'
+            'err\n'
+            '-----------------END----------------\n'
+            '-------LAST LINES OF STDOUT---------\n'
+            'out\n'
+            '-----------------END----------------\n'))
+
 if __name__ == '__main__':
     unittest.main()
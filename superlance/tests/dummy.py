@@ -1,7 +1,9 @@
 class DummyRPCServer:
-    def __init__(self):
+    def __init__(self, all_process_info=None):
         self.supervisor = DummySupervisorRPCNamespace()
         self.system = DummySystemRPCNamespace()
+        if all_process_info is not None:
+            self.supervisor.all_process_info = all_process_info
 
 class DummyResponse:
     status = 200
@@ -90,3 +92,30 @@ class DummySupervisorRPCNamespace:
             raise xmlrpclib.Fault(xmlrpc.Faults.FAILED, 'FAILED')
         return True
 
+    def signalProcess(self, name, signal):
+        from supervisor import xmlrpc
+        from superlance.compat import xmlrpclib
+        if name.endswith('FAILED'):
+            raise xmlrpclib.Fault(xmlrpc.Faults.FAILED, 'FAILED')
+        self._signalled = (name, signal)
+        return True
+
+def make_process_infos(count, group_size=10):
+    """Return getAllProcessInfo results for count running processes,
+    group_size of them per group, to scale DummyRPCServer up."""
+    infos = []
+    for i in range(count):
+        infos.append({
+            'name':'proc_%05d' % i,
+            'group':'group_%04d' % (i // group_size),
+            'pid':1000 + i,
+            'state':ProcessStates.RUNNING,
+            'statename':'RUNNING',
+            'start':_NOW - 100,
+            'stop':0,
+            'spawnerr':'',
+            'exitstatus':0,
+            'now':_NOW,
+            'description':'pid %d, uptime 0:01:40' % (1000 + i),
+            })
+    return infos
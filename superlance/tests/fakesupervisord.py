@@ -0,0 +1,537 @@
+doc = """\
+fakesupervisord.py [-p processes] [-l log_bytes] [-d delay] [-s socket]
+                   [-P port] [-H] [-n events] [-t tick_every] [-e file]
+                   [-v] [command ...]
+
+A fake supervisord, to load test listeners end to end on one machine.
+It serves the part of the supervisor XML-RPC API the listeners use, over
+a unix socket and over HTTP, for as many processes as asked for, each
+with stdout and stderr logs of the size asked for.  Every response can
+be delayed, to play a loaded or remote supervisord.
+
+Given listener commands, it runs each of them as supervisord would, with
+SUPERVISOR_SERVER_URL pointing to the fake, and plays an event stream to
+all of them at once.  It then reports, for each listener, the events
+handled per second, the time taken to acknowledge an event and its peak
+RSS, and the XML-RPC calls made.  Without commands, it serves until
+interrupted.
+
+Options:
+
+-p -- the number of processes (default 100)
+
+-l -- the size of each process log, in bytes (default 65536)
+
+-d -- the delay before each XML-RPC response, in seconds (default 0)
+
+-s -- the path of the unix socket (default: in a temporary directory)
+
+-P -- the HTTP port, on 127.0.0.1 (default: any free port)
+
+-H -- point the listeners to the HTTP server instead of the unix socket
+
+-n -- the number of events played (default 1000)
+
+-t -- play a TICK_60 event every this many events (default 10)
+
+-e -- play the events in a file instead, one per line:  the event name
+      then the payload, e.g. "PROCESS_STATE_EXITED processname:foo
+      groupname:foo from_state:RUNNING expected:0 pid:1234"
+
+-v -- let the listeners write to stderr
+
+The events do not change the state of the processes; starting, stopping
+and signalling them through XML-RPC does.  Listeners send mail and
+Sentry messages for real, so point them somewhere harmless.  A sample
+invocation:
+
+python -m superlance.tests.fakesupervisord -p 2000 -l 1048576 -d 0.01 \\
+    "crashmail -a -m dev@example.com -s 'cat > /dev/null'" \\
+    "memmon -a 1GB"
+"""
+
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from supervisor.states import ProcessStates
+from supervisor.states import getProcessStateDescription
+from supervisor.xmlrpc import Faults
+
+from superlance.compat import SimpleXMLRPCDispatcher
+from superlance.compat import SimpleXMLRPCRequestHandler
+from superlance.compat import SimpleXMLRPCServer
+from superlance.compat import socketserver
+from superlance.compat import xmlrpclib
+from superlance.tests.benchmark import Result
+from superlance.tests.benchmark import feed_events
+from superlance.tests.benchmark import format_results
+from superlance.tests.benchmark import get_maxrss
+from superlance.tests.benchmark import make_events
+from superlance.tests.dummy import make_process_infos
+
+API_VERSION = '3.0'
+
+def usage():
+    print(doc)
+    sys.exit(255)
+
+class FakeLog:
+    """A process log of size bytes, made up of numbered lines generated
+    when read rather than kept in memory."""
+
+    def __init__(self, name, size):
+        self.name = name
+        self.size = size
+        self.line_length = len(self.line(0))
+
+    def line(self, number):
+        return '%s log line %08d\n' % (self.name, number)
+
+    def data(self, offset, length):
+        end = min(offset + length, self.size)
+        if offset >= end:
+            return ''
+        first = offset // self.line_length
+        last = (end - 1) // self.line_length
+        data = ''.join([self.line(n) for n in range(first, last + 1)])
+        start = offset - first * self.line_length
+        return data[start:start + end - offset]
+
+    def read(self, offset, length):
+        """supervisor.readProcess*Log, as supervisor.options.readFile"""
+        if offset < 0:
+            if length:
+                raise ValueError('BAD_ARGUMENTS')
+            return self.data(max(0, self.size + offset), -offset)
+        if length < 0:
+            raise ValueError('BAD_ARGUMENTS')
+        if length == 0:
+            length = self.size
+        return self.data(offset, length)
+
+    def tail(self, offset, length):
+        """supervisor.tailProcess*Log, as supervisor.options.tailFile"""
+        size = self.size
+        overflow = False
+        if size > offset + length:
+            overflow = True
+            offset = size - 1
+        if offset + length > size:
+            if offset > size - 1:
+                length = 0
+            offset = size - length
+        offset = max(offset, 0)
+        length = max(length, 0)
+        return [self.data(offset, length), size, overflow]
+
+class FakeSupervisorNamespace:
+    """The supervisor namespace of the XML-RPC API, for processes that
+    only exist in memory."""
+
+    def __init__(self, processes=100, log_bytes=65536):
+        self.infos = make_process_infos(processes)
+        self.lock = threading.Lock()
+        self.next_pid = 1000 + processes
+        self.index = {} # {namespec: info}
+        self.logs = {}
+        for info in self.infos:
+            namespec = '%s:%s' % (info['group'], info['name'])
+            self.index[namespec] = info
+            info['stdout_logfile'] = ''
+            info['stderr_logfile'] = ''
+            info['logfile'] = ''
+            self.logs[namespec] = {
+                'Stdout': FakeLog('%s stdout' % namespec, log_bytes),
+                'Stderr': FakeLog('%s stderr' % namespec, log_bytes),
+                }
+
+    def _get_info(self, name):
+        namespec = name
+        if ':' not in namespec:
+            namespec = '%s:%s' % (name, name)
+        info = self.index.get(namespec)
+        if info is None:
+            raise xmlrpclib.Fault(Faults.BAD_NAME, 'BAD_NAME: %s' % name)
+        return info
+
+    def _get_log(self, name, stream):
+        info = self._get_info(name)
+        return self.logs['%s:%s' % (info['group'], info['name'])][stream]
+
+    def _set_state(self, info, state):
+        now = time.time()
+        info['state'] = state
+        info['statename'] = getProcessStateDescription(state)
+        info['now'] = now
+        if state == ProcessStates.RUNNING:
+            info['pid'] = self.next_pid
+            self.next_pid += 1
+            info['start'] = now
+        else:
+            info['pid'] = 0
+            info['stop'] = now
+
+    def getAPIVersion(self):
+        return API_VERSION
+
+    def getState(self):
+        return {'statecode': 1, 'statename': 'RUNNING'}
+
+    def getPID(self):
+        return os.getpid()
+
+    def getAllProcessInfo(self):
+        now = time.time()
+        with self.lock:
+            for info in self.infos:
+                info['now'] = now
+            return [dict(info) for info in self.infos]
+
+    def getProcessInfo(self, name):
+        with self.lock:
+            info = self._get_info(name)
+            info['now'] = time.time()
+            return dict(info)
+
+    def startProcess(self, name, wait=True):
+        with self.lock:
+            info = self._get_info(name)
+            if info['state'] == ProcessStates.RUNNING:
+                raise xmlrpclib.Fault(Faults.ALREADY_STARTED,
+                                      'ALREADY_STARTED: %s' % name)
+            self._set_state(info, ProcessStates.RUNNING)
+            return True
+
+    def stopProcess(self, name, wait=True):
+        with self.lock:
+            info = self._get_info(name)
+            if info['state'] != ProcessStates.RUNNING:
+                raise xmlrpclib.Fault(Faults.NOT_RUNNING,
+                                      'NOT_RUNNING: %s' % name)
+            self._set_state(info, ProcessStates.STOPPED)
+            return True
+
+    def signalProcess(self, name, signal):
+        with self.lock:
+            info = self._get_info(name)
+            if info['state'] != ProcessStates.RUNNING:
+                raise xmlrpclib.Fault(Faults.NOT_RUNNING,
+                                      'NOT_RUNNING: %s' % name)
+            return True
+
+    def _read_log(self, name, stream, offset, length):
+        try:
+            return self._get_log(name, stream).read(offset, length)
+        except ValueError as e:
+            raise xmlrpclib.Fault(getattr(Faults, str(e)), str(e))
+
+    def readProcessStdoutLog(self, name, offset, length):
+        return self._read_log(name, 'Stdout', offset, length)
+
+    def readProcessStderrLog(self, name, offset, length):
+        return self._read_log(name, 'Stderr', offset, length)
+
+    def tailProcessStdoutLog(self, name, offset, length):
+        return self._get_log(name, 'Stdout').tail(offset, length)
+
+    def tailProcessStderrLog(self, name, offset, length):
+        return self._get_log(name, 'Stderr').tail(offset, length)
+
+    # the methods served, as supervisor.<name>
+    methods = ('getAPIVersion', 'getState', 'getPID', 'getAllProcessInfo',
+               'getProcessInfo', 'startProcess', 'stopProcess',
+               'signalProcess', 'readProcessStdoutLog',
+               'readProcessStderrLog', 'tailProcessStdoutLog',
+               'tailProcessStderrLog')
+
+class CallStats:
+    """XML-RPC calls served:  the number of requests and calls, and the
+    bytes of the responses, by method (system.multicall counts the
+    calls in it too)."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.calls = {}
+        self.response_bytes = {}
+
+    def add_request(self, method, response_bytes):
+        with self.lock:
+            self.requests += 1
+            self.response_bytes[method] = (
+                self.response_bytes.get(method, 0) + response_bytes)
+
+    def add_call(self, method):
+        with self.lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+
+    def format(self):
+        lines = ['%-32s %8s %14s' % ('method', 'calls', 'response bytes')]
+        for method in sorted(self.calls):
+            lines.append('%-32s %8d %14d' % (
+                method, self.calls[method],
+                self.response_bytes.get(method, 0)))
+        lines.append('%d requests' % self.requests)
+        return '\n'.join(lines)
+
+class FakeDispatcher:
+    """Mixin serving a FakeSupervisorNamespace, delaying each response
+    by delay seconds and counting calls in stats."""
+
+    def setup_dispatcher(self, namespace, delay, stats):
+        self.namespace = namespace
+        self.delay = delay
+        self.stats = stats
+        self.request_method = threading.local()
+        for name in namespace.methods:
+            self.register_function(getattr(namespace, name),
+                                   'supervisor.%s' % name)
+        self.register_introspection_functions()
+        self.register_multicall_functions()
+
+    def _dispatch(self, method, params):
+        if self.request_method.name is None:
+            # the method of the request, not one in a multicall
+            self.request_method.name = method
+        self.stats.add_call(method)
+        return SimpleXMLRPCDispatcher._dispatch(self, method, params)
+
+    def _marshaled_dispatch(self, data, dispatch_method=None, path=None):
+        if self.delay:
+            time.sleep(self.delay)
+        self.request_method.name = None
+        response = SimpleXMLRPCDispatcher._marshaled_dispatch(
+            self, data, dispatch_method, path)
+        self.stats.add_request(self.request_method.name, len(response))
+        return response
+
+class RequestHandler(SimpleXMLRPCRequestHandler):
+    rpc_paths = ('/RPC2',)
+    # keep connections open between requests, as supervisord does
+    protocol_version = 'HTTP/1.1'
+
+class UnixRequestHandler(RequestHandler):
+    # TCP_NODELAY does not apply to unix sockets
+    disable_nagle_algorithm = False
+
+    def address_string(self):
+        # unix socket clients have no address
+        return 'unix'
+
+class FakeHTTPServer(socketserver.ThreadingMixIn, FakeDispatcher,
+                     SimpleXMLRPCServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, namespace, delay, stats):
+        SimpleXMLRPCServer.__init__(self, address, RequestHandler,
+                                    logRequests=False, allow_none=True)
+        self.setup_dispatcher(namespace, delay, stats)
+
+class FakeUnixServer(socketserver.ThreadingMixIn, FakeDispatcher,
+                     socketserver.UnixStreamServer, SimpleXMLRPCDispatcher):
+    daemon_threads = True
+    logRequests = False
+
+    def __init__(self, path, namespace, delay, stats):
+        socketserver.UnixStreamServer.__init__(self, path,
+                                               UnixRequestHandler)
+        SimpleXMLRPCDispatcher.__init__(self, allow_none=True,
+                                        encoding=None)
+        self.setup_dispatcher(namespace, delay, stats)
+
+class FakeSupervisord:
+    """The fake supervisord:  one set of processes served over a unix
+    socket and HTTP, in background threads, until stopped."""
+
+    def __init__(self, processes=100, log_bytes=65536, delay=0,
+                 socket_path=None, port=0):
+        self.namespace = FakeSupervisorNamespace(processes, log_bytes)
+        self.stats = CallStats()
+        self.tempdir = None
+        if socket_path is None:
+            self.tempdir = tempfile.mkdtemp()
+            socket_path = os.path.join(self.tempdir, 'supervisor.sock')
+        self.socket_path = socket_path
+        self.unix_server = FakeUnixServer(socket_path, self.namespace,
+                                          delay, self.stats)
+        self.http_server = FakeHTTPServer(('127.0.0.1', port),
+                                          self.namespace, delay, self.stats)
+        self.threads = []
+
+    @property
+    def unix_url(self):
+        return 'unix://%s' % self.socket_path
+
+    @property
+    def http_url(self):
+        return 'http://127.0.0.1:%d' % self.http_server.server_address[1]
+
+    def get_env(self, url=None):
+        """Return the environment of a listener talking to this fake."""
+        env = os.environ.copy()
+        env['SUPERVISOR_ENABLED'] = '1'
+        env['SUPERVISOR_SERVER_URL'] = url or self.unix_url
+        env['SUPERVISOR_PROCESS_NAME'] = 'listener'
+        env['SUPERVISOR_GROUP_NAME'] = 'listener'
+        env.pop('SUPERVISOR_USERNAME', None)
+        env.pop('SUPERVISOR_PASSWORD', None)
+        return env
+
+    def start(self):
+        for server in (self.unix_server, self.http_server):
+            thread = threading.Thread(target=server.serve_forever)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self):
+        for server in (self.unix_server, self.http_server):
+            if self.threads:
+                server.shutdown()
+            server.server_close()
+        self.threads = []
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        if self.tempdir is not None:
+            shutil.rmtree(self.tempdir, ignore_errors=True)
+
+def read_events(path):
+    """Return the (eventname, payload) pairs in the file at path."""
+    events = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            parts = line.split(None, 1)
+            events.append((parts[0], len(parts) > 1 and parts[1] or ''))
+    return events
+
+def play(command, events, env, verbose=False):
+    """Run the listener command as supervisord would, feed it events,
+    (eventname, payload) pairs, and return its Result."""
+    stderr = None
+    if not verbose:
+        stderr = open(os.devnull, 'w')
+    proc = subprocess.Popen(command, shell=True, env=env,
+                            stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                            stderr=stderr)
+    try:
+        latencies, elapsed = feed_events(proc.stdin, proc.stdout, events)
+    finally:
+        # the listener exits once its stdin is closed
+        proc.stdin.close()
+        proc.stdout.close()
+        _, status, rusage = os.wait4(proc.pid, 0)
+        proc.returncode = status
+        if stderr is not None:
+            stderr.close()
+    return Result(command, latencies, elapsed, get_maxrss(rusage))
+
+def play_all(commands, events, env, verbose=False):
+    """Play events to all the listener commands at once, and return
+    their Results in order, or raise the first error."""
+    results = [None] * len(commands)
+    errors = []
+
+    def run(index, command):
+        try:
+            results[index] = play(command, events, env, verbose)
+        except Exception as e:
+            errors.append('%s: %s' % (command, e))
+
+    threads = [threading.Thread(target=run, args=(index, command))
+               for index, command in enumerate(commands)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise RuntimeError('\n'.join(errors))
+    return results
+
+def main(argv=sys.argv):
+    import getopt
+    short_args = 'hp:l:d:s:P:Hn:t:e:v'
+    long_args = ['help', 'processes=', 'log-bytes=', 'delay=', 'socket=',
+                 'port=', 'http', 'events=', 'tick-every=', 'events-file=',
+                 'verbose']
+    try:
+        opts, args = getopt.getopt(argv[1:], short_args, long_args)
+    except:
+        usage()
+
+    processes = 100
+    log_bytes = 65536
+    delay = 0.0
+    socket_path = None
+    port = 0
+    use_http = False
+    count = 1000
+    tick_every = 10
+    events_file = None
+    verbose = False
+
+    for option, value in opts:
+        if option in ('-h', '--help'):
+            usage()
+        if option in ('-p', '--processes'):
+            processes = int(value)
+        if option in ('-l', '--log-bytes'):
+            log_bytes = int(value)
+        if option in ('-d', '--delay'):
+            delay = float(value)
+        if option in ('-s', '--socket'):
+            socket_path = value
+        if option in ('-P', '--port'):
+            port = int(value)
+        if option in ('-H', '--http'):
+            use_http = True
+        if option in ('-n', '--events'):
+            count = int(value)
+        if option in ('-t', '--tick-every'):
+            tick_every = int(value)
+        if option in ('-e', '--events-file'):
+            events_file = value
+        if option in ('-v', '--verbose'):
+            verbose = True
+
+    try:
+        fake = FakeSupervisord(processes, log_bytes, delay, socket_path,
+                               port)
+    except socket.error as e:
+        sys.stderr.write('Cannot listen: %s\n' % e)
+        sys.exit(1)
+    fake.start()
+    try:
+        print('Serving %d processes on %s and %s' % (
+            processes, fake.unix_url, fake.http_url))
+        sys.stdout.flush()
+        if not args:
+            while 1:
+                time.sleep(3600)
+
+        if events_file:
+            events = read_events(events_file)
+        else:
+            events = list(make_events(count, fake.namespace.infos,
+                                      tick_every))
+        env = fake.get_env(use_http and fake.http_url or None)
+        results = play_all(args, events, env, verbose)
+        print(format_results(results))
+        print('')
+        print(fake.stats.format())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        fake.stop()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,172 @@
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+from superlance.compat import xmlrpclib
+
+class FakeLogTests(unittest.TestCase):
+    def setUp(self):
+        from superlance.tests.fakesupervisord import FakeLog
+        self.log = FakeLog('foo:foo stderr', 1000)
+        self.tempdir = tempfile.mkdtemp()
+        # the same log on disk, for supervisor's own functions
+        self.path = os.path.join(self.tempdir, 'foo.log')
+        with open(self.path, 'w') as f:
+            f.write(self.log.read(0, 0))
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_data(self):
+        data = self.log.read(0, 0)
+        self.assertEqual(1000, len(data))
+        self.assertTrue(data.startswith('foo:foo stderr log line 00000000\n'
+                                        'foo:foo stderr log line 00000001\n'))
+        self.assertEqual(data[10:95], self.log.read(10, 85))
+
+    def test_read_like_supervisor(self):
+        from supervisor.compat import as_string
+        from supervisor.options import readFile
+        for offset, length in ((0, 0), (0, 10), (990, 100), (-30, 0),
+                               (-2000, 0), (2000, 10), (33, 66)):
+            self.assertEqual(as_string(readFile(self.path, offset, length)),
+                             self.log.read(offset, length),
+                             (offset, length))
+        self.assertRaises(ValueError, self.log.read, -10, 5)
+        self.assertRaises(ValueError, self.log.read, 10, -5)
+
+    def test_tail_like_supervisor(self):
+        from supervisor.options import tailFile
+        for offset, length in ((0, 100), (0, 2000), (900, 100), (999, 10),
+                               (1000, 10), (1500, 10), (0, 0)):
+            self.assertEqual(tailFile(self.path, offset, length),
+                             self.log.tail(offset, length),
+                             (offset, length))
+
+class FakeSupervisordTests(unittest.TestCase):
+    def setUp(self):
+        from superlance.tests.fakesupervisord import FakeSupervisord
+        self.fake = FakeSupervisord(processes=30, log_bytes=4096)
+        self.fake.start()
+
+    def tearDown(self):
+        from superlance.rpc import reset_rpc_interface
+        from superlance.helpers import clear_logfile_cache
+        reset_rpc_interface()
+        clear_logfile_cache()
+        self.fake.stop()
+
+    def _getRPC(self, url=None):
+        from supervisor import childutils
+        return childutils.getRPCInterface(self.fake.get_env(url))
+
+    def test_serves_over_unix_socket_and_http(self):
+        for url in (self.fake.unix_url, self.fake.http_url):
+            rpc = self._getRPC(url)
+            infos = rpc.supervisor.getAllProcessInfo()
+            self.assertEqual(30, len(infos))
+            self.assertEqual('proc_00000', infos[0]['name'])
+            self.assertEqual('RUNNING', infos[0]['statename'])
+            self.assertEqual('3.0', rpc.supervisor.getAPIVersion())
+        self.assertEqual(4, self.fake.stats.requests)
+        self.assertEqual(2, self.fake.stats.calls[
+            'supervisor.getAllProcessInfo'])
+
+    def test_process_control(self):
+        rpc = self._getRPC()
+        name = 'group_0001:proc_00012'
+        rpc.supervisor.stopProcess(name)
+        info = rpc.supervisor.getProcessInfo(name)
+        self.assertEqual('STOPPED', info['statename'])
+        self.assertEqual(0, info['pid'])
+        try:
+            rpc.supervisor.stopProcess(name)
+            self.fail('stopped twice')
+        except xmlrpclib.Fault as e:
+            self.assertTrue(e.faultString.startswith('NOT_RUNNING'))
+        rpc.supervisor.startProcess(name)
+        info = rpc.supervisor.getProcessInfo(name)
+        self.assertEqual('RUNNING', info['statename'])
+        self.assertEqual(1030, info['pid'])
+        try:
+            rpc.supervisor.getProcessInfo('nope')
+            self.fail('found nope')
+        except xmlrpclib.Fault as e:
+            self.assertEqual('BAD_NAME: nope', e.faultString)
+
+    def test_multicall_and_stats(self):
+        rpc = self._getRPC()
+        results = rpc.system.multicall([
+            {'methodName': 'supervisor.tailProcessStderrLog',
+             'params': ['group_0000:proc_00001', 0, 100]},
+            {'methodName': 'supervisor.getProcessInfo',
+             'params': ['nope']},
+            ])
+        data, offset, overflow = results[0][0]
+        self.assertEqual(100, len(data))
+        self.assertEqual(4096, offset)
+        self.assertTrue(overflow)
+        self.assertEqual(10, results[1]['faultCode'])
+        stats = self.fake.stats
+        self.assertEqual(1, stats.requests)
+        self.assertEqual(1, stats.calls['system.multicall'])
+        self.assertEqual(1, stats.calls['supervisor.tailProcessStderrLog'])
+        self.assertTrue(stats.response_bytes['system.multicall'] > 100)
+        self.assertTrue('system.multicall' in stats.format())
+
+    def test_delay(self):
+        self.fake.unix_server.delay = 0.05
+        rpc = self._getRPC()
+        start = time.time()
+        rpc.supervisor.getState()
+        self.assertTrue(time.time() - start >= 0.05)
+
+    def test_last_lines_of_processes(self):
+        from superlance.helpers import get_last_lines_of_processes
+        from superlance.rpc import get_rpc_interface
+        get_rpc_interface(self.fake.get_env())
+        pheaders = {'groupname': 'group_0000', 'processname': 'proc_00003'}
+        [(stderr, stdout)] = get_last_lines_of_processes([pheaders], 3, 2)
+        log = self.fake.namespace.logs['group_0000:proc_00003']['Stderr']
+        # the last 3 complete lines, and the incomplete one after them
+        self.assertTrue(log.read(0, 0).endswith(stderr))
+        self.assertTrue(stderr.startswith(
+            log.line(4096 // log.line_length - 3)))
+        self.assertEqual(3, len(stdout.splitlines()))
+        self.assertTrue('stdout log line' in stdout)
+
+    def test_play(self):
+        from superlance.tests.benchmark import make_events
+        from superlance.tests.fakesupervisord import play_all
+        events = list(make_events(20, self.fake.namespace.infos))
+        command = ("%s -m superlance.crashmail -a -m dev@example.com "
+                   "-s 'cat > /dev/null' --stderr_lines=2" % sys.executable)
+        [result] = play_all([command], events, self.fake.get_env())
+        self.assertEqual(20, result.events)
+        self.assertTrue(result.maxrss > 0)
+        self.assertTrue(self.fake.stats.calls['system.multicall'] > 0)
+
+    def test_read_events(self):
+        from superlance.tests.fakesupervisord import read_events
+        tempdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tempdir, 'events')
+            with open(path, 'w') as f:
+                f.write('# a comment\n'
+                        'TICK_60 when:1234\n'
+                        '\n'
+                        'PROCESS_STATE_EXITED processname:foo '
+                        'groupname:foo from_state:RUNNING expected:0 '
+                        'pid:12\n')
+            self.assertEqual([
+                ('TICK_60', 'when:1234'),
+                ('PROCESS_STATE_EXITED', 'processname:foo groupname:foo '
+                 'from_state:RUNNING expected:0 pid:12'),
+                ], read_events(path))
+        finally:
+            shutil.rmtree(tempdir)
+
+if __name__ == '__main__':
+    unittest.main()
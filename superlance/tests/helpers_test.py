@@ -1,6 +1,27 @@
 import unittest
-from mock import Mock
-from superlance.helpers import get_last_lines
+from mock import Mock, patch
+from superlance.helpers import (
+    INITIAL_BYTES_TO_READ,
+    MAX_BYTES_TO_READ,
+    get_last_lines,
+)
+
+
+def _make_log(log):
+    """Return tail and read functions that behave like supervisor's
+    tailProcess*Log and readProcess*Log for the given log, and the
+    list of calls made to them."""
+    calls = []
+    def tail(name, offset, length):
+        calls.append(('tail', offset, length))
+        if len(log) > length:
+            return [log[-length:], len(log), True]
+        return [log, len(log), False]
+    def read(name, offset, length):
+        calls.append(('read', offset, length))
+        return log[offset:offset + length]
+    return tail, read, calls
+
 
 class HelpersTest(unittest.TestCase):
 
@@ -46,6 +67,549 @@ class HelpersTest(unittest.TestCase):
 
         self.assertEqual(result, 'line1\nline2\nline3\n')
 
+    def test_get_last_lines_reads_one_window_when_enough(self):
+        log = ''.join(['line%d\n' % i for i in range(1000)])
+        tail, read, calls = _make_log(log)
+        result = get_last_lines('test:proc', tail, read, 3)
+        self.assertEqual(result, 'line997\nline998\nline999\n')
+        self.assertEqual(calls, [('tail', 0, INITIAL_BYTES_TO_READ)])
+
+    def test_get_last_lines_doubles_window_for_long_lines(self):
+        long_line = 'x' * (INITIAL_BYTES_TO_READ * 3) + '\n'
+        log = 'first\n' + long_line + 'short\n'
+        tail, read, calls = _make_log(log)
+        result = get_last_lines('test:proc', tail, read, 2)
+        self.assertEqual(result, long_line + 'short\n')
+        end = len(log)
+        self.assertEqual(calls, [
+            ('tail', 0, INITIAL_BYTES_TO_READ),
+            ('read', end - INITIAL_BYTES_TO_READ * 2, INITIAL_BYTES_TO_READ),
+            ('read', 0, end - INITIAL_BYTES_TO_READ * 2),
+            ])
+
+    def test_get_last_lines_stops_at_start_of_log(self):
+        log = 'x' * (INITIAL_BYTES_TO_READ + 10) + '\nend\n'
+        tail, read, calls = _make_log(log)
+        result = get_last_lines('test:proc', tail, read, 5)
+        self.assertEqual(result, log)
+        self.assertEqual(calls[-1], ('read', 0, len(log) - INITIAL_BYTES_TO_READ))
+
+    def test_get_last_lines_stops_at_limit(self):
+        log = 'x' * (MAX_BYTES_TO_READ * 2) + '\n'
+        tail, read, calls = _make_log(log)
+        result = get_last_lines('test:proc', tail, read, 1)
+        self.assertEqual(len(result), MAX_BYTES_TO_READ)
+        self.assertEqual(len(calls), 10)
+
+
+class GetLastLinesOfProcessesTest(unittest.TestCase):
+
+    def setUp(self):
+        import tempfile
+        from superlance.helpers import clear_logfile_cache
+        self.tempdir = tempfile.mkdtemp()
+        clear_logfile_cache()
+
+    def tearDown(self):
+        import shutil
+        from superlance.helpers import clear_logfile_cache
+        shutil.rmtree(self.tempdir)
+        clear_logfile_cache()
+
+    def _make_rpc(self, logs, paths=None):
+        """Return a fake rpc interface whose system.multicall serves
+        getProcessInfo, reporting the log file paths in paths, and the
+        tail/read methods for the logs, a {(name, stream): text} dict,
+        and the list of multicalls made."""
+        if paths is None:
+            paths = {}
+        multicalls = []
+        def multicall(calls):
+            multicalls.append(calls)
+            results = []
+            for call in calls:
+                method = call['methodName'].split('.')[1]
+                if method == 'getProcessInfo':
+                    name = call['params'][0]
+                    results.append([{
+                        'stderr_logfile': paths.get((name, 'stderr'), ''),
+                        'stdout_logfile': paths.get((name, 'stdout'), ''),
+                        }])
+                    continue
+                name, offset, length = call['params']
+                stream = 'stderr' if 'Stderr' in method else 'stdout'
+                log = logs.get((name, stream))
+                if log is None:
+                    results.append({'faultCode': 10,
+                                    'faultString': 'BAD_NAME: %s' % name})
+                elif method.startswith('tail'):
+                    if len(log) > length:
+                        results.append([[log[-length:], len(log), True]])
+                    else:
+                        results.append([[log, len(log), False]])
+                else:
+                    results.append([log[offset:offset + length]])
+            return results
+        rpc = Mock()
+        rpc.system.multicall.side_effect = multicall
+        return rpc, multicalls
+
+    def _callFUT(self, rpc, pheaders_list, stderr_lines, stdout_lines):
+        from superlance.helpers import get_last_lines_of_processes
+        with patch('superlance.helpers.get_rpc_interface',
+                   Mock(return_value=rpc)):
+            return get_last_lines_of_processes(pheaders_list, stderr_lines,
+                                               stdout_lines)
+
+    def test_one_round_trip_for_all_processes_and_streams(self):
+        rpc, multicalls = self._make_rpc({
+            ('grp:foo', 'stderr'): 'e1\ne2\ne3\n',
+            ('grp:foo', 'stdout'): 'o1\no2\n',
+            ('bar', 'stderr'): 'b1\n',
+            ('bar', 'stdout'): 'b2\n',
+            })
+        result = self._callFUT(rpc, [
+            {'groupname': 'grp', 'processname': 'foo'},
+            {'groupname': '', 'processname': 'bar'},
+            ], 2, 2)
+        self.assertEqual(result, [('e2\ne3\n', 'o1\no2\n'),
+                                  ('b1\n', 'b2\n')])
+        self.assertEqual([len(calls) for calls in multicalls], [2, 4])
+        self.assertEqual(multicalls[0][0],
+                         {'methodName': 'supervisor.getProcessInfo',
+                          'params': ['grp:foo']})
+
+    def test_skips_streams_with_no_lines(self):
+        rpc, multicalls = self._make_rpc({('foo', 'stdout'): 'o1\n'})
+        result = self._callFUT(rpc, [{'groupname': '', 'processname': 'foo'}],
+                               0, 5)
+        self.assertEqual(result, [('', 'o1\n')])
+        self.assertEqual(multicalls[1:], [[
+            {'methodName': 'supervisor.tailProcessStdoutLog',
+             'params': ['foo', 0, INITIAL_BYTES_TO_READ]},
+            ]])
+
+    def test_only_unfinished_tails_read_further(self):
+        long_line = 'x' * (INITIAL_BYTES_TO_READ * 3) + '\n'
+        rpc, multicalls = self._make_rpc({
+            ('foo', 'stderr'): 'first\n' + long_line,
+            ('foo', 'stdout'): 'short\n',
+            })
+        result = self._callFUT(rpc, [{'groupname': '', 'processname': 'foo'}],
+                               1, 1)
+        self.assertEqual(result, [(long_line, 'short\n')])
+        self.assertEqual([len(calls) for calls in multicalls], [1, 2, 1, 1])
+
+    def _write_log(self, name, text):
+        import os
+        path = os.path.join(self.tempdir, name)
+        f = open(path, 'wb')
+        f.write(text.encode('utf-8'))
+        f.close()
+        return path
+
+    def test_reads_local_log_files(self):
+        stderr = self._write_log('stderr.log', 'e1\ne2\ne3\n')
+        stdout = self._write_log('stdout.log', 'o1\no2\n')
+        rpc, multicalls = self._make_rpc({}, {('foo', 'stderr'): stderr,
+                                              ('foo', 'stdout'): stdout})
+        pheaders = {'groupname': '', 'processname': 'foo'}
+        result = self._callFUT(rpc, [pheaders], 2, 5)
+        self.assertEqual(result, [('e2\ne3\n', 'o1\no2\n')])
+        self.assertEqual(len(multicalls), 1)
+        # the paths are cached: no more RPC at all
+        result = self._callFUT(rpc, [pheaders], 1, 1)
+        self.assertEqual(result, [('e3\n', 'o2\n')])
+        self.assertEqual(len(multicalls), 1)
+
+    def test_falls_back_to_rpc_when_file_unreadable(self):
+        import os
+        missing = os.path.join(self.tempdir, 'missing.log')
+        rpc, multicalls = self._make_rpc({('foo', 'stderr'): 'e1\n'},
+                                         {('foo', 'stderr'): missing})
+        result = self._callFUT(rpc, [{'groupname': '', 'processname': 'foo'}],
+                               1, 0)
+        self.assertEqual(result, [('e1\n', '')])
+        self.assertEqual(multicalls[1][0]['methodName'],
+                         'supervisor.tailProcessStderrLog')
+
+    def test_unreadable_file_read_through_rpc_from_then_on(self):
+        import os
+        from superlance.helpers import forget_logfiles
+        stderr = self._write_log('stderr.log', 'e1\n')
+        rpc, multicalls = self._make_rpc({('foo', 'stderr'): 'e1\n'},
+                                         {('foo', 'stderr'): stderr})
+        pheaders = {'groupname': '', 'processname': 'foo'}
+        self.assertEqual(self._callFUT(rpc, [pheaders], 1, 0), [('e1\n', '')])
+        os.remove(stderr)
+        for i in range(3):
+            self.assertEqual(self._callFUT(rpc, [pheaders], 1, 0),
+                             [('e1\n', '')])
+        # one round trip each, without fetching the paths again
+        methods = [[call['methodName'] for call in calls]
+                   for calls in multicalls]
+        self.assertEqual(methods, [['supervisor.getProcessInfo']] +
+                         [['supervisor.tailProcessStderrLog']] * 3)
+        # until they are forgotten, e.g. on a PROCESS_GROUP event
+        self._write_log('stderr.log', 'e2\n')
+        forget_logfiles(['foo'])
+        self.assertEqual(self._callFUT(rpc, [pheaders], 1, 0), [('e2\n', '')])
+        self.assertEqual(5, len(multicalls))
+
+    def test_forget_logfiles(self):
+        from superlance.helpers import forget_logfiles
+        stderr = self._write_log('stderr.log', 'e1\n')
+        rpc, multicalls = self._make_rpc({}, {('foo', 'stderr'): stderr,
+                                              ('bar', 'stderr'): stderr})
+        pheaders_list = [{'groupname': '', 'processname': 'foo'},
+                         {'groupname': '', 'processname': 'bar'}]
+        self._callFUT(rpc, pheaders_list, 1, 0)
+        forget_logfiles(['foo', 'baz'])
+        self._callFUT(rpc, pheaders_list, 1, 0)
+        self.assertEqual(2, len(multicalls))
+        self.assertEqual([{'methodName': 'supervisor.getProcessInfo',
+                           'params': ['foo']}], multicalls[1])
+
+    def test_fault_is_raised(self):
+        from superlance.compat import xmlrpclib
+        rpc, multicalls = self._make_rpc({})
+        self.assertRaises(xmlrpclib.Fault, self._callFUT, rpc,
+                          [{'groupname': '', 'processname': 'foo'}], 1, 0)
+
+    def test_format_last_lines_of_process(self):
+        from superlance.helpers import format_last_lines_of_process
+        rpc, multicalls = self._make_rpc({('foo', 'stderr'): 'e1\n',
+                                          ('foo', 'stdout'): 'o1\n'})
+        with patch('superlance.helpers.get_rpc_interface',
+                   Mock(return_value=rpc)):
+            pheaders = {'groupname': '', 'processname': 'foo'}
+            self.assertEqual(format_last_lines_of_process(pheaders, 0, 0), '')
+            self.assertEqual(multicalls, [])
+            self.assertEqual(
+                format_last_lines_of_process(pheaders, 1, 1),
+                '-------LAST LINES OF STDERR---------\n'
+                'e1\n'
+                '-----------------END----------------\n'
+                '-------LAST LINES OF STDOUT---------\n'
+                'o1\n'
+                '-----------------END----------------\n')
+
+
+class ReadLastLinesTest(unittest.TestCase):
+
+    def setUp(self):
+        import tempfile
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.tempdir)
+
+    def _callFUT(self, text, lines, **kw):
+        import os
+        from superlance.helpers import read_last_lines
+        path = os.path.join(self.tempdir, 'test.log')
+        f = open(path, 'wb')
+        f.write(text.encode('utf-8'))
+        f.close()
+        return read_last_lines(path, lines, **kw)
+
+    def test_matches_get_last_lines(self):
+        long_line = 'x' * (INITIAL_BYTES_TO_READ * 3) + '\n'
+        for log, lines in [
+            ('', 3),
+            ('no newline', 1),
+            ('line1\nline2\nline3\n', 2),
+            ('line1\nline2\nline3\n', 10),
+            ('line1\nline2\npartial', 1),
+            ('first\n' + long_line + 'short\n', 2),
+            ]:
+            tail, read, calls = _make_log(log)
+            self.assertEqual(self._callFUT(log, lines),
+                             get_last_lines('test:proc', tail, read, lines))
+
+    def test_limit(self):
+        log = 'x' * 100 + '\n'
+        self.assertEqual(self._callFUT(log, 1, limit=10), 'x' * 9 + '\n')
+
+    def test_missing_file(self):
+        import os
+        from superlance.helpers import read_last_lines
+        self.assertRaises(EnvironmentError, read_last_lines,
+                          os.path.join(self.tempdir, 'missing'), 1)
+
+
+def _tail(log, offset, length):
+    """supervisor's tailFile for a log held in a string."""
+    size = len(log)
+    overflow = size > offset + length
+    if overflow:
+        offset = size - length
+    elif offset + length > size:
+        if offset > size - 1:
+            length = 0
+        offset = max(0, size - length)
+    return [log[offset:offset + length], size, overflow]
+
+
+def _read(log, offset, length):
+    """supervisor's readFile for a log held in a string."""
+    if length == 0:
+        return log[offset:]
+    return log[offset:offset + length]
+
+
+def _log_result(log, call):
+    """The multicall result of a tail or read call on log."""
+    name, offset, length = call['params']
+    if call['methodName'].split('.')[1].startswith('tail'):
+        return [_tail(log, offset, length)]
+    return [_read(log, offset, length)]
+
+
+class LogRingTest(unittest.TestCase):
+
+    def _makeOne(self, maxlines, window=100):
+        from superlance.helpers import LogRing
+        return LogRing('foo', 'Stderr', maxlines, window)
+
+    def _poll(self, ring, log):
+        """Poll ring on log; return the calls made, round by round."""
+        rounds = []
+        calls = ring.calls()
+        while calls:
+            rounds.append(calls)
+            calls = ring.feed([_log_result(log, call) for call in calls])
+        return rounds
+
+    def test_calls(self):
+        ring = self._makeOne(3)
+        self.assertEqual(ring.calls(),
+                         [{'methodName': 'supervisor.tailProcessStderrLog',
+                           'params': ['foo', 0, 100]}])
+        ring.feed([[['a\n', 2, False]]])
+        self.assertEqual(ring.calls(),
+                         [{'methodName': 'supervisor.tailProcessStderrLog',
+                           'params': ['foo', 2, 0]},
+                          {'methodName': 'supervisor.readProcessStderrLog',
+                           'params': ['foo', 2, 100]}])
+
+    def test_follows_appended_lines(self):
+        ring = self._makeOne(3)
+        log = 'a\nb\n'
+        self._poll(ring, log)
+        self.assertEqual(ring.text(), 'a\nb\n')
+        log += 'c\nd'
+        self._poll(ring, log)
+        self.assertEqual(ring.text(), 'b\nc\nd')
+        log += 'e\n'
+        self._poll(ring, log)
+        self.assertEqual(ring.text(), 'b\nc\nde\n')
+        self.assertEqual(ring.offset, len(log))
+        self._poll(ring, log)
+        self.assertEqual(ring.text(), 'b\nc\nde\n')
+
+    def test_reads_only_new_bytes(self):
+        ring = self._makeOne(3, window=1000)
+        log = 'x' * 900 + '\n'
+        self._poll(ring, log)
+        transferred = []
+        for i in range(5):
+            log += 'line %05d\n' % i
+            rounds = self._poll(ring, log)
+            self.assertEqual(1, len(rounds))
+            results = [_log_result(log, call)[0] for call in rounds[0]]
+            transferred.append(len(results[0][0]) + len(results[1]))
+        # the tail of no bytes transfers nothing but the size
+        self.assertEqual([11] * 5, transferred)
+        self.assertEqual(ring.text(),
+                         'line 00002\nline 00003\nline 00004\n')
+
+    def test_keeps_lines_after_log_truncated(self):
+        ring = self._makeOne(3)
+        self._poll(ring, 'old1\nold2\nold3\n')
+        self.assertEqual(ring.text(), 'old1\nold2\nold3\n')
+        rounds = self._poll(ring, 'new\n')
+        self.assertEqual(2, len(rounds))
+        self.assertEqual(ring.text(), 'old2\nold3\nnew\n')
+        self._poll(ring, 'new\nnext\n')
+        self.assertEqual(ring.text(), 'old3\nnew\nnext\n')
+
+    def test_keeps_lines_after_log_truncated_and_grown(self):
+        ring = self._makeOne(3, window=10)
+        self._poll(ring, 'old1\nold2\nold3\nold4\n')
+        # the new log is already larger than the window
+        self._poll(ring, 'a' * 12 + '\nb\n')
+        self.assertEqual(ring.text(), 'old4\naaaaaaa\nb\n')
+
+    def test_overflow_starts_over(self):
+        ring = self._makeOne(2, window=10)
+        log = 'a\n'
+        self._poll(ring, log)
+        log += 'x' * 20 + '\nlast\n'
+        rounds = self._poll(ring, log)
+        self.assertEqual(2, len(rounds))
+        self.assertEqual(ring.text(), 'xxxx\nlast\n')
+        self.assertEqual(ring.offset, len(log))
+
+    def test_fault_leaves_ring_as_it_was(self):
+        ring = self._makeOne(2)
+        self._poll(ring, 'a\n')
+        ring.calls()
+        self.assertEqual([], ring.feed([[['', 4, True]],
+                                        {'faultCode': 70,
+                                         'faultString': 'NO_FILE'}]))
+        self.assertEqual(ring.text(), 'a\n')
+        self.assertEqual(ring.offset, 2)
+
+    def test_multibyte_characters(self):
+        ring = self._makeOne(2)
+        # offsets count bytes, the data read is decoded text
+        log = u'caf\xe9\n'
+        ring.calls()
+        ring.feed([[[log, 6, False]]])
+        ring.calls()
+        ring.feed([[['', 13, True]], [u'na\xefve\n']])
+        self.assertEqual(ring.text(), u'caf\xe9\nna\xefve\n')
+        self.assertEqual(ring.offset, 13)
+
+
+class LogFollowerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.logs = {}
+        self.infos = []
+        self.multicalls = []
+
+    def _multicall(self, calls):
+        self.multicalls.append(calls)
+        results = []
+        for call in calls:
+            method = call['methodName'].split('.')[1]
+            if method == 'getAllProcessInfo':
+                results.append([self.infos])
+                continue
+            name = call['params'][0]
+            stream = 'stderr' if 'Stderr' in method else 'stdout'
+            log = self.logs.get((name, stream))
+            if log is None:
+                results.append({'faultCode': 70, 'faultString': 'NO_FILE'})
+            else:
+                results.append(_log_result(log, call))
+        return results
+
+    def _makeOne(self, *arg, **kw):
+        from superlance.helpers import LogFollower
+        follower = LogFollower(*arg, **kw)
+        rpc = Mock()
+        rpc.system.multicall.side_effect = self._multicall
+        patcher = patch('superlance.helpers.get_rpc_interface',
+                        Mock(return_value=rpc))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return follower
+
+    def test_poll_follows_matching_processes(self):
+        follower = self._makeOne(2, 1, ['web*'])
+        self.infos = [{'group': 'web', 'name': 'web_01'},
+                      {'group': 'db', 'name': 'db'}]
+        self.logs = {('web:web_01', 'stderr'): 'e1\n',
+                     ('web:web_01', 'stdout'): 'o1\n'}
+        follower.poll()
+        self.assertEqual(sorted(follower.rings), ['web:web_01'])
+        self.assertEqual(len(self.multicalls[0]), 1)
+        follower.poll()
+        self.assertEqual(len(self.multicalls[1]), 3)
+        follower.poll()
+        # the size of each log, and what was written since
+        self.assertEqual(len(self.multicalls[2]), 5)
+        self.logs[('web:web_01', 'stderr')] += 'e2\ne3\n'
+        pheaders = {'groupname': 'web', 'processname': 'web_01'}
+        self.assertEqual(follower.get_last_lines(pheaders),
+                         ('e2\ne3\n', 'o1\n'))
+        self.assertEqual(len(self.multicalls[3]), 4)
+        self.assertEqual(4, len(self.multicalls))
+
+    def test_poll_finishes_overflowed_logs_in_a_second_round(self):
+        follower = self._makeOne(1, 1, window=10)
+        self.infos = [{'group': 'foo', 'name': 'foo'},
+                      {'group': 'bar', 'name': 'bar'}]
+        self.logs = {('foo', 'stderr'): 'f\n', ('foo', 'stdout'): 'g\n',
+                     ('bar', 'stderr'): 'b\n', ('bar', 'stdout'): 'c\n'}
+        follower.poll()
+        follower.poll()
+        self.logs[('foo', 'stderr')] += 'x' * 20 + '\nlast\n'
+        self.logs[('bar', 'stderr')] += 'b2\n'
+        del self.multicalls[:]
+        follower.poll()
+        self.assertEqual([9, 1], [len(calls) for calls in self.multicalls])
+        self.assertEqual({'methodName': 'supervisor.tailProcessStderrLog',
+                          'params': ['foo', 0, 10]},
+                         self.multicalls[1][0])
+        self.assertEqual('last\n', follower.rings['foo'][0].text())
+        self.assertEqual('b2\n', follower.rings['bar'][0].text())
+
+    def test_keeps_lines_when_log_overwritten_after_crash(self):
+        follower = self._makeOne(2, 0)
+        self.infos = [{'group': 'foo', 'name': 'foo'}]
+        self.logs = {('foo', 'stderr'): 'boom\n'}
+        follower.poll()
+        follower.poll()
+        # the restarted process truncated the log before the event
+        self.logs[('foo', 'stderr')] = ''
+        pheaders = {'groupname': 'foo', 'processname': 'foo'}
+        self.assertEqual(follower.format_last_lines(pheaders),
+                         '-------LAST LINES OF STDERR---------\n'
+                         'boom\n'
+                         '-----------------END----------------\n')
+
+    def test_stops_following_removed_processes(self):
+        follower = self._makeOne(1, 1)
+        self.infos = [{'group': 'foo', 'name': 'foo'}]
+        follower.poll()
+        self.infos = []
+        follower.poll()
+        self.assertEqual(follower.rings, {})
+
+    def test_unfollowed_process_reads_logs_directly(self):
+        follower = self._makeOne(1, 1)
+        pheaders = {'groupname': 'foo', 'processname': 'foo'}
+        with patch('superlance.helpers.get_last_lines_of_process',
+                   Mock(return_value=('e', 'o'))) as get_last_lines:
+            self.assertEqual(follower.get_last_lines(pheaders), ('e', 'o'))
+        get_last_lines.assert_called_with(pheaders, 1, 1)
+
+
+class ProgramMatcherTest(unittest.TestCase):
+
+    def _makeOne(self, specs):
+        from superlance.helpers import ProgramMatcher
+        return ProgramMatcher(specs)
+
+    def test_matches_name_and_namespec(self):
+        matcher = self._makeOne(['foo', 'grp:bar'])
+        self.assertTrue(matcher.matches('foo', 'foo'))
+        self.assertTrue(matcher.matches('other', 'foo'))
+        self.assertTrue(matcher.matches('grp', 'bar'))
+        self.assertFalse(matcher.matches('other', 'bar'))
+
+    def test_matches_patterns(self):
+        matcher = self._makeOne(['web*', 'workers:*'])
+        self.assertTrue(matcher.matches('web', 'web_01'))
+        self.assertTrue(matcher.matches('workers', 'anything'))
+        self.assertFalse(matcher.matches('db', 'db_01'))
+
+    def test_matching_specs(self):
+        matcher = self._makeOne(['foo', 'grp:foo', 'f*', 'bar'])
+        self.assertEqual(sorted(matcher.matching_specs('grp', 'foo')),
+                         ['f*', 'foo', 'grp:foo'])
+        self.assertEqual(matcher.matching_specs('grp', 'baz'), [])
+
+    def test_no_specs(self):
+        matcher = self._makeOne([])
+        self.assertFalse(matcher.matches('foo', 'foo'))
+        self.assertEqual(matcher.matching_specs('foo', 'foo'), [])
+
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
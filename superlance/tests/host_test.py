@@ -0,0 +1,175 @@
+import unittest
+from mock import Mock
+from superlance.compat import StringIO
+
+class LoadPluginTests(unittest.TestCase):
+    def _callFUT(self, spec):
+        from superlance.host import load_plugin
+        return load_plugin(spec)
+
+    def test_loads_each_plugin(self):
+        from superlance.crashmail import CrashMail
+        from superlance.crashmailbatch import CrashMailBatch
+        from superlance.crashsms import CrashSMS
+        from superlance.fatalmailbatch import FatalMailBatch
+        from superlance.httpok import HTTPOk
+        from superlance.memmon import Memmon
+        from superlance.sentryreporter import SentryReporter
+        emails = '-t you@example.com -f me@example.com'
+        for spec, cls in (
+                ('memmon -a 200MB -m dev@example.com', Memmon),
+                ('httpok -p web "http://localhost:8080/"', HTTPOk),
+                ('crashmail -a -m dev@example.com', CrashMail),
+                ('crashmailbatch ' + emails, CrashMailBatch),
+                ('fatalmailbatch ' + emails, FatalMailBatch),
+                ('crashsms ' + emails, CrashSMS),
+                ('sentryreporter -e fatal -s http://dsn', SentryReporter)):
+            name, plugin = self._callFUT(spec)
+            self.assertEqual(spec.split()[0], name)
+            self.assertTrue(isinstance(plugin, cls), spec)
+
+    def test_passes_options(self):
+        name, plugin = self._callFUT('crashmail -p foo -p "bar:baz" -l 3')
+        self.assertEqual(['foo', 'bar:baz'], plugin.programs)
+        self.assertEqual(3, plugin.crash_loops.threshold)
+        name, plugin = self._callFUT('sentryreporter -e fatal')
+        self.assertEqual('fatal', plugin.event_type)
+        self.assertTrue(plugin.detect_gaps)
+
+    def test_passes_no_gap_detection(self):
+        for spec in ('crashmail -a -G', 'sentryreporter -e crash -G',
+                     'crashmailbatch -t you@example.com -f me@example.com '
+                     '--noGapDetection'):
+            name, plugin = self._callFUT(spec)
+            self.assertFalse(plugin.detect_gaps, spec)
+
+    def test_unknown_plugin(self):
+        self.assertRaises(ValueError, self._callFUT, 'nosuchplugin -a')
+        self.assertRaises(ValueError, self._callFUT, '')
+
+    def test_bad_options(self):
+        self.assertRaises(ValueError, self._callFUT, 'memmon -Z')
+        self.assertRaises(ValueError, self._callFUT, 'httpok -p foo')
+
+class ListenerHostTests(unittest.TestCase):
+    def _makeOne(self, plugins, rpc=None):
+        from superlance.host import ListenerHost
+        host = ListenerHost(plugins, rpc)
+        host.stdin = StringIO()
+        host.stdout = StringIO()
+        host.stderr = StringIO()
+        return host
+
+    def _makePlugin(self, events, **kw):
+        plugin = Mock(spec=['listener_events', 'handle_event'] + list(kw))
+        plugin.listener_events = events
+        for name, value in kw.items():
+            setattr(plugin, name, value)
+        return plugin
+
+    def test_dispatches_to_plugins_that_want_the_event(self):
+        ticks = self._makePlugin(('TICK',))
+        states = self._makePlugin(('PROCESS_STATE', 'TICK'),
+                                  dispatch_event=Mock())
+        host = self._makeOne([('ticks', ticks), ('states', states)])
+        host.handle_event({'eventname': 'TICK_60'}, 'when:1')
+        host.handle_event({'eventname': 'PROCESS_STATE_EXITED'}, 'x')
+        self.assertEqual(1, ticks.handle_event.call_count)
+        ticks.handle_event.assert_called_with({'eventname': 'TICK_60'},
+                                              'when:1')
+        self.assertEqual(2, states.dispatch_event.call_count)
+        self.assertEqual(0, states.handle_event.call_count)
+
+    def test_dispatches_every_process_state_event_to_reconcile(self):
+        from superlance.host import load_plugin
+        name, crashmail = load_plugin('crashmail -a -m dev@example.com')
+        crashmail.mail = Mock()
+        crashmail.stderr = StringIO()
+        crashmail.baseline_taken = True
+        info = {'group': 'foo', 'name': 'foo', 'statename': 'RUNNING',
+                'pid': 10, 'exitstatus': 0}
+        crashmail.reconcile_process_infos([info])
+        host = self._makeOne([(name, crashmail)])
+        host.handle_event({'eventname': 'PROCESS_STATE_STOPPING'},
+                          'processname:foo groupname:foo from_state:RUNNING '
+                          'pid:10')
+        # restarted, with the exit status of a JVM stopped by SIGTERM
+        crashmail.reconcile_process_infos([dict(info, pid=11,
+                                                exitstatus=143)])
+        self.assertEqual(0, crashmail.mail.call_count)
+        self.assertEqual('', crashmail.stderr.getvalue())
+
+    def test_plugin_error_does_not_stop_others(self):
+        broken = self._makePlugin(('TICK',))
+        broken.handle_event.side_effect = ValueError('boom')
+        other = self._makePlugin(('TICK',))
+        host = self._makeOne([('broken', broken), ('other', other)])
+        host.handle_event({'eventname': 'TICK_60'}, 'when:1')
+        self.assertEqual(1, other.handle_event.call_count)
+        output = host.stderr.getvalue()
+        self.assertTrue(output.startswith('Error in plugin broken:\n'))
+        self.assertTrue('ValueError: boom' in output)
+
+    def test_shares_rpc_and_snapshot(self):
+        rpc = Mock()
+        plugin = self._makePlugin(('TICK',), rpc=None)
+        host = self._makeOne([('memmon', plugin)], rpc)
+        self.assertTrue(plugin.rpc is rpc)
+        self.assertTrue(rpc.cache_snapshot)
+        host.handle_event({'eventname': 'TICK_60'}, 'when:1')
+        self.assertEqual(1, rpc.invalidate_snapshot.call_count)
+
+    def test_reconciles_plugins_after_missed_events(self):
+        plugin = self._makePlugin(('TICK',), reconcile=Mock(),
+                                  detect_gaps=True)
+        host = self._makeOne([('crashmail', plugin)])
+        host.handle_event({'eventname': 'TICK_60', 'poolserial': '1'}, '')
+        host.handle_event({'eventname': 'TICK_60', 'poolserial': '4'}, '')
+        self.assertEqual(1, plugin.reconcile.call_count)
+        self.assertEqual('Missed 2 events before event 4 (2 missed in '
+                         'all), reconciling\n', host.stderr.getvalue())
+
+    def test_no_gap_detection_without_plugins_detecting_gaps(self):
+        detecting = self._makePlugin(('TICK',), reconcile=Mock(),
+                                     detect_gaps=True)
+        other = self._makePlugin(('TICK',), reconcile=Mock(),
+                                 detect_gaps=False)
+        host = self._makeOne([('crashmail', detecting), ('memmon', other)])
+        host.handle_event({'eventname': 'TICK_60', 'poolserial': '1'}, '')
+        host.handle_event({'eventname': 'TICK_60', 'poolserial': '4'}, '')
+        self.assertEqual(1, detecting.reconcile.call_count)
+        self.assertEqual(0, other.reconcile.call_count)
+        # e.g. the pool turned out to have several processes
+        detecting.detect_gaps = False
+        host.handle_event({'eventname': 'TICK_60', 'poolserial': '9'}, '')
+        self.assertEqual(1, detecting.reconcile.call_count)
+        self.assertEqual(1, host.stderr.getvalue().count('Missed'))
+
+    def test_process_group_event_clears_logfile_cache(self):
+        from mock import patch
+        plugin = self._makePlugin(('PROCESS_STATE',))
+        host = self._makeOne([('crashmail', plugin)])
+        with patch('superlance.host.clear_logfile_cache') as clear:
+            host.handle_event({'eventname': 'PROCESS_GROUP_REMOVED'},
+                              'groupname:foo')
+        self.assertEqual(1, clear.call_count)
+        self.assertEqual(0, plugin.handle_event.call_count)
+
+    def test_ignores_httpok_interval(self):
+        plugin = self._makePlugin(('TICK',), interval=5.0)
+        host = self._makeOne([('httpok', plugin)])
+        self.assertEqual(None, plugin.interval)
+
+    def test_runforever(self):
+        plugin = self._makePlugin(('TICK',), start=Mock(), stop=Mock())
+        host = self._makeOne([('memmon', plugin)])
+        host.stdin.write('eventname:TICK_60 len:0\n')
+        host.stdin.seek(0)
+        host.runforever(test=True)
+        self.assertEqual('READY\nRESULT 2\nOK', host.stdout.getvalue())
+        self.assertEqual(1, plugin.start.call_count)
+        self.assertEqual(1, plugin.handle_event.call_count)
+        self.assertEqual(1, plugin.stop.call_count)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -50,6 +50,9 @@ def make_connection(response, exc=None):
         def getresponse(self):
             return response
 
+        def close(self):
+            pass
+
     return TestConnection
 
 class HTTPOkTests(unittest.TestCase):
@@ -115,6 +118,35 @@ class HTTPOkTests(unittest.TestCase):
         specs = list(prog.listProcesses(ProcessStates.RUNNING))
         self.assertEqual(len(specs), 0, (prog.programs, specs))
 
+    def test_listProcesses_w_namespec(self):
+        programs = ['baz:baz_01']
+        prog = self._makeOnePopulated(programs, None)
+        specs = list(prog.listProcesses())
+        self.assertEqual(specs,
+                         [DummySupervisorRPCNamespace.all_process_info[2]])
+
+    def test_listProcesses_w_pattern(self):
+        programs = ['ba*']
+        prog = self._makeOnePopulated(programs, None)
+        specs = list(prog.listProcesses())
+        self.assertEqual(specs,
+                         DummySupervisorRPCNamespace.all_process_info[1:])
+
+    def test_runforever_eager_error_on_request_pattern(self):
+        programs = ['f*', 'baz:*', 'nomatch*']
+        prog = self._makeOnePopulated(programs, None, exc=True)
+        prog.stdin.write('eventname:TICK len:0\n')
+        prog.stdin.seek(0)
+        prog.runforever(test=True)
+        lines = prog.stderr.getvalue().split('\n')
+        self.assertEqual(lines[1], 'foo is in RUNNING state, restarting')
+        self.assertEqual(lines[2], 'foo restarted')
+        self.assertTrue(lines[3].startswith('foo: restart took '))
+        self.assertEqual(lines[4],
+                         'baz:baz_01 not in RUNNING state, NOT restarting')
+        self.assertEqual(lines[5],
+          "Programs not restarted because they did not exist: ['nomatch*']")
+
     def test_runforever_eager_notatick(self):
         programs = {'foo':0, 'bar':0, 'baz_01':0 }
         any = None
@@ -139,13 +171,14 @@ class HTTPOkTests(unittest.TestCase):
                          )
         self.assertEqual(lines[1], 'foo is in RUNNING state, restarting')
         self.assertEqual(lines[2], 'foo restarted')
-        self.assertEqual(lines[3], 'bar not in RUNNING state, NOT restarting')
-        self.assertEqual(lines[4],
-                         'baz:baz_01 not in RUNNING state, NOT restarting')
+        self.assertTrue(lines[3].startswith('foo: restart took '))
+        self.assertEqual(lines[4], 'bar not in RUNNING state, NOT restarting')
         self.assertEqual(lines[5],
+                         'baz:baz_01 not in RUNNING state, NOT restarting')
+        self.assertEqual(lines[6],
           "Programs not restarted because they did not exist: ['notexisting']")
         mailed = prog.mailed.split('\n')
-        self.assertEqual(len(mailed), 12)
+        self.assertEqual(len(mailed), 13)
         self.assertEqual(mailed[0], 'To: chrism@plope.com')
         self.assertEqual(mailed[1],
                     'Subject: httpok for http://foo/bar: bad status returned')
@@ -162,11 +195,12 @@ class HTTPOkTests(unittest.TestCase):
         self.assertEqual(lines[0], 'Restarting all running processes')
         self.assertEqual(lines[1], 'foo is in RUNNING state, restarting')
         self.assertEqual(lines[2], 'foo restarted')
-        self.assertEqual(lines[3], 'bar not in RUNNING state, NOT restarting')
-        self.assertEqual(lines[4],
+        self.assertTrue(lines[3].startswith('foo: restart took '))
+        self.assertEqual(lines[4], 'bar not in RUNNING state, NOT restarting')
+        self.assertEqual(lines[5],
                          'baz:baz_01 not in RUNNING state, NOT restarting')
         mailed = prog.mailed.split('\n')
-        self.assertEqual(len(mailed), 11)
+        self.assertEqual(len(mailed), 12)
         self.assertEqual(mailed[0], 'To: chrism@plope.com')
         self.assertEqual(mailed[1],
                     'Subject: httpok for http://foo/bar: bad status returned')
@@ -186,8 +220,9 @@ class HTTPOkTests(unittest.TestCase):
         self.assertEqual(lines[2],
                     "Failed to stop process foo:FAILED: <Fault 30: 'FAILED'>")
         self.assertEqual(lines[3], 'foo:FAILED restarted')
+        self.assertTrue(lines[4].startswith('foo:FAILED: restart took '))
         mailed = prog.mailed.split('\n')
-        self.assertEqual(len(mailed), 10)
+        self.assertEqual(len(mailed), 11)
         self.assertEqual(mailed[0], 'To: chrism@plope.com')
         self.assertEqual(mailed[1],
                     'Subject: httpok for http://foo/bar: bad status returned')
@@ -208,8 +243,9 @@ class HTTPOkTests(unittest.TestCase):
                          'foo:SPAWN_ERROR is in RUNNING state, restarting')
         self.assertEqual(lines[2],
            "Failed to start process foo:SPAWN_ERROR: <Fault 50: 'SPAWN_ERROR'>")
+        self.assertTrue(lines[3].startswith('foo:SPAWN_ERROR: restart took '))
         mailed = prog.mailed.split('\n')
-        self.assertEqual(len(mailed), 9)
+        self.assertEqual(len(mailed), 10)
         self.assertEqual(mailed[0], 'To: chrism@plope.com')
         self.assertEqual(mailed[1],
                     'Subject: httpok for http://foo/bar: bad status returned')
@@ -232,17 +268,76 @@ class HTTPOkTests(unittest.TestCase):
         self.assertEqual(lines[3], ' ')
         self.assertEqual(lines[4], 'foo is in RUNNING state, restarting')
         self.assertEqual(lines[5], 'foo restarted')
-        self.assertEqual(lines[6], 'bar not in RUNNING state, NOT restarting')
-        self.assertEqual(lines[7],
-                         'baz:baz_01 not in RUNNING state, NOT restarting')
+        self.assertTrue(lines[6].startswith('foo: restart took '))
+        self.assertEqual(lines[7], 'bar not in RUNNING state, NOT restarting')
         self.assertEqual(lines[8],
+                         'baz:baz_01 not in RUNNING state, NOT restarting')
+        self.assertEqual(lines[9],
           "Programs not restarted because they did not exist: ['notexisting']")
         mailed = prog.mailed.split('\n')
-        self.assertEqual(len(mailed), 15)
+        self.assertEqual(len(mailed), 16)
         self.assertEqual(mailed[0], 'To: chrism@plope.com')
         self.assertEqual(mailed[1],
                     'Subject: httpok for http://foo/bar: bad status returned')
 
+    def test_runforever_eager_gcore_timeout(self):
+        programs = ['foo']
+        any = None
+        prog = self._makeOnePopulated(programs, any, exc=True,
+                                      gcore="sleep 10; true",
+                                      coredir="/tmp")
+        prog.dump_timeout = 0.1
+        prog.stdin.write('eventname:TICK len:0\n')
+        prog.stdin.seek(0)
+        prog.runforever(test=True)
+        lines = prog.stderr.getvalue().split('\n')
+        self.assertEqual(lines[1],
+                         'gcore for foo timed out after 0.1 seconds')
+        self.assertEqual(lines[2], 'gcore output for foo:')
+        self.assertEqual(lines[5], 'foo is in RUNNING state, restarting')
+
+    def test_runforever_eager_gcore_compress(self):
+        import gzip, os, shutil, tempfile
+        coredir = tempfile.mkdtemp()
+        try:
+            programs = ['foo']
+            prog = self._makeOnePopulated(programs, None, exc=True,
+                gcore='sh -c \'echo core > "$0.$1"\'', coredir=coredir)
+            prog.compress = True
+            prog.stdin.write('eventname:TICK len:0\n')
+            prog.stdin.seek(0)
+            prog.runforever(test=True)
+            self.assertEqual(os.listdir(coredir), ['foo.11.gz'])
+            with gzip.open(os.path.join(coredir, 'foo.11.gz')) as f:
+                self.assertEqual(f.read(), b'core\n')
+        finally:
+            shutil.rmtree(coredir)
+
+    def test_runforever_eager_stacks(self):
+        import os, shutil, tempfile
+        procdir = tempfile.mkdtemp()
+        try:
+            threaddir = os.path.join(procdir, '11', 'task', '11')
+            os.makedirs(threaddir)
+            with open(os.path.join(threaddir, 'wchan'), 'w') as f:
+                f.write('futex_wait_queue')
+            with open(os.path.join(threaddir, 'stack'), 'w') as f:
+                f.write('[<0>] futex_wait_queue+0x60/0x90\n')
+            prog = self._makeOnePopulated(['foo'], None, exc=True,
+                                          gcore="true", coredir="/tmp")
+            prog.stacks = True
+            prog.procdir = procdir
+            prog.stdin.write('eventname:TICK len:0\n')
+            prog.stdin.seek(0)
+            prog.runforever(test=True)
+            lines = prog.stderr.getvalue().split('\n')
+            self.assertEqual(lines[1], 'kernel stacks for foo:')
+            self.assertEqual(lines[3], 'thread 11 (wchan futex_wait_queue):')
+            self.assertEqual(lines[4], '[<0>] futex_wait_queue+0x60/0x90')
+            self.assertEqual(lines[5], 'foo is in RUNNING state, restarting')
+        finally:
+            shutil.rmtree(procdir)
+
     def test_runforever_not_eager_none_running(self):
         programs = ['bar', 'baz_01']
         any = None
@@ -268,9 +363,10 @@ class HTTPOkTests(unittest.TestCase):
                          )
         self.assertEqual(lines[1], 'foo is in RUNNING state, restarting')
         self.assertEqual(lines[2], 'foo restarted')
-        self.assertEqual(lines[3], 'bar not in RUNNING state, NOT restarting')
+        self.assertTrue(lines[3].startswith('foo: restart took '))
+        self.assertEqual(lines[4], 'bar not in RUNNING state, NOT restarting')
         mailed = prog.mailed.split('\n')
-        self.assertEqual(len(mailed), 10)
+        self.assertEqual(len(mailed), 11)
         self.assertEqual(mailed[0], 'To: chrism@plope.com')
         self.assertEqual(mailed[1],
                     'Subject: httpok for http://foo/bar: bad status returned')
@@ -303,12 +399,164 @@ class HTTPOkTests(unittest.TestCase):
                          )
         self.assertEqual(lines[1], 'foo is in RUNNING state, restarting')
         self.assertEqual(lines[2], 'foo restarted')
-        self.assertEqual(lines[3], 'bar not in RUNNING state, NOT restarting')
+        self.assertTrue(lines[3].startswith('foo: restart took '))
+        self.assertEqual(lines[4], 'bar not in RUNNING state, NOT restarting')
         mailed = prog.mailed.split('\n')
-        self.assertEqual(len(mailed), 10)
+        self.assertEqual(len(mailed), 11)
         self.assertEqual(mailed[0], 'To: chrism@plope.com')
         self.assertEqual(mailed[1],
                     'Subject: httpok for http://foo/bar: bad status returned')
 
+    def test_runforever_actions_recovered_on_recheck(self):
+        programs = ['foo']
+        prog = self._makeOnePopulated(programs, None,
+                                      exc=[ValueError('foo')])
+        prog.actions = {
+            'foo': [('signal', 'HUP'), ('wait', 0), ('recheck', None),
+                    ('restart', None)],
+            }
+        prog.stdin.write('eventname:TICK len:0\n')
+        prog.stdin.seek(0)
+        prog.runforever(test=True)
+        lines = [x for x in prog.stderr.getvalue().split('\n') if x]
+        self.assertEqual(lines[0], "Restarting selected processes ['foo']")
+        self.assertEqual(lines[1], 'foo is in RUNNING state, remediating '
+                                   'with signal:HUP,wait:0,recheck,restart')
+        self.assertEqual(lines[2], 'Sent SIGHUP to foo')
+        self.assertEqual(lines[3], 'foo recovered, skipping remaining actions')
+        self.assertTrue(lines[4].startswith(
+            'foo: signal:HUP,wait:0,recheck took '))
+        self.assertEqual(prog.rpc.supervisor._signalled, ('foo', 'HUP'))
+        self.assertTrue('foo: signal:HUP,wait:0,recheck took ' in prog.mailed)
+
+    def test_runforever_actions_still_failing_on_recheck(self):
+        programs = ['foo']
+        prog = self._makeOnePopulated(programs, None, exc=True)
+        prog.actions = {
+            None: [('signal', 'HUP'), ('recheck', None), ('restart', None)],
+            }
+        prog.stdin.write('eventname:TICK len:0\n')
+        prog.stdin.seek(0)
+        prog.runforever(test=True)
+        lines = [x for x in prog.stderr.getvalue().split('\n') if x]
+        self.assertEqual(lines[2], 'Sent SIGHUP to foo')
+        self.assertEqual(lines[3], 'foo still failing: error contacting '
+                                   'http://foo/bar:')
+        self.assertEqual(lines[5], 'foo restarted')
+        self.assertTrue(lines[6].startswith(
+            'foo: signal:HUP,recheck,restart took '))
+
+    def test_parse_actions(self):
+        from superlance.httpok import parse_actions
+        self.assertEqual(parse_actions('restart'),
+                         (None, [('restart', None)]))
+        self.assertEqual(parse_actions('grp:foo=SIGNAL:sighup,wait:2.5,recheck'),
+                         ('grp:foo', [('signal', 'HUP'), ('wait', 2.5),
+                                      ('recheck', None)]))
+        self.assertRaises(ValueError, parse_actions, 'reboot')
+        self.assertRaises(ValueError, parse_actions, 'wait:soon')
+        self.assertRaises(ValueError, parse_actions, 'signal')
+        self.assertRaises(ValueError, parse_actions, 'restart:now')
+
+    def test_runscheduled_checks_between_events(self):
+        programs = ['foo']
+        prog = self._makeOnePopulated(programs, None, exc=True)
+        prog.interval = 0.01
+        waits = []
+        def wait_for_event(timeout):
+            waits.append(timeout)
+            return len(waits) > 1
+        prog.wait_for_event = wait_for_event
+        prog.stdin.write('eventname:TICK_5 len:0\n')
+        prog.stdin.seek(0)
+        prog.runforever(test=True)
+        lines = [x for x in prog.stderr.getvalue().split('\n') if x]
+        self.assertEqual(lines[0], "Restarting selected processes ['foo']")
+        self.assertEqual(prog.stdout.getvalue(), 'READY\nRESULT 2\nOK')
+        self.assertEqual(len(waits), 2)
+        self.assertTrue(0 <= waits[0] <= 0.01)
+        self.assertTrue(0 < waits[1] <= 0.01)
+
+    def test_runscheduled_event_only(self):
+        programs = ['foo']
+        prog = self._makeOnePopulated(programs, None, exc=True)
+        prog.interval = 60
+        prog.wait_for_event = lambda timeout: True
+        prog.stdin.write('eventname:TICK_5 len:0\n')
+        prog.stdin.seek(0)
+        prog.runforever(test=True)
+        self.assertEqual(prog.stderr.getvalue(), '')
+        self.assertEqual(prog.stdout.getvalue(), 'READY\nRESULT 2\nOK')
+
+    def test_runforever_metrics(self):
+        import os, shutil, tempfile
+        tempdir = tempfile.mkdtemp()
+        try:
+            error = socket.error()
+            error.errno = 111
+            prog = self._makeOnePopulated(['foo'], None,
+                exc=[error for x in range(100)])
+            prog.metrics_file = os.path.join(tempdir, 'httpok.prom')
+            prog.stdin.write('eventname:TICK len:0\n')
+            prog.stdin.seek(0)
+            prog.runforever(test=True)
+            url = 'http://foo/bar'
+            self.assertEqual(prog.checks.get(url=url, outcome='refused'), 1)
+            self.assertEqual(prog.check_seconds.get_count(url=url), 1)
+            self.assertEqual(prog.restarts.get(program='foo'), 1)
+            with open(prog.metrics_file) as f:
+                exported = f.read()
+            self.assertTrue('httpok_checks_total{url="http://foo/bar",'
+                            'outcome="refused"} 1' in exported)
+        finally:
+            shutil.rmtree(tempdir)
+
+    def test_check_outcome_refused_by_closed_port(self):
+        from superlance.tests.timeoutconn_test import closed_port
+        prog = self._makeOnePopulated(['foo'], None)
+        prog.connclass = None
+        for url in ('http://127.0.0.1:%d/bar' % closed_port(),
+                    'tcp://127.0.0.1:%d' % closed_port()):
+            prog.url = url
+            subject, msg = prog.check()
+            self.assertEqual(prog.checks.get(url=url, outcome='refused'), 1)
+
+    def test_check_outcomes(self):
+        url = 'http://foo/bar'
+        prog = self._makeOnePopulated(['foo'], None)
+        self.assertEqual(prog.check(), None)
+        prog.inbody = 'missing'
+        self.assertEqual(prog.check()[0],
+                         'httpok for %s: bad body returned' % url)
+        prog.status = '204'
+        self.assertEqual(prog.check()[0],
+                         'httpok for %s: bad status returned' % url)
+        self.assertEqual(prog.checks.get(url=url, outcome='ok'), 1)
+        self.assertEqual(prog.checks.get(url=url, outcome='bad_body'), 1)
+        self.assertEqual(prog.checks.get(url=url, outcome='bad_status'), 1)
+
+    def test_runforever_tcp_url_without_port(self):
+        prog = self._makeOnePopulated(['foo'], None)
+        prog.connclass = None
+        prog.url = 'tcp://foo'
+        self.assertRaises(ValueError, prog.runforever, test=True)
+
+    def test_runforever_timeout(self):
+        programs = ['foo']
+        any = None
+        prog = self._makeOnePopulated(programs, any,
+            exc=[socket.timeout('deadline exceeded')])
+        prog.stdin.write('eventname:TICK len:0\n')
+        prog.stdin.seek(0)
+        prog.runforever(test=True)
+        lines = [x for x in prog.stderr.getvalue().split('\n') if x]
+        self.assertEqual(lines[0], "Restarting selected processes ['foo']")
+        self.assertEqual(lines[1], 'foo is in RUNNING state, restarting')
+        mailed = prog.mailed.split('\n')
+        self.assertEqual(mailed[1],
+                    'Subject: httpok for http://foo/bar: timed out')
+        self.assertEqual(mailed[3],
+                    'timeout contacting http://foo/bar after 10 seconds:')
+
 if __name__ == '__main__':
     unittest.main()
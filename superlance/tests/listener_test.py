@@ -0,0 +1,321 @@
+import unittest
+from mock import Mock, patch
+from superlance.compat import StringIO
+
+class PoolSerialTrackerTests(unittest.TestCase):
+    def _makeOne(self):
+        from superlance.listener import PoolSerialTracker
+        return PoolSerialTracker()
+
+    def test_check(self):
+        tracker = self._makeOne()
+        self.assertEqual(0, tracker.check({'poolserial': '7'}))
+        self.assertEqual(0, tracker.check({'poolserial': '8'}))
+        self.assertEqual(3, tracker.check({'poolserial': '12'}))
+        self.assertEqual(1, tracker.check({'poolserial': '14'}))
+        self.assertEqual(4, tracker.dropped)
+        self.assertEqual(2, tracker.gaps)
+
+    def test_check_restarted_supervisord(self):
+        tracker = self._makeOne()
+        tracker.check({'poolserial': '100'})
+        self.assertEqual(0, tracker.check({'poolserial': '0'}))
+        self.assertEqual(0, tracker.check({'poolserial': '1'}))
+        self.assertEqual(0, tracker.dropped)
+
+    def test_check_without_poolserial(self):
+        tracker = self._makeOne()
+        self.assertEqual(0, tracker.check({}))
+        self.assertEqual(None, tracker.last)
+
+class EventListenerTests(unittest.TestCase):
+    def _makeOne(self, events):
+        from superlance.listener import EventListener
+        listener = EventListener()
+        listener.stdin = StringIO(''.join(
+            ['ver:3.0 poolserial:%d pool:p eventname:TICK_5 len:0\n' % serial
+             for serial in events]))
+        listener.stdout = StringIO()
+        listener.stderr = StringIO()
+        listener.reconcile_process_infos = Mock()
+        return listener
+
+    @patch('superlance.listener.get_rpc_interface')
+    def test_wait_for_event_reconciles_after_gap(self, get_rpc_interface):
+        rpc = get_rpc_interface.return_value
+        rpc.supervisor.getAllProcessInfo.return_value = [{'name': 'foo'}]
+        listener = self._makeOne([1, 2, 5])
+        listener.wait_for_event()
+        headers, payload = listener.wait_for_event()
+        self.assertEqual('2', headers['poolserial'])
+        self.assertEqual(0, listener.reconcile_process_infos.call_count)
+        listener.wait_for_event()
+        listener.reconcile_process_infos.assert_called_with([{'name': 'foo'}])
+        self.assertEqual('Missed 2 events before event 5 of pool p '
+                         '(2 missed in all), reconciling\n',
+                         listener.stderr.getvalue())
+
+    @patch('superlance.listener.get_rpc_interface')
+    def test_reconcile_error(self, get_rpc_interface):
+        get_rpc_interface.side_effect = KeyError('SUPERVISOR_SERVER_URL')
+        listener = self._makeOne([1, 3])
+        listener.wait_for_event()
+        listener.wait_for_event()
+        self.assertEqual(0, listener.reconcile_process_infos.call_count)
+        self.assertTrue('Error reconciling process states'
+                        in listener.stderr.getvalue())
+
+    def test_no_gap_detection(self):
+        listener = self._makeOne([1, 5])
+        listener.detect_gaps = False
+        listener.wait_for_event()
+        listener.wait_for_event()
+        self.assertEqual('', listener.stderr.getvalue())
+
+    @patch('superlance.listener.get_rpc_interface')
+    def test_no_baseline_without_gap_detection_or_ticks(self,
+                                                        get_rpc_interface):
+        from superlance.listener import EventListener
+        listener = EventListener(detect_gaps=False)
+        listener.handle_event = Mock()
+        listener.dispatch_event({'eventname': 'TICK_60'}, 'when:1')
+        self.assertEqual(0, get_rpc_interface.call_count)
+        self.assertEqual(1, listener.handle_event.call_count)
+
+    @patch.dict('os.environ', {'SUPERVISOR_GROUP_NAME': 'crashmail'})
+    def test_several_processes_in_pool_turn_gap_detection_off(self):
+        from superlance.listener import EventListener
+        listener = EventListener()
+        listener.stderr = StringIO()
+        listener.reconcile_process_infos([
+            _info('crashmail_00', 'RUNNING', 10, group='crashmail'),
+            _info('foo', 'RUNNING', 11)])
+        self.assertTrue(listener.detect_gaps)
+        listener.reconcile_process_infos([
+            _info('crashmail_00', 'RUNNING', 10, group='crashmail'),
+            _info('crashmail_01', 'RUNNING', 12, group='crashmail'),
+            _info('foo', 'RUNNING', 11)])
+        self.assertFalse(listener.detect_gaps)
+        self.assertEqual('Listener pool crashmail has 2 processes, not '
+                         'detecting dropped events\n',
+                         listener.stderr.getvalue())
+
+    @patch('superlance.listener.forget_logfiles')
+    def test_forgets_logfiles_of_added_and_removed_processes(self,
+                                                             forget_logfiles):
+        from superlance.listener import EventListener
+        listener = EventListener()
+        listener.stderr = StringIO()
+        listener.reconcile_process_infos([_info('foo', 'RUNNING', 10),
+                                          _info('bar', 'RUNNING', 11)])
+        self.assertEqual(0, forget_logfiles.call_count)
+        listener.reconcile_process_infos([_info('foo', 'RUNNING', 10),
+                                          _info('baz', 'RUNNING', 12)])
+        forget_logfiles.assert_called_once_with(['bar:bar', 'baz:baz'])
+
+    @patch('superlance.listener.clear_logfile_cache')
+    def test_process_group_event_clears_logfile_cache(self,
+                                                      clear_logfile_cache):
+        from superlance.listener import EventListener
+        listener = EventListener(detect_gaps=False)
+        listener.handle_event = Mock()
+        listener.dispatch_event({'eventname': 'TICK_60'}, 'when:1')
+        self.assertEqual(0, clear_logfile_cache.call_count)
+        listener.dispatch_event({'eventname': 'PROCESS_GROUP_ADDED'},
+                                'groupname:foo')
+        self.assertEqual(1, clear_logfile_cache.call_count)
+
+def _info(name, statename, pid, exitstatus=0, group=None):
+    return {'name': name, 'group': group or name, 'statename': statename,
+            'pid': pid, 'exitstatus': exitstatus}
+
+class RecentKeysTests(unittest.TestCase):
+    def _makeOne(self, maxkeys):
+        from superlance.listener import RecentKeys
+        return RecentKeys(maxkeys)
+
+    def test_forgets_oldest_first(self):
+        keys = self._makeOne(2)
+        for key in ('a', 'b', 'a', 'c'):
+            keys.add(key)
+        self.assertEqual(2, len(keys))
+        self.assertFalse('a' in keys)
+        self.assertTrue('b' in keys)
+        self.assertTrue('c' in keys)
+
+    def test_discard(self):
+        keys = self._makeOne(2)
+        keys.add('a')
+        keys.add('b')
+        keys.discard('a')
+        keys.discard('z')
+        keys.add('a')
+        keys.add('c')
+        self.assertEqual(['a', 'c'], sorted(keys.keys))
+
+class ProcessStateReconcilerTests(unittest.TestCase):
+    def _makeOne(self, **kw):
+        from superlance.listener import ProcessStateReconciler
+        return ProcessStateReconciler(**kw)
+
+    def test_diff_finds_unexpected_exit(self):
+        reconciler = self._makeOne()
+        self.assertEqual([], reconciler.diff([_info('foo', 'RUNNING', 10),
+                                              _info('bar', 'RUNNING', 20)]))
+        events = reconciler.diff([_info('foo', 'RUNNING', 11, exitstatus=2),
+                                  _info('bar', 'RUNNING', 20)])
+        self.assertEqual(1, len(events))
+        headers, payload = events[0]
+        self.assertEqual('PROCESS_STATE_EXITED', headers['eventname'])
+        self.assertEqual(str(len(payload)), headers['len'])
+        self.assertEqual('processname:foo groupname:foo from_state:RUNNING '
+                         'expected:0 pid:10', payload)
+        # reported once
+        self.assertEqual([], reconciler.diff(
+            [_info('foo', 'RUNNING', 11, exitstatus=2)]))
+
+    def test_diff_ignores_expected_and_stopped(self):
+        reconciler = self._makeOne()
+        reconciler.diff([_info('foo', 'RUNNING', 10),
+                         _info('bar', 'RUNNING', 20),
+                         _info('baz', 'RUNNING', 30)])
+        self.assertEqual([], reconciler.diff(
+            [_info('foo', 'RUNNING', 11, exitstatus=0),
+             _info('bar', 'STOPPED', 0, exitstatus=1),
+             _info('baz', 'EXITED', 0, exitstatus=-1)]))
+
+    def test_diff_baseline(self):
+        reconciler = self._makeOne()
+        self.assertEqual([], reconciler.diff([_info('foo', 'FATAL', 0),
+                                              _info('bar', 'RUNNING', 20)]))
+        # already FATAL before the listener started:  not reported
+        self.assertEqual([], reconciler.diff([_info('foo', 'FATAL', 0),
+                                              _info('bar', 'RUNNING', 20)]))
+        reconciler.diff([_info('foo', 'RUNNING', 5)])
+        self.assertEqual(1, len(reconciler.diff([_info('foo', 'FATAL', 0)])))
+
+    def test_diff_finds_fatal_once(self):
+        reconciler = self._makeOne()
+        reconciler.diff([])
+        events = reconciler.diff([_info('foo', 'FATAL', 0, group='g')])
+        self.assertEqual([({'ver': '3.0', 'server': 'superlance',
+                            'eventname': 'PROCESS_STATE_FATAL',
+                            'len': '46', 'synthesized': '1'},
+                           'processname:foo groupname:g from_state:BACKOFF')],
+                         events)
+        self.assertEqual([], reconciler.diff([_info('foo', 'FATAL', 0,
+                                                    group='g')]))
+        reconciler.diff([_info('foo', 'RUNNING', 5, group='g')])
+        self.assertEqual(1, len(reconciler.diff([_info('foo', 'FATAL', 0,
+                                                       group='g')])))
+
+    def test_seen_dedupes_both_ways(self):
+        reconciler = self._makeOne()
+        reconciler.diff([_info('foo', 'RUNNING', 10),
+                         _info('bar', 'RUNNING', 20)])
+        exited = {'eventname': 'PROCESS_STATE_EXITED'}
+        # received, then found:  not synthesized
+        self.assertFalse(reconciler.seen(
+            exited, 'processname:foo groupname:foo expected:0 pid:10'))
+        # found, then received:  not handled again
+        events = reconciler.diff([_info('foo', 'RUNNING', 11, exitstatus=1),
+                                  _info('bar', 'RUNNING', 21, exitstatus=1)])
+        self.assertEqual(1, len(events))
+        self.assertTrue('processname:bar' in events[0][1])
+        self.assertTrue(reconciler.seen(
+            exited, 'processname:bar groupname:bar expected:0 pid:20'))
+        self.assertFalse(reconciler.seen({'eventname': 'TICK_5'},
+                                         'when:1'))
+
+    def test_stopping_is_not_a_crash(self):
+        reconciler = self._makeOne()
+        reconciler.diff([_info('foo', 'RUNNING', 10),
+                         _info('bar', 'RUNNING', 20)])
+        self.assertFalse(reconciler.seen(
+            {'eventname': 'PROCESS_STATE_STOPPING'},
+            'processname:foo groupname:foo from_state:RUNNING pid:10'))
+        # restarted, exiting with 143 on SIGTERM
+        events = reconciler.diff([_info('foo', 'RUNNING', 11, exitstatus=143),
+                                  _info('bar', 'RUNNING', 21, exitstatus=143)])
+        self.assertEqual(1, len(events))
+        self.assertTrue('processname:bar' in events[0][1])
+
+    def test_real_event_clears_fatal(self):
+        reconciler = self._makeOne()
+        reconciler.diff([])
+        reconciler.diff([_info('foo', 'FATAL', 0)])
+        fatal = {'eventname': 'PROCESS_STATE_FATAL'}
+        payload = 'processname:foo groupname:foo from_state:BACKOFF'
+        self.assertTrue(reconciler.seen(fatal, payload))
+        reconciler.seen({'eventname': 'PROCESS_STATE_STARTING'},
+                        'processname:foo groupname:foo from_state:FATAL')
+        self.assertFalse(reconciler.seen(fatal, payload))
+
+    def test_keys_are_bounded(self):
+        reconciler = self._makeOne(maxkeys=2)
+        exited = {'eventname': 'PROCESS_STATE_EXITED'}
+        for pid in range(5):
+            reconciler.seen(
+                exited, 'processname:foo groupname:foo expected:0 pid:%d' % pid)
+        self.assertEqual(2, len(reconciler.received))
+
+class DispatchEventTests(unittest.TestCase):
+    def _makeOne(self, reconcile_ticks):
+        from superlance.listener import EventListener
+        listener = EventListener(reconcile_ticks)
+        listener.stderr = StringIO()
+        listener.handle_event = Mock()
+        return listener
+
+    @patch('superlance.listener.get_rpc_interface')
+    def test_reconciles_every_n_ticks(self, get_rpc_interface):
+        getAllProcessInfo = get_rpc_interface.return_value.supervisor.getAllProcessInfo
+        getAllProcessInfo.side_effect = [
+            [_info('foo', 'RUNNING', 10)],
+            [_info('foo', 'RUNNING', 10)],
+            [_info('foo', 'RUNNING', 11, exitstatus=1)],
+        ]
+        listener = self._makeOne(2)
+        tick = {'eventname': 'TICK_60'}
+        for i in range(4):
+            listener.dispatch_event(tick, 'when:1')
+        # the baseline, then every 2 ticks
+        self.assertEqual(3, getAllProcessInfo.call_count)
+        synthesized = [call[0] for call in listener.handle_event.call_args_list
+                       if call[0][0]['eventname'] != 'TICK_60']
+        self.assertEqual(1, len(synthesized))
+        self.assertEqual('PROCESS_STATE_EXITED', synthesized[0][0]['eventname'])
+        self.assertEqual('Found a missed PROCESS_STATE_EXITED event: '
+                         'processname:foo groupname:foo from_state:RUNNING '
+                         'expected:0 pid:10\n', listener.stderr.getvalue())
+        # the event arriving late is not handled again
+        listener.handle_event.reset_mock()
+        listener.dispatch_event({'eventname': 'PROCESS_STATE_EXITED'},
+                                'processname:foo groupname:foo expected:0 '
+                                'pid:10')
+        self.assertEqual(0, listener.handle_event.call_count)
+
+    @patch('superlance.listener.get_rpc_interface')
+    def test_only_baseline_by_default(self, get_rpc_interface):
+        getAllProcessInfo = get_rpc_interface.return_value.supervisor.getAllProcessInfo
+        getAllProcessInfo.return_value = [_info('foo', 'FATAL', 0)]
+        listener = self._makeOne(0)
+        for i in range(5):
+            listener.dispatch_event({'eventname': 'TICK_60'}, 'when:1')
+        self.assertEqual(1, getAllProcessInfo.call_count)
+        self.assertEqual(5, listener.handle_event.call_count)
+        self.assertEqual('', listener.stderr.getvalue())
+
+    @patch('superlance.listener.get_rpc_interface')
+    def test_baseline_failure_is_not_retried_every_event(self,
+                                                         get_rpc_interface):
+        get_rpc_interface.side_effect = KeyError('SUPERVISOR_SERVER_URL')
+        listener = self._makeOne(0)
+        listener.dispatch_event({'eventname': 'TICK_60'}, 'when:1')
+        listener.dispatch_event({'eventname': 'TICK_60'}, 'when:1')
+        self.assertEqual(1, listener.stderr.getvalue().count(
+            'Error reconciling process states'))
+        self.assertEqual(2, listener.handle_event.call_count)
+
+if __name__ == '__main__':
+    unittest.main()
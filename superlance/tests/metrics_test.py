@@ -0,0 +1,84 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+class RegistryTests(unittest.TestCase):
+    def _makeOne(self):
+        from superlance.metrics import Registry
+        return Registry()
+
+    def test_counter(self):
+        registry = self._makeOne()
+        counter = registry.counter('checks_total', 'Checks.', ['outcome'])
+        counter.inc(outcome='ok')
+        counter.inc(outcome='ok')
+        counter.inc(outcome='timeout')
+        self.assertEqual(counter.get(outcome='ok'), 2)
+        self.assertEqual(counter.get(outcome='refused'), 0)
+        self.assertEqual(registry.render(), '''\
+# HELP checks_total Checks.
+# TYPE checks_total counter
+checks_total{outcome="ok"} 2
+checks_total{outcome="timeout"} 1
+''')
+
+    def test_counter_wrong_labels(self):
+        registry = self._makeOne()
+        counter = registry.counter('checks_total', 'Checks.', ['outcome'])
+        self.assertRaises(ValueError, counter.inc, url='x')
+
+    def test_histogram(self):
+        registry = self._makeOne()
+        histogram = registry.histogram('latency_seconds', 'Latency.',
+                                       ['url'], buckets=(0.1, 1))
+        histogram.observe(0.05, url='http://a/"b"')
+        histogram.observe(0.5, url='http://a/"b"')
+        histogram.observe(5, url='http://a/"b"')
+        self.assertEqual(histogram.get_count(url='http://a/"b"'), 3)
+        self.assertEqual(registry.render(), '''\
+# HELP latency_seconds Latency.
+# TYPE latency_seconds histogram
+latency_seconds_bucket{url="http://a/\\"b\\"",le="0.1"} 1
+latency_seconds_bucket{url="http://a/\\"b\\"",le="1"} 2
+latency_seconds_bucket{url="http://a/\\"b\\"",le="+Inf"} 3
+latency_seconds_sum{url="http://a/\\"b\\""} 5.55
+latency_seconds_count{url="http://a/\\"b\\""} 3
+''')
+
+class ExportTests(unittest.TestCase):
+    def setUp(self):
+        from superlance.metrics import Registry
+        self.registry = Registry()
+        self.registry.counter('restarts_total', 'Restarts.').inc()
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_write_textfile(self):
+        from superlance.metrics import write_textfile
+        path = os.path.join(self.tempdir, 'httpok.prom')
+        write_textfile(self.registry, path)
+        with open(path) as f:
+            self.assertEqual(f.read(), self.registry.render())
+        self.assertEqual(os.listdir(self.tempdir), ['httpok.prom'])
+
+    def test_serve(self):
+        from superlance.metrics import serve
+        from superlance.compat import httplib
+        server = serve(self.registry, 0)
+        try:
+            conn = httplib.HTTPConnection('127.0.0.1',
+                                          server.server_address[1])
+            conn.request('GET', '/metrics')
+            res = conn.getresponse()
+            self.assertEqual(res.status, 200)
+            self.assertEqual(res.read().decode('utf-8'),
+                             self.registry.render())
+        finally:
+            server.shutdown()
+            server.server_close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -138,6 +138,66 @@ msg1
 msg2
 """ % (self.to_str, socket.gethostname()), monitor.stderr.getvalue())
 
+    def test_send_batch_notification_queues_email_when_running(self):
+        monitor = self._make_one_mock_send_email()
+        monitor.sender = mock.Mock()
+        monitor.batchmsgs = ['msg1']
+        monitor.send_batch_notification()
+        self.assertEqual(0, monitor.send_email.call_count)
+        self.assertEqual(1, monitor.sender.submit.call_count)
+        self.assertEqual('msg1', monitor.sender.submit.call_args[0][0][1]['body'])
+
+    def test_deliver_notification_raises(self):
+        monitor = self._make_one_mock_send_smtp()
+        monitor.send_smtp.side_effect = self._raiseSTMPException
+        email = {'to': ['you@fubar.com'], 'from': 'me@fubar.com',
+                 'subject': 'yo', 'body': 'sup'}
+        self.assertRaises(ProcessStateEmailMonitorTestException,
+                          monitor.deliver_notification, email)
+
+    def test_run_flushes_queued_notifications(self):
+        clock = mock.Mock(side_effect=[0.0, 60.0, 60.0])
+        monitor = self._make_one_mock_send_smtp(eventname='TICK_60',
+                                                interval=1.0, clock=clock)
+        monitor.batchmsgs = ['msg1']
+        monitor.stdin.write('eventname:TICK_60 len:0\n')
+        monitor.stdin.seek(0)
+        with mock.patch('superlance.process_state_monitor.signal'):
+            # the listener protocol fails at the end of stdin
+            self.assertRaises(KeyError, monitor.run)
+        self.assertEqual(1, monitor.send_smtp.call_count)
+        self.assertEqual(None, monitor.sender)
+        self.assertEqual(monitor.stdout.getvalue(),
+                         'READY\nRESULT 2\nOKREADY\n')
+
+    def test_send_smtp_keeps_one_transport(self):
+        from email.mime.text import MIMEText
+        monitor = self._make_one(smtp_host='mail.example.com',
+                                 smtp_user='bob', smtp_password='pw')
+        transport = monitor.get_transport()
+        self.assertEqual(transport.host, 'mail.example.com')
+        self.assertEqual(transport.user, 'bob')
+        transport.send = mock.Mock()
+        msg = MIMEText('body')
+        msg['From'] = 'me@fubar.com'
+        monitor.send_smtp(msg, ['you@fubar.com'])
+        monitor.send_smtp(msg, ['you@fubar.com'])
+        self.assertTrue(monitor.get_transport() is transport)
+        self.assertEqual(2, transport.send.call_count)
+        transport.send.assert_called_with(msg.as_string(),
+                                          to_addrs=['you@fubar.com'],
+                                          from_addr='me@fubar.com')
+
+    def test_smtp_host_url(self):
+        from superlance.mailer import close_transports
+        monitor = self._make_one(smtp_host='smtp://mail.example.com:587?starttls')
+        try:
+            transport = monitor.get_transport()
+            self.assertEqual(transport.port, 587)
+            self.assertTrue(transport.starttls)
+        finally:
+            close_transports()
+
     def test_log_email_with_body_digest(self):
         bodyLen = 80
         monitor = self._make_one_mock_send_email()
@@ -1,3 +1,6 @@
+import os
+import shutil
+import tempfile
 import unittest
 import mock
 from superlance.compat import StringIO
@@ -15,10 +18,17 @@ class ProcessStateMonitorTests(unittest.TestCase):
     def _get_target_class(self):
         return TestProcessStateMonitor
 
+    def setUp(self):
+        self.now = 1000.0
+
+    def clock(self):
+        return self.now
+
     def _make_one_mocked(self, **kwargs):
         kwargs['stdin'] = StringIO()
         kwargs['stdout'] = StringIO()
         kwargs['stderr'] = StringIO()
+        kwargs.setdefault('clock', self.clock)
 
         obj = self._get_target_class()(**kwargs)
         obj.send_batch_notification = mock.Mock()
@@ -80,6 +90,7 @@ pid:58597' % (pname, gname, expected)
         monitor.handle_event(hdrs, payload)
         self.assertEqual(2, len(monitor.get_batch_msgs()))
         #Time expired
+        self.now += 60
         hdrs, payload = self.get_tick60_event()
         monitor.handle_event(hdrs, payload)
 
@@ -91,10 +102,177 @@ pid:58597' % (pname, gname, expected)
     def test_handle_event_tick_interval_not_expired(self):
         monitor = self._make_one_mocked(interval=3)
         hdrs, payload = self.get_tick60_event()
+        self.now += 60
         monitor.handle_event(hdrs, payload)
         self.assertEqual(1.0, monitor.get_batch_minutes())
+        self.now += 60
         monitor.handle_event(hdrs, payload)
         self.assertEqual(2.0, monitor.get_batch_minutes())
+        self.assertEqual(0, monitor.send_batch_notification.call_count)
+
+    def test_handle_event_tick_uses_clock_not_tick_count(self):
+        monitor = self._make_one_mocked(interval=1.0)
+        hdrs, payload = self.get_process_exited_event('foo', 'bar', 0)
+        monitor.handle_event(hdrs, payload)
+        # delayed ticks: a single TICK_60 after 5 minutes
+        self.now += 300
+        hdrs, payload = self.get_tick60_event()
+        monitor.handle_event(hdrs, payload)
+        self.assertEqual(1, monitor.send_batch_notification.call_count)
+        self.assertEqual(0.0, monitor.get_batch_minutes())
+        # bursts of ticks don't flush early
+        self.now += 1
+        for i in range(3):
+            monitor.handle_event(hdrs, payload)
+        self.assertEqual(1, monitor.send_batch_notification.call_count)
+
+    def test_handle_event_tick_interval_despite_slow_send(self):
+        monitor = self._make_one_mocked(interval=1.0)
+        def send():
+            # building and sending the batch takes time
+            self.now += 0.5
+        monitor.send_batch_notification.side_effect = send
+        hdrs, payload = self.get_tick60_event()
+        for i in range(10):
+            self.now += 60
+            monitor.handle_event(hdrs, payload)
+        self.assertEqual(10, monitor.send_batch_notification.call_count)
+
+    def test_handle_event_tick_interval_tolerates_jitter(self):
+        monitor = self._make_one_mocked(interval=1.0)
+        hdrs, payload = self.get_tick60_event()
+        for delay in (60, 59, 61, 58.5, 60, 59.9):
+            self.now += delay
+            monitor.handle_event(hdrs, payload)
+        self.assertEqual(6, monitor.send_batch_notification.call_count)
+        # but not ticks coming early by half a period or more
+        self.now += 29
+        monitor.handle_event(hdrs, payload)
+        self.assertEqual(6, monitor.send_batch_notification.call_count)
+
+    def test_handle_event_flushes_on_max_batch_msgs(self):
+        monitor = self._make_one_mocked(max_batch_msgs=2)
+        hdrs, payload = self.get_process_exited_event('foo', 'bar', 0)
+        monitor.handle_event(hdrs, payload)
+        self.assertEqual(0, monitor.send_batch_notification.call_count)
+        monitor.handle_event(hdrs, payload)
+        self.assertEqual(1, monitor.send_batch_notification.call_count)
+        self.assertEqual([], monitor.get_batch_msgs())
+
+    def test_handle_event_flushes_on_max_batch_bytes(self):
+        hdrs, payload = self.get_process_exited_event('foo', 'bar', 0)
+        monitor = self._make_one_mocked(max_batch_bytes=len(repr(payload)) + 1)
+        monitor.handle_event(hdrs, payload)
+        self.assertEqual(0, monitor.send_batch_notification.call_count)
+        monitor.handle_event(hdrs, payload)
+        self.assertEqual(1, monitor.send_batch_notification.call_count)
+        self.assertEqual(0, monitor.batch_bytes)
+
+    def test_handle_event_immediate(self):
+        monitor = self._make_one_mocked(immediate_events='fatal')
+        monitor.send_immediate_notification = mock.Mock()
+        hdrs, payload = self.get_process_exited_event('foo', 'bar', 0,
+                                            eventname='PROCESS_STATE_FATAL')
+        monitor.handle_event(hdrs, payload)
+        monitor.send_immediate_notification.assert_called_with(
+            [repr(payload)])
+        self.assertEqual([], monitor.get_batch_msgs())
+        self.assertEqual(0, monitor.batch_count)
+        hdrs, payload = self.get_process_exited_event('foo', 'bar', 0)
+        monitor.handle_event(hdrs, payload)
+        self.assertEqual(1, monitor.send_immediate_notification.call_count)
+        self.assertEqual([repr(payload)], monitor.get_batch_msgs())
+
+    def test_get_event_names(self):
+        from superlance.process_state_monitor import get_event_names
+        self.assertEqual(['PROCESS_STATE_FATAL', 'PROCESS_STATE_BACKOFF'],
+                         get_event_names('fatal, PROCESS_STATE_BACKOFF,'))
+        self.assertEqual(['PROCESS_STATE_FATAL'],
+                         get_event_names(['PROCESS_STATE_FATAL']))
+
+class SpoolingProcessStateMonitor(TestProcessStateMonitor):
+
+    def __init__(self, **kwargs):
+        TestProcessStateMonitor.__init__(self, **kwargs)
+        self.delivered = []
+        self.fail = False
+
+    def send_batch_notification(self):
+        msgs = self.get_batch_msgs()
+        if msgs:
+            self.queue_notification('\n'.join(msgs))
+
+    def deliver_notification(self, notification):
+        if self.fail:
+            raise ValueError('relay down')
+        self.delivered.append(notification)
+
+class ProcessStateMonitorSpoolTests(ProcessStateMonitorTests):
+
+    def setUp(self):
+        ProcessStateMonitorTests.setUp(self)
+        self.tempdir = tempfile.mkdtemp()
+        self.spool_dir = os.path.join(self.tempdir, 'spool')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def _make_spooling(self, **kwargs):
+        kwargs['stdin'] = StringIO()
+        kwargs['stdout'] = StringIO()
+        kwargs['stderr'] = StringIO()
+        kwargs.setdefault('clock', self.clock)
+        kwargs.setdefault('spool_dir', self.spool_dir)
+        return SpoolingProcessStateMonitor(**kwargs)
+
+    def test_replays_batch_after_restart(self):
+        monitor = self._make_spooling()
+        hdrs, payload = self.get_process_exited_event('foo', 'bar', 0)
+        monitor.handle_event(hdrs, payload)
+        monitor.spool.close()
+
+        monitor = self._make_spooling()
+        monitor.replay_spool()
+        self.assertEqual([repr(payload)], monitor.get_batch_msgs())
+        self.now += 60
+        monitor.handle_event(*self.get_tick60_event())
+        self.assertEqual([repr(payload)], monitor.delivered)
+        self.assertEqual(0, len(monitor.spool))
+        monitor.spool.close()
+
+    def test_undelivered_notification_is_resent(self):
+        monitor = self._make_spooling()
+        monitor.fail = True
+        hdrs, payload = self.get_process_exited_event('foo', 'bar', 0)
+        monitor.handle_event(hdrs, payload)
+        self.now += 60
+        monitor.handle_event(*self.get_tick60_event())
+        self.assertEqual([], monitor.delivered)
+        self.assertEqual(1, len(monitor.spool.pending('notification')))
+        self.assertEqual([], monitor.spool.pending('event'))
+        monitor.spool.close()
+
+        monitor = self._make_spooling(send_retries=0)
+        monitor.start_sender()
+        monitor.replay_spool()
+        monitor.stop_sender()
+        self.assertEqual([repr(payload)], monitor.delivered)
+        self.assertEqual(0, len(monitor.spool))
+        monitor.spool.close()
+
+    def test_resend_waits_for_idle_sender(self):
+        monitor = self._make_spooling()
+        monitor.fail = True
+        monitor.queue_notification('note')
+        monitor.sender = mock.Mock()
+        monitor.sender.pending.return_value = 1
+        monitor.resend_spooled()
+        self.assertEqual(0, monitor.sender.submit.call_count)
+        monitor.sender.pending.return_value = 0
+        monitor.resend_spooled()
+        spool_id = monitor.spool.pending()[0][0]
+        monitor.sender.submit.assert_called_with((spool_id, 'note'))
+        monitor.spool.close()
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,164 @@
+import socket
+import unittest
+from mock import Mock, patch
+from superlance.compat import httplib
+from superlance.compat import xmlrpclib
+
+class PersistentRPCInterfaceTests(unittest.TestCase):
+    def _makeOne(self, proxies):
+        from superlance.rpc import PersistentRPCInterface
+        self.env = {'SUPERVISOR_SERVER_URL': 'unix:///tmp/supervisor.sock'}
+        with patch('superlance.rpc.childutils.getRPCInterface',
+                   Mock(side_effect=proxies)) as factory:
+            rpc = PersistentRPCInterface(self.env)
+        self.factory = factory
+        return rpc
+
+    def test_connects_once_and_reuses_proxy(self):
+        proxy = Mock()
+        proxy.supervisor.getAllProcessInfo.return_value = []
+        rpc = self._makeOne([proxy])
+        self.assertEqual(rpc.supervisor.getAllProcessInfo(), [])
+        self.assertEqual(rpc.supervisor.getAllProcessInfo(), [])
+        self.assertEqual(self.factory.call_count, 1)
+        self.factory.assert_called_with(self.env)
+        self.assertEqual(proxy.supervisor.getAllProcessInfo.call_count, 2)
+
+    def test_passes_arguments(self):
+        proxy = Mock()
+        rpc = self._makeOne([proxy])
+        rpc.supervisor.tailProcessStderrLog('foo', 0, 100)
+        proxy.supervisor.tailProcessStderrLog.assert_called_with('foo', 0,
+                                                                 100)
+
+    def test_reconnects_and_retries_on_connection_error(self):
+        stale = Mock()
+        stale.supervisor.getState.side_effect = socket.error('reset')
+        fresh = Mock()
+        fresh.supervisor.getState.return_value = {'statename': 'RUNNING'}
+        rpc = self._makeOne([stale, fresh])
+        with patch('superlance.rpc.childutils.getRPCInterface',
+                   Mock(return_value=fresh)) as factory:
+            self.assertEqual(rpc.supervisor.getState(),
+                             {'statename': 'RUNNING'})
+        stale.assert_called_with('close')
+        self.assertEqual(factory.call_count, 1)
+        self.assertTrue(rpc.proxy is fresh)
+
+    def test_snapshot_not_cached_by_default(self):
+        proxy = Mock()
+        proxy.supervisor.getAllProcessInfo.return_value = []
+        rpc = self._makeOne([proxy])
+        rpc.supervisor.getAllProcessInfo()
+        rpc.supervisor.getAllProcessInfo()
+        self.assertEqual(proxy.supervisor.getAllProcessInfo.call_count, 2)
+
+    def test_cache_snapshot(self):
+        proxy = Mock()
+        proxy.supervisor.getAllProcessInfo.return_value = [{'name': 'foo'}]
+        rpc = self._makeOne([proxy])
+        rpc.cache_snapshot = True
+        infos = rpc.supervisor.getAllProcessInfo()
+        infos[0]['name'] = 'changed'
+        self.assertEqual(rpc.supervisor.getAllProcessInfo(), [{'name': 'foo'}])
+        rpc.supervisor.getProcessInfo('foo')
+        rpc.system.multicall([{'methodName': 'supervisor.readLog',
+                               'params': [0, 10]}])
+        rpc.supervisor.getAllProcessInfo()
+        self.assertEqual(proxy.supervisor.getAllProcessInfo.call_count, 1)
+        rpc.invalidate_snapshot()
+        rpc.supervisor.getAllProcessInfo()
+        self.assertEqual(proxy.supervisor.getAllProcessInfo.call_count, 2)
+
+    def test_cache_snapshot_invalidated_by_changes(self):
+        proxy = Mock()
+        proxy.supervisor.getAllProcessInfo.return_value = []
+        rpc = self._makeOne([proxy])
+        rpc.cache_snapshot = True
+        rpc.supervisor.getAllProcessInfo()
+        rpc.supervisor.stopProcess('foo')
+        rpc.supervisor.getAllProcessInfo()
+        self.assertEqual(proxy.supervisor.getAllProcessInfo.call_count, 2)
+        rpc.system.multicall([{'methodName': 'supervisor.startProcess',
+                               'params': ['foo']}])
+        rpc.supervisor.getAllProcessInfo()
+        self.assertEqual(proxy.supervisor.getAllProcessInfo.call_count, 3)
+
+    def test_gives_up_after_one_retry(self):
+        broken = Mock()
+        broken.supervisor.getState.side_effect = httplib.BadStatusLine('')
+        rpc = self._makeOne([broken])
+        with patch('superlance.rpc.childutils.getRPCInterface',
+                   Mock(return_value=broken)) as factory:
+            self.assertRaises(httplib.HTTPException, rpc.supervisor.getState)
+        self.assertEqual(factory.call_count, 1)
+        self.assertEqual(rpc.proxy, None)
+
+    def test_changes_are_not_retried(self):
+        stale = Mock()
+        stale.supervisor.stopProcess.side_effect = socket.error('reset')
+        stale.system.multicall.side_effect = socket.error('reset')
+        rpc = self._makeOne([stale])
+        fresh = Mock()
+        with patch('superlance.rpc.childutils.getRPCInterface',
+                   Mock(return_value=fresh)) as factory:
+            # may have been stopped before the connection broke
+            self.assertRaises(socket.error, rpc.supervisor.stopProcess,
+                              'foo')
+            self.assertEqual(rpc.proxy, None)
+            self.assertEqual(factory.call_count, 0)
+            rpc.proxy = stale
+            self.assertRaises(socket.error, rpc.system.multicall,
+                              [{'methodName': 'supervisor.getProcessInfo',
+                                'params': ['foo']},
+                               {'methodName': 'supervisor.signalProcess',
+                                'params': ['foo', 'HUP']}])
+            self.assertEqual(factory.call_count, 0)
+            # the next call reconnects
+            rpc.supervisor.startProcess('foo')
+        self.assertEqual(1, stale.supervisor.stopProcess.call_count)
+        self.assertEqual(1, stale.system.multicall.call_count)
+        self.assertEqual(factory.call_count, 1)
+        fresh.supervisor.startProcess.assert_called_once_with('foo')
+
+    def test_faults_are_not_retried(self):
+        proxy = Mock()
+        proxy.supervisor.startProcess.side_effect = xmlrpclib.Fault(
+            60, 'ALREADY_STARTED')
+        rpc = self._makeOne([proxy])
+        self.assertRaises(xmlrpclib.Fault, rpc.supervisor.startProcess, 'foo')
+        self.assertEqual(proxy.supervisor.startProcess.call_count, 1)
+        self.assertTrue(rpc.proxy is proxy)
+
+    def test_missing_server_url_raises_immediately(self):
+        from superlance.rpc import PersistentRPCInterface
+        self.assertRaises(KeyError, PersistentRPCInterface, {})
+
+class SharedRPCInterfaceTests(unittest.TestCase):
+    def setUp(self):
+        from superlance.rpc import reset_rpc_interface
+        reset_rpc_interface()
+
+    tearDown = setUp
+
+    def test_get_rpc_interface_is_shared(self):
+        from superlance.rpc import get_rpc_interface
+        env = {'SUPERVISOR_SERVER_URL': 'http://localhost:9001'}
+        with patch('superlance.rpc.childutils.getRPCInterface',
+                   Mock(return_value=Mock())) as factory:
+            rpc = get_rpc_interface(env)
+            self.assertTrue(get_rpc_interface() is rpc)
+        self.assertEqual(factory.call_count, 1)
+
+    def test_reset_rpc_interface_closes_connection(self):
+        from superlance.rpc import get_rpc_interface, reset_rpc_interface
+        proxy = Mock()
+        with patch('superlance.rpc.childutils.getRPCInterface',
+                   Mock(return_value=proxy)):
+            first = get_rpc_interface({})
+            reset_rpc_interface()
+            self.assertFalse(get_rpc_interface({}) is first)
+        proxy.assert_called_with('close')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+import threading
+import unittest
+
+class BackgroundSenderTests(unittest.TestCase):
+    def _makeOne(self, deliver, **kw):
+        from superlance.sender import BackgroundSender
+        self.logged = []
+        self.slept = []
+        kw.setdefault('log', self.logged.append)
+        kw.setdefault('sleep', self.slept.append)
+        return BackgroundSender(deliver, **kw)
+
+    def test_delivers_in_background_and_flushes_on_close(self):
+        delivered = []
+        sender = self._makeOne(delivered.append)
+        sender.start()
+        for i in range(5):
+            sender.submit(i)
+        self.assertTrue(sender.close(5))
+        self.assertEqual(delivered, [0, 1, 2, 3, 4])
+        self.assertEqual(sender.thread, None)
+
+    def test_submit_does_not_wait_for_delivery(self):
+        release = threading.Event()
+        delivered = []
+        def deliver(item):
+            release.wait(5)
+            delivered.append(item)
+        sender = self._makeOne(deliver)
+        sender.start()
+        sender.submit('slow')
+        sender.submit('next')
+        self.assertEqual(delivered, [])
+        self.assertEqual(sender.pending(), 2)
+        release.set()
+        sender.close(5)
+        self.assertEqual(delivered, ['slow', 'next'])
+
+    def test_full_queue_drops_oldest(self):
+        delivered = []
+        sender = self._makeOne(delivered.append, maxsize=2)
+        for i in range(4):
+            sender.submit(i)
+        self.assertEqual(sender.dropped, 2)
+        self.assertEqual(len(self.logged), 2)
+        self.assertEqual(sender.pending(), 2)
+        sender.start()
+        sender.close(5)
+        self.assertEqual(delivered, [2, 3])
+        self.assertEqual(sender.pending(), 0)
+
+    def test_retries_with_backoff(self):
+        attempts = []
+        def deliver(item):
+            attempts.append(item)
+            if len(attempts) < 3:
+                raise ValueError('relay down')
+        sender = self._makeOne(deliver, retries=3, retry_delay=1.0)
+        self.assertTrue(sender.send('mail'))
+        self.assertEqual(attempts, ['mail'] * 3)
+        self.assertEqual(self.slept, [1.0, 2.0])
+        self.assertEqual(self.logged[0],
+                         'Error sending notification, retrying in 1.0 '
+                         'seconds: relay down\n')
+
+    def test_gives_up_after_retries(self):
+        def deliver(item):
+            raise ValueError('relay down')
+        sender = self._makeOne(deliver, retries=1)
+        self.assertFalse(sender.send('mail'))
+        self.assertEqual(self.logged[-1],
+                         'Error sending notification, giving up after 2 '
+                         'attempts: relay down\n')
+
+    def test_close_with_full_queue_honours_timeout(self):
+        import time
+        release = threading.Event()
+        started = threading.Event()
+        def deliver(item):
+            started.set()
+            release.wait(5)
+        sender = self._makeOne(deliver, maxsize=1)
+        sender.start()
+        sender.submit('slow')
+        started.wait(5)
+        sender.submit('queued')
+        start = time.time()
+        try:
+            self.assertFalse(sender.close(0.2))
+            self.assertTrue(time.time() - start < 2)
+            self.assertEqual(sender.pending(), 2)
+        finally:
+            release.set()
+
+    def test_close_without_start(self):
+        sender = self._makeOne(None)
+        self.assertTrue(sender.close())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -53,26 +53,103 @@ class SentryReporterTests(unittest.TestCase):
                 event_type='fatal'),
             'fatal error')
 
-    def test_get_event_details(self):
-        reporter = SentryReporter(sentry_dsn=None, stderr_lines=10, stdout_lines=10)
-        reporter.stdin = StringIO()
-        reporter.stdout = StringIO()
-
-        reporter.stdin.write('ver:3.0 len:69 eventname:PROCESS_STATE_EXITED\n')
-        reporter.stdin.write('processname:proc groupname:grp from_state:RUNNING expected:0 pid:123\n')
-        reporter.stdin.seek(0)
-
-        event_details = reporter.get_event_details('crash')
-
-        expected_pheaders = {
-            'processname': 'proc',
-            'groupname': 'grp',
-            'from_state': 'RUNNING',
-            'expected': '0',
-            'pid': '123',
-        }
-        expected_ignore = False
-        self.assertEqual(event_details, (expected_pheaders, expected_ignore))
+    def _makeOne(self, **kw):
+        from mock import Mock
+        reporter = SentryReporter(sentry_dsn=None, stderr_lines=0,
+                                  stdout_lines=0, **kw)
+        reporter.stderr = StringIO()
+        reporter.notify_sentry = Mock()
+        return reporter
+
+    def test_handle_event_notifies_unexpected_exit(self):
+        reporter = self._makeOne()
+        reporter.handle_event(
+            {'eventname': 'PROCESS_STATE_EXITED'},
+            'processname:proc groupname:grp from_state:RUNNING expected:0 '
+            'pid:123')
+        reporter.notify_sentry.assert_called_once_with(
+            'Process grp:proc exited unexpectedly', '', '', 'crash')
+
+    def test_handle_event_ignores_events(self):
+        reporter = self._makeOne()
+        reporter.handle_event(
+            {'eventname': 'PROCESS_STATE_EXITED'},
+            'processname:proc groupname:grp from_state:RUNNING expected:1 '
+            'pid:123')
+        reporter.handle_event(
+            {'eventname': 'PROCESS_STATE_FATAL'},
+            'processname:proc groupname:grp from_state:BACKOFF')
+        reporter.handle_event({'eventname': 'TICK_60'}, 'when:1')
+        self.assertEqual(0, reporter.notify_sentry.call_count)
+
+    def test_handle_event_tick_polls_followed_logs(self):
+        from mock import Mock
+        reporter = self._makeOne(follow_logs=True)
+        reporter.log_follower = Mock()
+        reporter.handle_event({'eventname': 'TICK_5'}, 'when:1')
+        reporter.log_follower.poll.assert_called_once_with()
+        self.assertEqual(0, reporter.notify_sentry.call_count)
+        # the lines reported are those followed
+        reporter.stderr_lines = 2
+        reporter.log_follower.get_last_lines.return_value = ('err\n',
+                                                             'out\n')
+        reporter.handle_event(
+            {'eventname': 'PROCESS_STATE_EXITED'},
+            'processname:proc groupname:grp from_state:RUNNING expected:0 '
+            'pid:123')
+        reporter.notify_sentry.assert_called_once_with(
+            'Process grp:proc exited unexpectedly', 'err\n', 'out\n',
+            'crash')
+
+    def test_reconciled_events_are_notified(self):
+        reporter = self._makeOne(event_type='fatal')
+        info = {'name': 'proc', 'group': 'grp', 'statename': 'RUNNING',
+                'pid': 123, 'exitstatus': 0}
+        reporter.reconcile_process_infos([info])
+        info = dict(info, statename='FATAL', pid=0)
+        reporter.reconcile_process_infos([info])
+        reporter.notify_sentry.assert_called_once_with(
+            'Process grp:proc exited unexpectedly', '', '', 'fatal')
+        self.assertTrue(reporter.stderr.getvalue().startswith(
+            'Found a missed PROCESS_STATE_FATAL event'))
+        # the event arriving late is not notified again
+        reporter.baseline_taken = True
+        reporter.dispatch_event({'eventname': 'PROCESS_STATE_FATAL'},
+                                'processname:proc groupname:grp '
+                                'from_state:BACKOFF')
+        self.assertEqual(1, reporter.notify_sentry.call_count)
+
+    def test_crash_loop(self):
+        from superlance.crashloop import CrashLoopTracker
+        reporter = SentryReporter(sentry_dsn=None, stderr_lines=0,
+                                  stdout_lines=0)
+        now = [100.0]
+        reporter.crash_loops = CrashLoopTracker(3, 10, clock=lambda: now[0],
+                                                time=lambda: 0)
+        crash = {'eventname': 'PROCESS_STATE_EXITED'}
+        payload = ('processname:proc groupname:grp from_state:RUNNING '
+                   'expected:0 pid:123')
+        with patch.object(reporter, 'notify_sentry') as notify_sentry:
+            for i in range(5):
+                reporter.handle_event(crash, payload)
+                now[0] += 1
+            headers = [call[0][0] for call in notify_sentry.call_args_list]
+            self.assertEqual([
+                'Process grp:proc exited unexpectedly',
+                'Process grp:proc exited unexpectedly',
+                'Process grp:proc is crash looping: 3 events within 10 '
+                'seconds',
+                ], headers)
+            notify_sentry.reset_mock()
+            # the summary is sent on the first event after the loop ended
+            now[0] += 10
+            reporter.handle_event({'eventname': 'TICK_60'}, 'when:1')
+            summary, stderr, stdout, event_type = notify_sentry.call_args[0]
+            self.assertEqual(1, notify_sentry.call_count)
+            self.assertTrue(summary.startswith(
+                'Process grp:proc stopped crash looping: it crashed 5 '
+                'times between '), summary)
+            self.assertEqual(('', '', 'crash'), (stderr, stdout, event_type))
 
     def test_notify_sentry(self):
         reporter = SentryReporter(sentry_dsn=None, stderr_lines=10, stdout_lines=10)
@@ -93,7 +170,8 @@ exceptions.UnicodeEncodeError: 'ascii' codec can't encode character u'\u2026' in
         stderr_body = '\n'.join(stderr.splitlines()[:-1])
         stderr_last_line = stderr.splitlines()[-1]
 
-        md5 = hashlib.md5(stderr_body + stdout).hexdigest()
+        md5 = hashlib.md5(
+            (stderr_body + stdout).encode('utf-8')).hexdigest()
 
         with patch('superlance.sentryreporter.raven') as raven_mock:
             reporter.notify_sentry(msg_header, stderr, stdout, 'crash')
@@ -0,0 +1,94 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+class SpoolTests(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.directory = os.path.join(self.tempdir, 'spool')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def _makeOne(self, **kw):
+        from superlance.spool import Spool
+        return Spool(self.directory, **kw)
+
+    def _segments(self):
+        return sorted(os.listdir(self.directory))
+
+    def test_append_and_ack(self):
+        spool = self._makeOne()
+        first = spool.append({'kind': 'event', 'n': 1})
+        second = spool.append({'kind': 'notification', 'n': 2})
+        self.assertEqual(spool.pending(),
+                         [(first, {'kind': 'event', 'n': 1}),
+                          (second, {'kind': 'notification', 'n': 2})])
+        self.assertEqual(spool.pending('notification'),
+                         [(second, {'kind': 'notification', 'n': 2})])
+        spool.ack([first])
+        self.assertEqual(spool.pending(),
+                         [(second, {'kind': 'notification', 'n': 2})])
+        self.assertEqual(len(spool), 1)
+        spool.close()
+
+    def test_replays_unacked_records_after_reopening(self):
+        spool = self._makeOne()
+        ids = [spool.append({'n': n}) for n in range(3)]
+        spool.ack([ids[1]])
+        spool.sync()
+        spool.close()
+        spool = self._makeOne()
+        self.assertEqual(spool.pending(), [(ids[0], {'n': 0}),
+                                           (ids[2], {'n': 2})])
+        self.assertEqual(spool.append({'n': 3}), ids[2] + 1)
+        spool.close()
+
+    def test_ignores_half_written_line(self):
+        spool = self._makeOne()
+        spool.append({'n': 0})
+        spool.file.write('{"id": 2, "rec')
+        spool.close()
+        spool = self._makeOne()
+        self.assertEqual(spool.pending(), [(1, {'n': 0})])
+        spool.append({'n': 1})
+        spool.close()
+        spool = self._makeOne()
+        self.assertEqual(spool.pending(), [(1, {'n': 0}), (2, {'n': 1})])
+        spool.close()
+
+    def test_rotates_and_compacts_segments(self):
+        spool = self._makeOne(segment_bytes=100)
+        ids = [spool.append({'data': 'x' * 40}) for n in range(6)]
+        self.assertTrue(len(self._segments()) >= 3)
+        spool.ack(ids[:-1])
+        # the segment holding the last record is kept
+        self.assertEqual(spool.pending(), [(ids[-1], {'data': 'x' * 40})])
+        spool.ack(ids[-1:])
+        self.assertEqual(len(self._segments()), 1)
+        spool.close()
+        spool = self._makeOne()
+        self.assertEqual(spool.pending(), [])
+        spool.close()
+
+    def test_keeps_segments_with_acks_of_older_records(self):
+        spool = self._makeOne(segment_bytes=60)
+        old = spool.append({'data': 'x' * 40})
+        new = spool.append({'data': 'y' * 40})
+        spool.ack([new])
+        spool.close()
+        spool = self._makeOne()
+        self.assertEqual(spool.pending(), [(old, {'data': 'x' * 40})])
+        spool.close()
+
+    def test_sync(self):
+        spool = self._makeOne()
+        spool.append({'n': 0})
+        self.assertTrue(spool.dirty)
+        spool.sync()
+        self.assertFalse(spool.dirty)
+        spool.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+import os
+import subprocess
+import sys
+import threading
+import time
+import unittest
+
+# seconds each console script may take to start, from launching a fresh
+# interpreter to the listener writing READY;  slow machines can raise it
+BUDGET = float(os.environ.get('SUPERLANCE_STARTUP_BUDGET', '1.0'))
+RUNS = 3
+# seconds after which a console script that did not write READY is killed
+TIMEOUT = 30
+
+EMAILS = ['-t', 'you@example.com', '-f', 'me@example.com']
+
+# console script: (module, arguments)
+CONSOLE_SCRIPTS = {
+    'httpok': ('superlance.httpok', ['-p', 'foo', 'http://localhost:8080/']),
+    'crashsms': ('superlance.crashsms', EMAILS),
+    'crashmail': ('superlance.crashmail', ['-a', '-m', 'dev@example.com']),
+    'crashmailbatch': ('superlance.crashmailbatch', EMAILS),
+    'fatalmailbatch': ('superlance.fatalmailbatch', EMAILS),
+    'sentryreporter': ('superlance.sentryreporter',
+                       ['-e', 'crash', '-s', 'http://key@sentry.example.com/1']),
+    'memmon': ('superlance.memmon', ['-a', '200MB', '-m', 'dev@example.com']),
+    'superlance': ('superlance.host', ['crashmail -a', 'memmon -a 200MB']),
+    }
+
+# runs a console script's main(), writing the modules loaded to stderr
+# when the listener first writes READY
+ENTRY_POINT = '''\
+import sys
+from supervisor import childutils
+ready = childutils.listener.ready
+def report_modules(stdout):
+    sys.stderr.write('modules:%%s\\n' %% ','.join(sorted(sys.modules)))
+    sys.stderr.flush()
+    ready(stdout)
+childutils.listener.ready = report_modules
+sys.argv[:] = %r
+from %s import main
+main()
+'''
+
+def start_console_script(name):
+    """Run the console script name as supervisord would, until it is
+    ready for its first event.  Return the seconds it took and the
+    modules it had loaded then."""
+    module, args = CONSOLE_SCRIPTS[name]
+    code = ENTRY_POINT % ([name] + args, module)
+    env = dict(os.environ)
+    # nothing listens there:  listeners only connect on their first call
+    env['SUPERVISOR_SERVER_URL'] = 'unix:///nonexistent/supervisor.sock'
+    start = time.time()
+    proc = subprocess.Popen([sys.executable, '-c', code],
+                            stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE, env=env)
+    timer = threading.Timer(TIMEOUT, proc.kill)
+    timer.start()
+    try:
+        line = proc.stdout.readline()
+        elapsed = time.time() - start
+        proc.kill()
+        stderr = proc.communicate()[1].decode('ascii', 'replace')
+    finally:
+        timer.cancel()
+    if line != b'READY\n':
+        raise AssertionError('%s did not start: %r\n%s' % (name, line, stderr))
+    for line in stderr.splitlines():
+        if line.startswith('modules:'):
+            return elapsed, line[len('modules:'):].split(',')
+    raise AssertionError('%s did not report its modules\n%s' % (name, stderr))
+
+class StartupTests(unittest.TestCase):
+    def test_startup_time_within_budget(self):
+        for name in sorted(CONSOLE_SCRIPTS):
+            best = None
+            for _ in range(RUNS):
+                elapsed, modules = start_console_script(name)
+                if best is None or elapsed < best:
+                    best = elapsed
+            self.assertTrue(
+                best <= BUDGET,
+                '%s took %.3fs to start, over the budget of %.3fs '
+                '(SUPERLANCE_STARTUP_BUDGET)' % (name, best, BUDGET))
+
+    def _assertNotLoaded(self, name, deferred):
+        elapsed, modules = start_console_script(name)
+        self.assertEqual([], [module for module in deferred
+                              if module in modules], name)
+
+    def test_sentryreporter_defers_raven(self):
+        self._assertNotLoaded('sentryreporter', ('raven',))
+
+    def test_mail_listeners_defer_smtplib(self):
+        for name in ('crashmail', 'crashmailbatch', 'memmon'):
+            self._assertNotLoaded(name, ('smtplib', 'email.mime'))
+
+    def test_httpok_defers_subprocess(self):
+        self._assertNotLoaded('httpok', ('subprocess',))
+
+if __name__ == '__main__':
+    unittest.main()
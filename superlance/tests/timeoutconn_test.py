@@ -0,0 +1,179 @@
+import errno
+import socket
+import threading
+import time
+import unittest
+from superlance.compat import monotonic
+
+def closed_port():
+    """Return a localhost port that nothing listens on."""
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(('127.0.0.1', 0))
+    port = listener.getsockname()[1]
+    listener.close()
+    return port
+
+def serve_once(response, delay=0, path=None, wait_request=True):
+    """Start a one-shot server on localhost (or on the unix socket
+    ``path``) that writes ``response`` a byte at a time, sleeping
+    ``delay`` seconds between bytes."""
+    if path is None:
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.bind(('127.0.0.1', 0))
+    else:
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(path)
+    listener.listen(1)
+
+    def serve():
+        conn, addr = listener.accept()
+        try:
+            if wait_request:
+                conn.recv(4096)
+            for i in range(len(response)):
+                conn.sendall(response[i:i+1])
+                if delay:
+                    time.sleep(delay)
+        except socket.error:
+            pass
+        finally:
+            conn.close()
+            listener.close()
+
+    thread = threading.Thread(target=serve)
+    thread.daemon = True
+    thread.start()
+    if path is None:
+        return listener.getsockname()[1]
+    return path
+
+class DeadlineSocketTests(unittest.TestCase):
+    def _makeOne(self, sock, deadline):
+        from superlance.timeoutconn import DeadlineSocket
+        return DeadlineSocket(sock, deadline)
+
+    def test_recv_after_deadline_raises(self):
+        from superlance.timeoutconn import DeadlineExceeded
+        a, b = socket.socketpair()
+        try:
+            b.sendall(b'x')
+            sock = self._makeOne(a, monotonic() - 1)
+            self.assertRaises(DeadlineExceeded, sock.recv, 1)
+        finally:
+            a.close()
+            b.close()
+
+    def test_recv_before_deadline(self):
+        a, b = socket.socketpair()
+        try:
+            b.sendall(b'x')
+            sock = self._makeOne(a, monotonic() + 10)
+            self.assertEqual(sock.recv(1), b'x')
+            self.assertTrue(0 < a.gettimeout() <= 10)
+        finally:
+            a.close()
+            b.close()
+
+    def test_no_deadline_leaves_timeout_alone(self):
+        a, b = socket.socketpair()
+        try:
+            b.sendall(b'x')
+            sock = self._makeOne(a, None)
+            self.assertEqual(sock.recv(1), b'x')
+            self.assertEqual(a.gettimeout(), None)
+        finally:
+            a.close()
+            b.close()
+
+class TimeoutHTTPConnectionTests(unittest.TestCase):
+    response = (b'HTTP/1.0 200 OK\r\nContent-Length: 2\r\n'
+                b'Connection: close\r\n\r\nOK')
+
+    def _makeOne(self, port, timeout):
+        from superlance.timeoutconn import TimeoutHTTPConnection
+        conn = TimeoutHTTPConnection('127.0.0.1:%d' % port)
+        conn.timeout = timeout
+        return conn
+
+    def test_fast_response(self):
+        conn = self._makeOne(serve_once(self.response), 5)
+        conn.request('GET', '/')
+        res = conn.getresponse()
+        self.assertEqual(res.status, 200)
+        self.assertEqual(res.read(), b'OK')
+
+    def test_trickling_response_hits_deadline(self):
+        # each byte arrives well within the timeout, but the response
+        # as a whole takes much longer than it
+        conn = self._makeOne(serve_once(self.response, delay=0.05), 0.5)
+        start = monotonic()
+        def check():
+            conn.request('GET', '/')
+            conn.getresponse().read()
+        self.assertRaises(socket.timeout, check)
+        self.assertTrue(monotonic() - start < 2)
+
+    def test_connection_refused(self):
+        conn = self._makeOne(closed_port(), 5)
+        try:
+            conn.request('GET', '/')
+        except socket.error as e:
+            self.assertEqual(e.errno, errno.ECONNREFUSED)
+        else:
+            self.fail('connection not refused')
+
+class UnixHTTPConnectionTests(unittest.TestCase):
+    def setUp(self):
+        import tempfile
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.tempdir)
+
+    def test_request(self):
+        import os
+        from superlance.timeoutconn import UnixHTTPConnection
+        path = serve_once(TimeoutHTTPConnectionTests.response,
+                          path=os.path.join(self.tempdir, 'http.sock'))
+        conn = UnixHTTPConnection(path)
+        conn.timeout = 5
+        conn.request('GET', '/')
+        res = conn.getresponse()
+        self.assertEqual(res.status, 200)
+        self.assertEqual(res.read(), b'OK')
+
+class TCPProbeConnectionTests(unittest.TestCase):
+    def _makeOne(self, port, banner=None):
+        from superlance.timeoutconn import TCPProbeConnection
+        conn = TCPProbeConnection('127.0.0.1:%d' % port)
+        conn.timeout = 5
+        conn.banner = banner
+        return conn
+
+    def test_connect_only(self):
+        conn = self._makeOne(serve_once(b'', wait_request=False))
+        conn.request('GET', '/')
+        res = conn.getresponse()
+        self.assertEqual(res.status, 200)
+        self.assertEqual(res.read(), b'')
+
+    def test_banner(self):
+        port = serve_once(b'+OK ready\r\n', wait_request=False)
+        conn = self._makeOne(port, banner='+OK')
+        conn.request('GET', '/')
+        # read stops as soon as the banner shows up, and the server
+        # sends a byte at a time, so the rest may not have arrived
+        self.assertTrue(conn.getresponse().read().startswith(b'+OK'))
+
+    def test_connection_refused(self):
+        conn = self._makeOne(closed_port())
+        try:
+            conn.request('GET', '/')
+        except socket.error as e:
+            self.assertEqual(e.errno, errno.ECONNREFUSED)
+        else:
+            self.fail('connection not refused')
+
+if __name__ == '__main__':
+    unittest.main()
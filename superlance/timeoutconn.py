@@ -1,42 +1,209 @@
 from superlance.compat import httplib
+from superlance.compat import monotonic
+from supervisor.compat import as_bytes
+import io
 import socket
 
-class TimeoutHTTPConnection(httplib.HTTPConnection):
-    """A customised HTTPConnection allowing a per-connection
-    timeout, specified at construction."""
+class DeadlineExceeded(socket.timeout):
+    """Raised when a connection runs past its end-to-end deadline."""
+
+def _has_timeout(timeout):
+    # HTTPConnection defaults to socket._GLOBAL_DEFAULT_TIMEOUT, which
+    # is a sentinel object rather than a number of seconds.
+    return (isinstance(timeout, (int, float)) and
+            not isinstance(timeout, bool) and timeout > 0)
+
+def remaining_time(deadline):
+    """Return the seconds left before deadline, None if there is no
+    deadline, or raise DeadlineExceeded if it has passed."""
+    if deadline is None:
+        return None
+    remaining = deadline - monotonic()
+    if remaining <= 0:
+        raise DeadlineExceeded('deadline exceeded')
+    return remaining
+
+class DeadlineSocket(object):
+    """Wraps a socket so that every operation on it shares a single
+    deadline, instead of each operation getting the full timeout.  A
+    peer trickling one byte at a time cannot hold the connection open
+    past the deadline."""
+
+    def __init__(self, sock, deadline):
+        self._sock = sock
+        self.deadline = deadline
+
+    def _arm(self):
+        remaining = remaining_time(self.deadline)
+        if remaining is not None:
+            self._sock.settimeout(remaining)
+
+    def recv(self, *args):
+        self._arm()
+        return self._sock.recv(*args)
+
+    def recv_into(self, *args):
+        self._arm()
+        return self._sock.recv_into(*args)
+
+    def send(self, *args):
+        self._arm()
+        return self._sock.send(*args)
+
+    def sendall(self, *args):
+        self._arm()
+        return self._sock.sendall(*args)
+
+    def makefile(self, mode='r', bufsize=-1):
+        """Return a file object whose reads go through this wrapper, so
+        httplib's header and body reads honor the deadline."""
+        if hasattr(socket, 'SocketIO'):
+            # Python 3: keep the underlying socket's io refcount right so
+            # closing the connection doesn't close a pending response.
+            self._sock._io_refs += 1
+            raw = socket.SocketIO(self, mode.replace('b', '') + 'b')
+            if bufsize is None or bufsize < 0:
+                bufsize = io.DEFAULT_BUFFER_SIZE
+            return io.BufferedReader(raw, bufsize)
+        return socket._fileobject(self, mode, bufsize)
+
+    def __getattr__(self, name):
+        return getattr(self._sock, name)
+
+class DeadlineConnectionMixin:
+    """Connect logic shared by the connection classes below.  The
+    timeout is a deadline for the whole exchange (connect, request,
+    headers and body), starting from the first connection attempt."""
     timeout = None
+    deadline = None
 
-    def connect(self):
-        """Override HTTPConnection.connect to connect to
-        host/port specified in __init__."""
+    def start_deadline(self):
+        """Start the deadline clock if it isn't running yet and return
+        the deadline, or None if no timeout is set."""
+        if self.deadline is None and _has_timeout(self.timeout):
+            self.deadline = monotonic() + self.timeout
+        return self.deadline
 
-        e = "getaddrinfo returns an empty list"
+    def connect_socket(self):
+        """Connect to host/port specified in __init__ and return the
+        plain socket."""
+        deadline = self.start_deadline()
+        error = None
         for res in socket.getaddrinfo(self.host, self.port,
                 0, socket.SOCK_STREAM):
             af, socktype, proto, canonname, sa = res
+            sock = None
             try:
-                self.sock = socket.socket(af, socktype, proto)
-                if self.timeout:   # this is the new bit
-                    self.sock.settimeout(self.timeout)
-                self.sock.connect(sa)
+                sock = socket.socket(af, socktype, proto)
+                sock.settimeout(remaining_time(deadline))
+                sock.connect(sa)
             except socket.error as e:
-                if self.sock:
-                    self.sock.close()
-                self.sock = None
+                if sock:
+                    sock.close()
+                if isinstance(e, DeadlineExceeded):
+                    raise
+                error = e
                 continue
-            break
-        if not self.sock:
-            raise socket.error(e)
+            return sock
+        if error is not None:
+            # the error itself, so that callers can still tell a refused
+            # connection by its errno
+            raise error
+        raise socket.error("getaddrinfo returns an empty list")
 
-class TimeoutHTTPSConnection(httplib.HTTPSConnection):
-    timeout = None
+class TimeoutHTTPConnection(DeadlineConnectionMixin, httplib.HTTPConnection):
+    """A customised HTTPConnection allowing a per-connection
+    timeout, specified at construction."""
+
+    def connect(self):
+        """Override HTTPConnection.connect to connect to
+        host/port specified in __init__."""
+        self.sock = DeadlineSocket(self.connect_socket(), self.deadline)
+
+class TimeoutHTTPSConnection(DeadlineConnectionMixin, httplib.HTTPSConnection):
 
     def connect(self):
         "Connect to a host on a given (SSL) port."
 
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        if self.timeout:
-            self.sock.settimeout(self.timeout)
-        sock.connect((self.host, self.port))
-        ssl = socket.ssl(sock, self.key_file, self.cert_file)
-        self.sock = httplib.FakeSocket(sock, ssl)
+        sock = self.connect_socket()
+        if getattr(self, '_context', None) is not None:
+            sock = self._context.wrap_socket(sock, server_hostname=self.host)
+        else:
+            import ssl
+            sock = ssl.wrap_socket(sock, self.key_file, self.cert_file)
+        self.sock = DeadlineSocket(sock, self.deadline)
+
+class UnixHTTPConnection(TimeoutHTTPConnection):
+    """An HTTP connection to a server listening on a unix domain socket
+    at ``socket_path``.  Requests carry a Host header of localhost."""
+
+    def __init__(self, socket_path):
+        TimeoutHTTPConnection.__init__(self, 'localhost')
+        self.socket_path = socket_path
+
+    def connect_socket(self):
+        deadline = self.start_deadline()
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.settimeout(remaining_time(deadline))
+            sock.connect(self.socket_path)
+        except:
+            sock.close()
+            raise
+        return sock
+
+class TCPProbeResponse:
+    """The result of a successful TCP probe.  ``read`` returns the
+    server's banner if one is expected, reading until it shows up, the
+    server closes the connection or ``max_bytes`` have been read."""
+    status = 200
+    reason = 'Connected'
+    max_bytes = 64 * 1024
+
+    def __init__(self, sock, banner=None):
+        self.sock = sock
+        self.banner = banner
+
+    def read(self):
+        if not self.banner:
+            data = b''
+        else:
+            banner = as_bytes(self.banner)
+            data = b''
+            while banner not in data and len(data) < self.max_bytes:
+                chunk = self.sock.recv(4096)
+                if not chunk:
+                    break
+                data += chunk
+        self.sock.close()
+        return data
+
+class TCPProbeConnection(DeadlineConnectionMixin):
+    """A liveness probe for services that only expose a TCP port (raw
+    protocols, gRPC servers).  It implements just enough of the
+    HTTPConnection interface for httpok:  ``request`` connects to
+    ``host:port`` and ``getresponse`` returns a TCPProbeResponse.  Set
+    ``banner`` to require a string the server sends after accepting."""
+    response_class = TCPProbeResponse
+    banner = None
+
+    def __init__(self, hostport):
+        host, port = hostport.rsplit(':', 1)
+        self.host = host.strip('[]')
+        self.port = int(port)
+        self.sock = None
+
+    def connect(self):
+        self.sock = DeadlineSocket(self.connect_socket(), self.deadline)
+
+    def request(self, method, path, body=None, headers=None):
+        if self.sock is None:
+            self.connect()
+
+    def getresponse(self):
+        return self.response_class(self.sock, self.banner)
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None